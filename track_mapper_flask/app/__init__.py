@@ -1,23 +1,38 @@
 # app/__init__.py
 import os
+import logging
 from flask import Flask
 from .extensions import db
 from .routes import bp
 from .auth import auth_bp
+from .metrics import metrics_bp
+from .serialization import FastJSONProvider
+from . import instrumentation
 
 def create_app():
     app = Flask(__name__)
+    app.json = FastJSONProvider(app)
     # load config.py (or environment vars)
     app.config.from_pyfile('../config.py')
+    if not app.config.get('SECRET_KEY'):
+        # a public key would let anyone sign tokens for any user
+        if not (app.debug or app.testing):
+            raise RuntimeError("SECRET_KEY is not set; set it, or FLASK_DEBUG/TESTING for development")
+        app.config['SECRET_KEY'] = 'dev-secret-change-me'
+    # app.* loggers go to stderr (no-op if the server configured logging)
+    logging.basicConfig(level=app.config.get('LOG_LEVEL', 'INFO'),
+                        format='%(asctime)s %(levelname)s %(name)s: %(message)s')
     # ensure upload folder exists
     os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
     # initialize extensions
+    instrumentation.init_app(app)
     db.init_app(app)
 
     # register blueprints
     app.register_blueprint(bp)
     app.register_blueprint(auth_bp)
+    app.register_blueprint(metrics_bp)
 
     # create tables on first run
     with app.app_context():
@@ -2,6 +2,8 @@ from flask import Blueprint, request, jsonify
 from werkzeug.security import generate_password_hash, check_password_hash
 from .extensions import db
 from .models import User
+from .tokens import issue_token
+from .serializers import user_dict
 
 auth_bp = Blueprint('auth', __name__)
 
@@ -40,9 +42,8 @@ def register():
     db.session.add(u)
     db.session.commit()
 
-    # For simplicity, return a fake token and user payload
-    token = f"token-{u.id}"
-    return jsonify(token=token, user=u.to_dict()), 201
+    token = issue_token(u)
+    return jsonify(token=token, user=user_dict(u)), 201
 
 @auth_bp.route('/auth/login', methods=['POST'])
 def login():
@@ -56,18 +57,15 @@ def login():
     if not u or not check_password_hash(u.password_hash, password):
         return jsonify(error='invalid credentials'), 401
 
-    token = f"token-{u.id}"
-    return jsonify(token=token, user=u.to_dict())
+    token = issue_token(u)
+    return jsonify(token=token, user=user_dict(u))
 
 
 @auth_bp.route('/auth/google', methods=['POST'])
 def google_login():
-    print("google_login")
     data = request.get_json() or {}
     email = data.get('email')
     google_id = data.get('google_id')
-    print("email", email)
-    print("google_id", google_id)
     firstname = data.get('firstname', '')
     lastname = data.get('lastname', '')
     username = data.get('username') or (email.split('@')[0] if email else None)
@@ -97,6 +95,6 @@ def google_login():
         db.session.add(u)
 
     db.session.commit()
-    token = f"token-{u.id}"
-    return jsonify(token=token, user=u.to_dict())
+    token = issue_token(u)
+    return jsonify(token=token, user=user_dict(u))
 
@@ -0,0 +1,133 @@
+# app/caching.py
+"""
+Conditional GET and body caching for per-user, read-mostly endpoints.
+
+User.data_version is bumped (bump_data_version) in the same transaction
+as every write that changes what those endpoints return: creating or
+deleting a map or activity, and profile updates. @versioned_by_user reads
+the version with one primary-key lookup and derives a weak ETag from it
+plus the endpoint, query string and Accept header, so:
+
+  - a matching If-None-Match gets a 304 before the handler runs
+  - otherwise the serialized body is served from a per-worker LRU keyed
+    by that ETag when present (RESPONSE_CACHE_SIZE entries, 0 disables)
+
+Friendships are edited outside the API; rebuild_timelines.py bumps the
+version of every user it rebuilds so profile friend lists refresh.
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+from functools import wraps
+
+from flask import current_app, request, make_response
+from sqlalchemy import select, update
+
+from .extensions import db
+from .models import User
+
+
+def bump_data_version(user_id):
+    """Invalidates cached responses for a user; the caller commits."""
+    db.session.execute(
+        update(User)
+        .where(User.id == user_id)
+        .values(data_version=User.data_version + 1)
+        .execution_options(synchronize_session=False)
+    )
+
+
+class ResponseCache:
+    def __init__(self, max_entries=1024, max_body_size=256 * 1024):
+        self.max_entries = max_entries
+        self.max_body_size = max_body_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, body, mimetype):
+        if self.max_entries <= 0 or len(body) > self.max_body_size:
+            return
+        with self._lock:
+            self._entries[key] = (body, mimetype)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_response_cache():
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ResponseCache(
+                    current_app.config.get('RESPONSE_CACHE_SIZE', 1024),
+                    current_app.config.get('RESPONSE_CACHE_MAX_BODY', 256 * 1024),
+                )
+    return _cache
+
+
+def _etag(user_id, version):
+    variant = hashlib.sha1('|'.join((
+        request.endpoint or '',
+        request.query_string.decode('latin-1'),
+        request.headers.get('Accept', ''),
+    )).encode('utf-8')).hexdigest()[:16]
+    return f"{user_id.hex}-{version}-{variant}"
+
+
+def _finish(resp, etag):
+    resp.set_etag(etag, weak=True)
+    # clients may store it but must revalidate, which is a cheap 304
+    resp.headers['Cache-Control'] = 'private, no-cache'
+    resp.vary.add('Accept')
+    return resp
+
+
+def versioned_by_user(func):
+    """For GET handlers taking a `user_id` that only return that user's data."""
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        user_id = kwargs['user_id']
+        version = db.session.execute(
+            select(User.data_version).where(User.id == user_id)
+        ).scalar()
+        if version is None:
+            # unknown user: let the handler produce its 404
+            return func(*args, **kwargs)
+
+        etag = _etag(user_id, version)
+        if request.if_none_match.contains_weak(etag):
+            return _finish(current_app.response_class(status=304), etag)
+
+        cache = get_response_cache()
+        cached = cache.get(etag) if cache.max_entries > 0 else None
+        if cached is not None:
+            body, mimetype = cached
+            return _finish(current_app.response_class(body, mimetype=mimetype), etag)
+
+        resp = make_response(func(*args, **kwargs))
+        if resp.status_code != 200:
+            return resp
+        cache.put(etag, resp.get_data(), resp.mimetype)
+        return _finish(resp, etag)
+    return wrapper
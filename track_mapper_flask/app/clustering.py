@@ -0,0 +1,211 @@
+# app/clustering.py
+"""
+Viewport queries over maps, with server-side clustering.
+
+MapCell holds, for every geohash prefix of length 1 to MAX_PRECISION that
+contains a map, the number of maps, the sums of their coordinates (for
+the centroid) and the most recently uploaded one as its representative.
+create_map adds a map to its cells and delete_map removes it, in the same
+transaction, with upserts that add to the counters (deleting a cell's
+representative looks up the next most recent map in it);
+rebuild_map_cells.py recomputes the table from Map rows.
+
+maps_in_bbox answers a viewport given in real latitudes and longitudes;
+Map rows hold them swapped (see maps_nearest) and Map.geohash is the
+geohash of the columns folded over the pole (app/spatial.py), so the box
+is swapped and folded into up to three boxes of geohash space first.
+Zoomed in (MAP_CLUSTER_MAX_ZOOM and deeper) it returns the maps
+themselves from Map.geohash range scans, up to MAP_BBOX_MAX_MAPS; zoomed
+out, or when more maps are in view, it returns one cluster per cell at a
+precision picked from the zoom, read by primary key from MapCell.
+Neither path reads more than a fixed number of rows, however many maps
+are in view: at most MAP_CLUSTER_MAX_CELLS cells, coarsening the
+precision until the viewport fits. Centroids use the same (swapped)
+latitude/longitude as the maps.
+"""
+from sqlalchemy import select, delete, update, insert, func, case, literal, or_, and_, tuple_
+from sqlalchemy.dialects.postgresql import insert as pg_insert, aggregate_order_by
+from sqlalchemy.orm import joinedload
+from flask import current_app
+
+from .extensions import db
+from .models import Map, MapCell
+from .spatial import bbox_cells, cell_ranges
+
+MAX_PRECISION = 8
+
+
+def _lat_bits(precision):
+    """Latitude bits of a geohash: 1 -> 2, 2 -> 5, ... 8 -> 20."""
+    return 5 * precision // 2
+
+
+def _config(name, default):
+    return current_app.config.get(name, default)
+
+
+def add_map(m):
+    """Counts a flushed map in its cells; the caller commits."""
+    if not m.geohash:
+        return
+    rows = [
+        {'precision': p, 'cell': m.geohash[:p], 'count': 1,
+         'sum_lat': m.latitude, 'sum_lon': m.longitude,
+         'rep_id': m.id, 'rep_uploaded_at': m.uploaded_at}
+        for p in range(1, MAX_PRECISION + 1)
+    ]
+    stmt = pg_insert(MapCell).values(rows)
+    newer = stmt.excluded.rep_uploaded_at >= MapCell.rep_uploaded_at
+    db.session.execute(stmt.on_conflict_do_update(
+        index_elements=[MapCell.precision, MapCell.cell],
+        set_={
+            'count': MapCell.count + stmt.excluded.count,
+            'sum_lat': MapCell.sum_lat + stmt.excluded.sum_lat,
+            'sum_lon': MapCell.sum_lon + stmt.excluded.sum_lon,
+            'rep_id': case((newer, stmt.excluded.rep_id), else_=MapCell.rep_id),
+            'rep_uploaded_at': case((newer, stmt.excluded.rep_uploaded_at), else_=MapCell.rep_uploaded_at),
+        },
+    ))
+
+
+def remove_map(m):
+    """Uncounts a map that is being deleted; the caller commits."""
+    if not m.geohash:
+        return
+    in_cells = tuple_(MapCell.precision, MapCell.cell).in_(
+        [(p, m.geohash[:p]) for p in range(1, MAX_PRECISION + 1)]
+    )
+    db.session.execute(
+        update(MapCell)
+        .where(in_cells)
+        .values(count=MapCell.count - 1,
+                sum_lat=MapCell.sum_lat - m.latitude,
+                sum_lon=MapCell.sum_lon - m.longitude)
+        .execution_options(synchronize_session=False)
+    )
+    db.session.execute(delete(MapCell).where(in_cells, MapCell.count <= 0)
+                       .execution_options(synchronize_session=False))
+
+    # cells it represented fall back to their next most recent map
+    for cell in db.session.execute(
+        select(MapCell).where(in_cells, MapCell.rep_id == m.id)
+    ).scalars():
+        rep = db.session.execute(
+            select(Map.id, Map.uploaded_at)
+            .where(*cell_ranges([cell.cell]), Map.id != m.id)
+            .order_by(Map.uploaded_at.desc())
+            .limit(1)
+        ).first()
+        cell.rep_id, cell.rep_uploaded_at = rep if rep else (None, None)
+
+
+def rebuild_map_cells():
+    """Recomputes MapCell from every Map row; the caller commits."""
+    db.session.execute(delete(MapCell))
+    for p in range(1, MAX_PRECISION + 1):
+        cell = func.substr(Map.geohash, 1, p)
+        latest = func.array_agg(aggregate_order_by(Map.id, Map.uploaded_at.desc(), Map.id))
+        db.session.execute(insert(MapCell).from_select(
+            ['precision', 'cell', 'count', 'sum_lat', 'sum_lon', 'rep_id', 'rep_uploaded_at'],
+            select(literal(p), cell, func.count(), func.sum(Map.latitude), func.sum(Map.longitude),
+                   latest[1], func.max(Map.uploaded_at))
+            .where(Map.geohash.isnot(None))
+            .group_by(cell),
+        ))
+
+
+def _cluster_precision(zoom):
+    """Finest precision whose cells span at least a quarter of a web-map tile's longitudes at `zoom`."""
+    if zoom is None:
+        return MAX_PRECISION
+    # real longitudes run along the geohash latitude: 180 / 2**lat_bits degrees
+    fitting = [p for p in range(1, MAX_PRECISION + 1) if _lat_bits(p) <= zoom + 1]
+    return fitting[-1] if fitting else 1
+
+
+def _folded_boxes(min_lat, min_lon, max_lat, max_lon):
+    """
+    Boxes of geohash space (as for bbox_cells) holding the maps in a real
+    box: a real longitude x is stored as a latitude and folds to x within
+    +/-90, to 180 - x east of 90 and to -180 - x west of -90 (with the
+    real latitude moved to the opposite meridian).
+    """
+    lon_spans = [(min_lon, max_lon)] if min_lon <= max_lon else [(min_lon, 180.0), (-180.0, max_lon)]
+    opposite = ((min_lat + 360.0) % 360.0 - 180.0, (max_lat + 360.0) % 360.0 - 180.0)
+    boxes = []
+    for lo, hi in lon_spans:
+        if lo <= 90.0 and hi >= -90.0:
+            boxes.append((max(lo, -90.0), min_lat, min(hi, 90.0), max_lat))
+        if hi > 90.0:
+            boxes.append((180.0 - hi, opposite[0], 180.0 - max(lo, 90.0), opposite[1]))
+        if lo < -90.0:
+            boxes.append((-180.0 - min(hi, -90.0), opposite[0], -180.0 - lo, opposite[1]))
+    return boxes
+
+
+def _cells(box, precision, limit=None):
+    """Geohashes at `precision` covering a real box, or None if there are more than `limit`."""
+    cells = set()
+    for folded in _folded_boxes(*box):
+        found = bbox_cells(*folded, precision, limit=limit)
+        if found is None:
+            return None
+        cells.update(found)
+    if limit is not None and len(cells) > limit:
+        return None
+    return sorted(cells)
+
+
+def _in_box(min_lat, min_lon, max_lat, max_lon):
+    # swapped columns: Map.latitude is the real longitude
+    lon_ok = (and_(Map.latitude >= min_lon, Map.latitude <= max_lon) if min_lon <= max_lon
+              else or_(Map.latitude >= min_lon, Map.latitude <= max_lon))
+    return and_(Map.longitude >= min_lat, Map.longitude <= max_lat, lon_ok)
+
+
+def _maps(box, limit):
+    """Up to `limit` maps inside the box, newest first, or None if there are more."""
+    # the finest precision whose covering cells stay a short list of ranges
+    # (precision 1 has 32 cells in all)
+    for p in range(MAX_PRECISION, 0, -1):
+        cells = _cells(box, p, limit=32)
+        if cells is not None:
+            break
+    # no ORDER BY, so the scan stops after limit + 1 rows
+    maps = (
+        Map.query
+        .options(joinedload(Map.user))
+        .filter(or_(*cell_ranges(cells)), _in_box(*box))
+        .limit(limit + 1)
+        .all()
+    )
+    if len(maps) > limit:
+        return None
+    return sorted(maps, key=lambda m: (m.uploaded_at, m.id.hex), reverse=True)
+
+
+def _clusters(box, zoom):
+    max_cells = _config('MAP_CLUSTER_MAX_CELLS', 1024)
+    for p in range(_cluster_precision(zoom), 0, -1):
+        cells = _cells(box, p, limit=max_cells)
+        if cells is not None:
+            break
+    else:
+        p, cells = 1, _cells(box, 1)
+    clusters = db.session.execute(
+        select(MapCell).where(MapCell.precision == p, MapCell.cell.in_(cells)).order_by(MapCell.cell)
+    ).scalars().all()
+    return p, clusters
+
+
+def maps_in_bbox(min_lat, min_lon, max_lat, max_lon, zoom=None):
+    """
+    ('maps', [Map]) when zoomed in and no more than MAP_BBOX_MAX_MAPS are
+    in the real box, else ('clusters', precision, [MapCell]).
+    """
+    box = (min_lat, min_lon, max_lat, max_lon)
+    if zoom is not None and zoom >= _config('MAP_CLUSTER_MAX_ZOOM', 12):
+        maps = _maps(box, _config('MAP_BBOX_MAX_MAPS', 500))
+        if maps is not None:
+            return ('maps', maps)
+    return ('clusters', *_clusters(box, zoom))
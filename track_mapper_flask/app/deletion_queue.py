@@ -0,0 +1,204 @@
+# app/deletion_queue.py
+"""
+Storage deletion outbox.
+
+delete_map and delete_activity record the objects they free as
+PendingDeletion rows in the same transaction as the row deletes
+(storage.delete_file_later / delete_folder_later), so a failed commit
+loses no files and a committed delete cannot be forgotten.
+storage_worker.py drains the rows:
+
+  - due rows are claimed with FOR UPDATE SKIP LOCKED, so several workers
+    can run side by side, and removed with one S3 delete_objects call per
+    1000 keys (or unlinks for LOCAL)
+  - a failed key stays queued with attempts + 1 and is retried after an
+    exponential backoff (DELETION_RETRY_BASE doubling up to
+    DELETION_RETRY_MAX seconds)
+  - a blob that was referenced again after being queued is kept
+
+reconcile() covers objects that were orphaned some other way (crashes
+before this existed, manual edits): it lists the upload folders and
+reports, or queues, objects whose owning row is gone.
+"""
+import uuid
+import logging
+from datetime import datetime, timezone, timedelta
+
+from flask import current_app
+from sqlalchemy import select, func
+
+from .extensions import db
+from .models import Map, Activity, StoredBlob, StoredFile, PendingDeletion
+from .storage import (
+    CONTENT_ADDRESSED_FOLDERS, delete_objects, delete_folder, delete_file_later, list_objects,
+)
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 1000
+
+# upload folders and the model whose id names the objects in them
+OWNERS = {
+    'images': Map,
+    'points': Map,
+    'tiles': Map,
+    'thumbnails': Map,
+    'activities': Activity,
+    'tracks': Activity,
+}
+
+# folders holding one subfolder per owner, deleted as a whole
+PREFIX_FOLDERS = {'tiles', 'tracks'}
+
+
+def _retry_delay(attempts):
+    base = current_app.config.get('DELETION_RETRY_BASE', 30)
+    cap = current_app.config.get('DELETION_RETRY_MAX', 3600)
+    return timedelta(seconds=min(cap, base * 2 ** min(attempts - 1, 20)))
+
+
+def drain_batch(batch_size=BATCH_SIZE):
+    """
+    Claims up to batch_size due rows, deletes their objects and commits.
+    Returns (deleted, failed) row counts.
+    """
+    now = datetime.now(timezone.utc)
+    rows = db.session.execute(
+        select(PendingDeletion)
+        .where(PendingDeletion.not_before <= now)
+        .order_by(PendingDeletion.not_before, PendingDeletion.id)
+        .limit(batch_size)
+        .with_for_update(skip_locked=True)
+    ).scalars().all()
+    if not rows:
+        db.session.commit()
+        return 0, 0
+
+    keys = [r.key for r in rows if not r.is_prefix]
+    digests = [k.rsplit('/', 1)[1] for k in keys if k.startswith('blobs/')]
+    live = set()
+    if digests:
+        live = {f"blobs/{h[:2]}/{h}" for h in db.session.execute(
+            select(StoredBlob.hash).where(StoredBlob.hash.in_(digests))
+        ).scalars()}
+    errors = delete_objects([k for k in keys if k not in live])
+
+    for r in rows:
+        if not r.is_prefix:
+            continue
+        try:
+            prefix_errors = delete_objects([k for k, _ in list_objects(r.key)])
+        except Exception as e:
+            prefix_errors = {r.key: str(e)}
+        if prefix_errors:
+            errors[r.key] = next(iter(prefix_errors.values()))
+        else:
+            delete_folder(r.key)  # drops the emptied LOCAL directories
+
+    failed = 0
+    for r in rows:
+        error = errors.get(r.key)
+        if error is None:
+            db.session.delete(r)
+            continue
+        failed += 1
+        r.attempts += 1
+        r.last_error = error[:1000]
+        r.not_before = now + _retry_delay(r.attempts)
+        logger.warning("Deleting %s failed (attempt %d): %s", r.key, r.attempts, error)
+    db.session.commit()
+    return len(rows) - failed, failed
+
+
+def backlog():
+    """(queued rows, rows that have failed at least once)"""
+    return tuple(db.session.execute(
+        select(func.count(), func.count().filter(PendingDeletion.attempts > 0))
+    ).one())
+
+
+def _owner_id(key):
+    # '<folder>/<id>.<ext>' or '<folder>/<id>/...'
+    name = key.split('/', 1)[1].split('/', 1)[0].split('.', 1)[0]
+    try:
+        return uuid.UUID(name)
+    except ValueError:
+        return None
+
+
+def _existing(model, ids):
+    return set(db.session.execute(select(model.id).where(model.id.in_(ids))).scalars())
+
+
+def _orphans_in(folder, objects):
+    """Keys among `objects` (all under `folder`) that nothing references."""
+    orphans = []
+    if folder == 'blobs':
+        by_digest = {key.rsplit('/', 1)[1]: key for key in objects}
+        live = set(db.session.execute(
+            select(StoredBlob.hash).where(StoredBlob.hash.in_(list(by_digest)))
+        ).scalars())
+        return [key for digest, key in by_digest.items() if digest not in live]
+
+    ids = {key: _owner_id(key) for key in objects}
+    unknown = [key for key, owner in ids.items() if owner is None]
+    for key in unknown:
+        logger.info("Skipping unrecognized object %s", key)
+    owners = _existing(OWNERS[folder], {o for o in ids.values() if o is not None})
+    renamed = set()
+    if folder in CONTENT_ADDRESSED_FOLDERS:
+        # names moved to a blob no longer read their original object
+        renamed = set(db.session.execute(
+            select(StoredFile.path).where(StoredFile.path.in_(list(ids)))
+        ).scalars())
+    for key, owner in ids.items():
+        if owner is not None and (owner not in owners or key in renamed):
+            orphans.append(key)
+    return orphans
+
+
+def _orphan_names():
+    """StoredFile names whose map or activity is gone."""
+    names = []
+    for folder in sorted(CONTENT_ADDRESSED_FOLDERS):
+        paths = db.session.execute(
+            select(StoredFile.path).where(StoredFile.path.like(f"{folder}/%"))
+        ).scalars().all()
+        for start in range(0, len(paths), BATCH_SIZE):
+            chunk = paths[start:start + BATCH_SIZE]
+            ids = {p: _owner_id(p) for p in chunk}
+            owners = _existing(OWNERS[folder], {o for o in ids.values() if o is not None})
+            names.extend(p for p, o in ids.items() if o is not None and o not in owners)
+    return names
+
+
+def reconcile(folders=None, min_age=timedelta(hours=24), fix=False):
+    """
+    Finds orphaned objects in the upload folders, plus content-addressed
+    names whose owner is gone. Objects newer than `min_age` are left alone,
+    as their row may not be committed yet. With fix=True both are queued
+    for deletion. Returns (orphan keys, orphan names).
+    """
+    folders = folders or sorted(OWNERS) + ['blobs']
+    cutoff = datetime.now(timezone.utc) - min_age
+    queued = set(db.session.execute(select(PendingDeletion.key)).scalars())
+
+    orphans = []
+    for folder in folders:
+        objects = [key for key, modified in list_objects(folder) if modified < cutoff]
+        if folder in PREFIX_FOLDERS:
+            # one entry per owner, deleted as a folder
+            objects = sorted({'/'.join(key.split('/', 2)[:2]) for key in objects})
+        objects = [key for key in objects if key not in queued]
+        for start in range(0, len(objects), BATCH_SIZE):
+            orphans.extend(_orphans_in(folder, objects[start:start + BATCH_SIZE]))
+
+    names = _orphan_names()
+    if fix:
+        for key in orphans:
+            db.session.add(PendingDeletion(key=key, is_prefix=key.split('/', 1)[0] in PREFIX_FOLDERS))
+        for path in names:
+            folder, filename = path.split('/', 1)
+            delete_file_later(folder, filename)
+        db.session.commit()
+    return orphans, names
@@ -0,0 +1,104 @@
+# app/instrumentation.py
+"""
+Per-request SQL query counting and timing, and the request, SQL and
+connection pool metrics served at /metrics (app/metrics.py).
+
+Every statement executed inside an app context adds to g.query_count and
+g.query_time. After each request the totals are logged, and they are
+returned as X-Query-Count / X-Query-Time (milliseconds) headers when the
+app runs in debug mode or QUERY_STATS_HEADERS is set, so a test can assert
+how many queries an endpoint issues:
+
+    r = client.get(f'/users/{uid}/profile')
+    assert int(r.headers['X-Query-Count']) <= 2
+"""
+import time
+import logging
+
+from flask import g, request, current_app, has_app_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import QueuePool
+
+from .metrics import REQUEST_LATENCY, REQUEST_QUERIES, SQL_LATENCY, SQL_ERRORS, POOL_WAIT
+
+QUERY_COUNT_HEADER = 'X-Query-Count'
+QUERY_TIME_HEADER = 'X-Query-Time'
+
+logger = logging.getLogger(__name__)
+
+
+def query_stats():
+    """(query count, seconds spent in queries) for the current app context."""
+    return g.get('query_count', 0), g.get('query_time', 0.0)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_start'].pop()
+    SQL_LATENCY.observe(elapsed)
+    if has_app_context():
+        g.query_count = g.get('query_count', 0) + 1
+        g.query_time = g.get('query_time', 0.0) + elapsed
+
+
+def _handle_error(context):
+    SQL_ERRORS.inc()
+    starts = context.connection.info.get('query_start') if context.connection else None
+    if starts:
+        starts.pop()
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that records how long each checkout waited for a connection."""
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            POOL_WAIT.observe(time.perf_counter() - start)
+
+
+def _before_request():
+    g.request_start = time.perf_counter()
+
+
+def _after_request(response):
+    count, seconds = query_stats()
+    endpoint = request.endpoint or 'unmatched'
+    if 'request_start' in g:
+        REQUEST_LATENCY.observe(time.perf_counter() - g.request_start, endpoint=endpoint,
+                                method=request.method, status=response.status_code)
+    REQUEST_QUERIES.observe(count, endpoint=endpoint)
+    if current_app.debug or current_app.config.get('QUERY_STATS_HEADERS'):
+        response.headers[QUERY_COUNT_HEADER] = str(count)
+        response.headers[QUERY_TIME_HEADER] = f'{seconds * 1000:.2f}'
+    warn_at = current_app.config.get('QUERY_COUNT_WARN', 0)
+    level = logging.WARNING if warn_at and count >= warn_at else logging.DEBUG
+    logger.log(level, "%s %s: %d queries in %.1f ms",
+               request.method, request.path, count, seconds * 1000)
+    return response
+
+
+_listening = False
+
+
+def init_app(app):
+    """Call before db.init_app(app) so the engine is built with TimedQueuePool."""
+    global _listening
+    uri = app.config.get('SQLALCHEMY_DATABASE_URI') or ''
+    options = app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', {})
+    if not uri.startswith('sqlite') and 'poolclass' not in options:
+        options['poolclass'] = TimedQueuePool
+
+    if not _listening:
+        # listen on every engine so binds added later are counted too
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+        event.listen(Engine, 'handle_error', _handle_error)
+        _listening = True
+    app.before_request(_before_request)
+    app.after_request(_after_request)
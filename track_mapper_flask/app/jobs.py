@@ -0,0 +1,191 @@
+# app/jobs.py
+"""
+Background jobs in a Postgres table, so no broker is needed.
+
+Request handlers call enqueue() before their commit: the job row lands in
+the same transaction as the rows it works on, and an idempotency key
+makes enqueueing the same work twice return the existing job. worker.py
+claims due jobs with FOR UPDATE SKIP LOCKED (several workers can run side
+by side) and runs them in a process pool, since the work is CPU-bound
+(image tiling, spline fits, GPX parsing).
+
+A claimed job holds a lease of JOB_LEASE seconds; if its worker dies the
+job is claimed again once the lease runs out, or marked failed if that
+was its last attempt. A job that raises is retried after a backoff
+(JOB_RETRY_BASE doubling up to JOB_RETRY_MAX seconds) until it has run
+max_attempts times, then marked failed. Task functions therefore must be
+safe to run more than once.
+
+With JOBS_INLINE set (development, tests) jobs run in the request process
+right after the handler returns, once its transaction has committed.
+
+Task functions are registered with @task in app/tasks.py; they take the
+job payload as keyword arguments and return a JSON-able result.
+"""
+import uuid
+import logging
+from datetime import datetime, timezone, timedelta
+
+from flask import current_app, has_request_context, after_this_request
+from sqlalchemy import select, update, func, or_, and_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from .extensions import db
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+QUEUED, RUNNING, SUCCEEDED, FAILED = 'queued', 'running', 'succeeded', 'failed'
+
+TASKS = {}
+
+
+def task(name):
+    """Registers a function as the handler for jobs of kind `name`."""
+    def register(func):
+        TASKS[name] = func
+        return func
+    return register
+
+
+def _handler(kind):
+    from . import tasks  # noqa: F401 - registers the handlers
+    return TASKS[kind]
+
+
+def _now():
+    return datetime.now(timezone.utc)
+
+
+def enqueue(kind, payload, idempotency_key=None, user_id=None):
+    """Adds a job to the caller's transaction and returns its id; the caller commits."""
+    job_id = db.session.execute(
+        pg_insert(Job)
+        .values(
+            id=uuid.uuid4(),
+            kind=kind,
+            payload=payload,
+            idempotency_key=idempotency_key,
+            user_id=user_id,
+            max_attempts=current_app.config.get('JOB_MAX_ATTEMPTS', 5),
+            status=QUEUED,
+            attempts=0,
+            run_after=_now(),
+        )
+        .on_conflict_do_nothing(index_elements=[Job.idempotency_key])
+        .returning(Job.id)
+    ).scalar()
+    if job_id is None:
+        return db.session.execute(
+            select(Job.id).where(Job.idempotency_key == idempotency_key)
+        ).scalar()
+
+    if current_app.config.get('JOBS_INLINE') and has_request_context():
+        @after_this_request
+        def run_now(response):
+            for claimed in claim(job_ids=[job_id]):
+                run_job(*claimed)
+            return response
+    return job_id
+
+
+def claim(limit=1, job_ids=None):
+    """
+    Marks up to `limit` due jobs (or the given ones) running under a lease
+    and commits. Returns [(job_id, kind, payload)].
+    """
+    now = _now()
+    expired = and_(Job.status == RUNNING, Job.locked_until < now)
+
+    # a job whose process died on its last attempt (e.g. killed for memory)
+    # never got to record a failure
+    exhausted = update(Job).where(expired, Job.attempts >= Job.max_attempts)
+    if job_ids is not None:
+        exhausted = exhausted.where(Job.id.in_(job_ids))
+    db.session.execute(
+        exhausted
+        .values(status=FAILED, finished_at=now, locked_until=None,
+                last_error=func.coalesce(Job.last_error, 'Lease expired on the last attempt'))
+        .execution_options(synchronize_session=False)
+    )
+
+    due = or_(
+        and_(Job.status == QUEUED, Job.run_after <= now),
+        and_(expired, Job.attempts < Job.max_attempts),
+    )
+    picked = select(Job.id).where(due)
+    if job_ids is not None:
+        picked = picked.where(Job.id.in_(job_ids))
+    picked = picked.order_by(Job.run_after).limit(limit if job_ids is None else len(job_ids))
+    lease = timedelta(seconds=current_app.config.get('JOB_LEASE', 600))
+    rows = db.session.execute(
+        update(Job)
+        .where(Job.id.in_(picked.with_for_update(skip_locked=True).scalar_subquery()))
+        .values(status=RUNNING, attempts=Job.attempts + 1, started_at=now, locked_until=now + lease)
+        .returning(Job.id, Job.kind, Job.payload)
+        .execution_options(synchronize_session=False)
+    ).all()
+    db.session.commit()
+    return [tuple(r) for r in rows]
+
+
+def _retry_delay(attempts):
+    base = current_app.config.get('JOB_RETRY_BASE', 10)
+    cap = current_app.config.get('JOB_RETRY_MAX', 3600)
+    return timedelta(seconds=min(cap, base * 2 ** min(attempts - 1, 20)))
+
+
+def run_job(job_id, kind, payload):
+    """
+    Runs a claimed job and records the outcome. The task's writes and the
+    job's success are committed together. Returns True on success.
+    """
+    try:
+        result = _handler(kind)(**payload)
+        db.session.execute(
+            update(Job)
+            .where(Job.id == job_id)
+            .values(status=SUCCEEDED, result=result, last_error=None,
+                    finished_at=_now(), locked_until=None)
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+        return True
+    except Exception as e:
+        db.session.rollback()
+        logger.exception("Job %s (%s) failed", job_id, kind)
+        _record_failure(job_id, f"{type(e).__name__}: {e}")
+        return False
+
+
+def _record_failure(job_id, error):
+    job = db.session.get(Job, job_id)
+    if job is None:
+        return
+    now = _now()
+    job.last_error = error[:2000]
+    job.locked_until = None
+    if job.attempts >= job.max_attempts:
+        job.status = FAILED
+        job.finished_at = now
+    else:
+        job.status = QUEUED
+        job.run_after = now + _retry_delay(job.attempts)
+    db.session.commit()
+
+
+# --- process pool entry points (worker.py) --------------------------------
+
+_process_app = None
+
+
+def init_process():
+    """ProcessPoolExecutor initializer: one app, engine and S3 client per process."""
+    global _process_app
+    from . import create_app
+    _process_app = create_app()
+
+
+def run_in_process(job_id, kind, payload):
+    with _process_app.app_context():
+        return run_job(job_id, kind, payload)
@@ -0,0 +1,141 @@
+# app/matching.py
+"""
+Matching activities to the maps they were recorded on.
+
+Every Map stores the bounding box of its control points' real coordinates
+(set_map_extent, from the points JSON), indexed as a Postgres box with
+GiST so overlap (&&) searches do not scan the table. A candidate map's
+`coverage` of an activity is the fraction of the activity's bounding box
+(Activity.bbox, from the GPX stats) inside the map's extent; along an
+axis where the track has no extent it counts as 1 if it overlaps at all.
+Candidates rank by coverage, then the activity owner's own maps, then
+the smaller map.
+
+process_activity attaches the best candidate to activities uploaded
+without a map when its coverage is at least ACTIVITY_MATCH_MIN_COVERAGE
+(ACTIVITY_AUTO_MATCH turns this off); /activities/<id>/maps lists the
+candidates for the client to suggest. match_activities.py fills in the
+extents of older maps and matches historical activities in bulk. Boxes
+do not wrap the antimeridian.
+"""
+import numpy as np
+from flask import current_app
+from sqlalchemy import select, update, func, case, and_, literal, Float
+
+from .extensions import db
+from .models import Map, Activity
+from .spline import parse_pairs
+
+
+def _box(min_lat, min_lon, max_lat, max_lon):
+    return func.box(func.point(min_lon, min_lat), func.point(max_lon, max_lat))
+
+
+# same expression as the ix_map_extent index
+map_extent = _box(Map.min_lat, Map.min_lon, Map.max_lat, Map.max_lon)
+
+
+def _axis_coverage(lo, hi, map_lo, map_hi):
+    overlap = func.greatest(func.least(hi, map_hi) - func.greatest(lo, map_lo), 0.0)
+    return case((hi > lo, overlap / (hi - lo)), else_=1.0)
+
+
+def _coverage(min_lat, min_lon, max_lat, max_lon):
+    return (_axis_coverage(min_lat, max_lat, Map.min_lat, Map.max_lat)
+            * _axis_coverage(min_lon, max_lon, Map.min_lon, Map.max_lon))
+
+
+def _rank(coverage, user_id):
+    map_area = (Map.max_lat - Map.min_lat) * (Map.max_lon - Map.min_lon)
+    return (coverage.desc(), (Map.user_id == user_id).desc(), map_area, Map.id)
+
+
+def _min_coverage():
+    return current_app.config.get('ACTIVITY_MATCH_MIN_COVERAGE', 0.5)
+
+
+def extent_of(points):
+    """(min_lat, min_lon, max_lat, max_lon) of a points JSON document, or None."""
+    try:
+        real, _ = parse_pairs(points)
+    except (ValueError, KeyError, TypeError):
+        return None
+    if len(real) == 0 or not np.isfinite(real).all():
+        return None
+    (min_lat, min_lon), (max_lat, max_lon) = real.min(axis=0), real.max(axis=0)
+    return float(min_lat), float(min_lon), float(max_lat), float(max_lon)
+
+
+def set_map_extent(m, points):
+    """Stores a map's extent from its control points (NULL if it has none)."""
+    m.min_lat, m.min_lon, m.max_lat, m.max_lon = extent_of(points) or (None, None, None, None)
+
+
+def candidate_maps(act, limit=5, min_coverage=0.0):
+    """(Map, coverage) pairs overlapping an activity's bounding box, best first."""
+    if act.bbox is None:
+        return []
+    coverage = _coverage(*(literal(v, Float) for v in act.bbox))
+    return (
+        Map.query
+        .add_columns(coverage.label('coverage'))
+        .filter(map_extent.op('&&')(_box(*act.bbox)), coverage > 0, coverage >= min_coverage)
+        .order_by(*_rank(coverage, act.user_id))
+        .limit(limit)
+        .all()
+    )
+
+
+def auto_match(act):
+    """Attaches the best map to an activity without one; returns its id or None. The caller commits."""
+    if act.map_id is not None or not current_app.config.get('ACTIVITY_AUTO_MATCH', True):
+        return None
+    best = candidate_maps(act, limit=1, min_coverage=_min_coverage())
+    if not best:
+        return None
+    act.map_id = best[0][0].id
+    return act.map_id
+
+
+def match_batch(after_id=None, batch_size=1000, min_coverage=None):
+    """
+    Attaches the best map to the next `batch_size` activities (by id, after
+    `after_id`) that have a bounding box but no map, in one UPDATE.
+    Returns (ids scanned, empty when done, [(activity_id, user_id, map_id)]);
+    the caller commits.
+    """
+    if min_coverage is None:
+        min_coverage = _min_coverage()
+    q = select(Activity.id).where(Activity.map_id.is_(None), Activity.min_lat.isnot(None))
+    if after_id is not None:
+        q = q.where(Activity.id > after_id)
+    ids = db.session.execute(q.order_by(Activity.id).limit(batch_size)).scalars().all()
+    if not ids:
+        return [], []
+
+    coverage = _coverage(Activity.min_lat, Activity.min_lon, Activity.max_lat, Activity.max_lon)
+    best = (
+        select(Activity.id.label('activity_id'), Map.id.label('map_id'))
+        .join(Map, map_extent.op('&&')(_box(Activity.min_lat, Activity.min_lon,
+                                            Activity.max_lat, Activity.max_lon)))
+        .where(Activity.id.in_(ids), coverage > 0, coverage >= min_coverage)
+        .order_by(Activity.id, *_rank(coverage, Activity.user_id))
+        .distinct(Activity.id)
+        .subquery()
+    )
+    matched = db.session.execute(
+        update(Activity)
+        .where(and_(Activity.id == best.c.activity_id, Activity.map_id.is_(None)))
+        .values(map_id=best.c.map_id)
+        .returning(Activity.id, Activity.user_id, Activity.map_id)
+        .execution_options(synchronize_session=False)
+    ).all()
+    return ids, [tuple(row) for row in matched]
+
+
+def maps_without_extent(batch_size=1000, after_id=None):
+    """Ids of the next maps whose extent has not been computed."""
+    q = select(Map.id).where(Map.min_lat.is_(None))
+    if after_id is not None:
+        q = q.where(Map.id > after_id)
+    return db.session.execute(q.order_by(Map.id).limit(batch_size)).scalars().all()
@@ -0,0 +1,273 @@
+# app/metrics.py
+"""
+In-process metrics in the Prometheus text exposition format, served at
+GET /metrics.
+
+Recording is a dict lookup and a bisect under a per-metric lock, so it is
+left on in production. Values live in the worker process that recorded
+them: with several gunicorn workers each scrape reaches one of them, so
+every series carries a `worker` label (the pid) and dashboards should
+sum() over it.
+
+What feeds it:
+  - app/instrumentation.py: request latency per endpoint, SQL statement
+    durations, SQL statements per request, pool checkout waits
+  - app/storage.py: backend operation timings (storage_timer)
+  - collectors registered below: connection pool state, the spline,
+    presigned URL, auth user and response body caches, the storage
+    deletion queue and the background job queue
+"""
+import os
+import time
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from flask import Blueprint, Response, current_app, abort
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+LATENCY_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+SQL_BUCKETS = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1)
+POOL_WAIT_BUCKETS = (.0001, .0005, .001, .005, .01, .05, .1, .5, 1, 5, 30)
+COUNT_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    pairs.append(('worker', os.getpid()))
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in pairs) + '}'
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels[n] for n in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        return [f'{self.name}{_labels(self.labelnames, k)} {_number(v)}' for k, v in items]
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._values = {}  # label values -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels[n] for n in self.labelnames)
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            row = self._values.get(key)
+            if row is None:
+                row = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            row[i] += 1
+            row[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        with self._lock:
+            items = [(k, list(row)) for k, row in self._values.items()]
+        lines = []
+        for key, row in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float('inf'),), row[:-1]):
+                cumulative += n
+                le = (('le', _number(bound)),)
+                lines.append(f'{self.name}_bucket{_labels(self.labelnames, key, le)} {cumulative}')
+            lines.append(f'{self.name}_sum{_labels(self.labelnames, key)} {_number(row[-1])}')
+            lines.append(f'{self.name}_count{_labels(self.labelnames, key)} {cumulative}')
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def collector(self, func):
+        """
+        Registers func() -> [(name, kind, documentation, [(labels dict, value)])],
+        called at scrape time for values read from elsewhere.
+        """
+        self._collectors.append(func)
+        return func
+
+    def render(self):
+        out = []
+        for m in self._metrics:
+            out.append(f'# HELP {m.name} {m.documentation}')
+            out.append(f'# TYPE {m.name} {m.kind}')
+            out.extend(m.samples())
+        for func in self._collectors:
+            try:
+                families = func()
+            except Exception as e:
+                current_app.logger.warning("metrics collector %s failed: %s", func.__name__, e)
+                continue
+            for name, kind, documentation, samples in families:
+                out.append(f'# HELP {name} {documentation}')
+                out.append(f'# TYPE {name} {kind}')
+                for labels, value in samples:
+                    out.append(f'{name}{_labels(labels.keys(), labels.values())} {_number(value)}')
+        return '\n'.join(out) + '\n'
+
+
+REGISTRY = Registry()
+
+REQUEST_LATENCY = REGISTRY.register(Histogram(
+    'trackmapper_http_request_duration_seconds', 'Request latency by endpoint.',
+    ('endpoint', 'method', 'status'),
+))
+REQUEST_QUERIES = REGISTRY.register(Histogram(
+    'trackmapper_http_request_sql_queries', 'SQL statements issued per request.',
+    ('endpoint',), buckets=COUNT_BUCKETS,
+))
+SQL_LATENCY = REGISTRY.register(Histogram(
+    'trackmapper_sql_query_duration_seconds', 'SQL statement execution time.',
+    buckets=SQL_BUCKETS,
+))
+SQL_ERRORS = REGISTRY.register(Counter(
+    'trackmapper_sql_errors_total', 'SQL statements that raised.',
+))
+POOL_WAIT = REGISTRY.register(Histogram(
+    'trackmapper_db_pool_checkout_wait_seconds', 'Time spent waiting for a pooled connection.',
+    buckets=POOL_WAIT_BUCKETS,
+))
+STORAGE_LATENCY = REGISTRY.register(Histogram(
+    'trackmapper_storage_operation_duration_seconds', 'Storage backend operation time.',
+    ('backend', 'operation'),
+))
+STORAGE_ERRORS = REGISTRY.register(Counter(
+    'trackmapper_storage_operation_errors_total', 'Storage backend operations that raised.',
+    ('backend', 'operation'),
+))
+
+
+@contextmanager
+def storage_timer(backend, operation):
+    """Times a storage backend call; exceptions are counted and re-raised."""
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        STORAGE_ERRORS.inc(backend=backend, operation=operation)
+        raise
+    finally:
+        STORAGE_LATENCY.observe(time.perf_counter() - start, backend=backend, operation=operation)
+
+
+@REGISTRY.collector
+def _pool_state():
+    from .extensions import db
+    pool = db.engine.pool
+    if not hasattr(pool, 'checkedout'):
+        return []
+    return [
+        ('trackmapper_db_pool_size', 'gauge', 'Configured pool size.',
+         [({}, pool.size())]),
+        ('trackmapper_db_pool_checked_out', 'gauge', 'Connections currently checked out.',
+         [({}, pool.checkedout())]),
+        ('trackmapper_db_pool_overflow', 'gauge', 'Connections open beyond the pool size.',
+         [({}, max(0, pool.overflow()))]),
+    ]
+
+
+@REGISTRY.collector
+def _cache_state():
+    from .spline_cache import get_spline_cache
+    from .storage import get_presign_cache
+    from .tokens import get_user_cache
+    from .caching import get_response_cache
+    caches = {
+        'spline': get_spline_cache().stats(),
+        'presign': get_presign_cache().stats(),
+        'auth_user': get_user_cache().stats(),
+        'response': get_response_cache().stats(),
+    }
+    return [
+        ('trackmapper_cache_entries', 'gauge', 'Entries held by an in-process cache.',
+         [({'cache': c}, s['entries']) for c, s in caches.items()]),
+        ('trackmapper_cache_hits_total', 'counter', 'Cache lookups answered from memory.',
+         [({'cache': c}, s['hits']) for c, s in caches.items()]),
+        ('trackmapper_cache_misses_total', 'counter', 'Cache lookups that missed.',
+         [({'cache': c}, s['misses']) for c, s in caches.items()]),
+        ('trackmapper_spline_disk_hits_total', 'counter', 'Spline fits loaded from persisted files.',
+         [({}, caches['spline']['disk_hits'])]),
+    ]
+
+
+@REGISTRY.collector
+def _deletion_backlog():
+    from .deletion_queue import backlog
+    queued, retrying = backlog()
+    return [
+        ('trackmapper_storage_pending_deletions', 'gauge',
+         'Storage objects queued for storage_worker.py.', [({}, queued)]),
+        ('trackmapper_storage_failed_deletions', 'gauge',
+         'Queued deletions that have failed at least once.', [({}, retrying)]),
+    ]
+
+
+
+@REGISTRY.collector
+def _job_state():
+    from sqlalchemy import select, func
+    from .extensions import db
+    from .models import Job
+    counts = db.session.execute(
+        select(Job.kind, Job.status, func.count()).where(Job.status.in_(('queued', 'running')))
+        .group_by(Job.kind, Job.status)
+    ).all()
+    return [
+        ('trackmapper_jobs', 'gauge', 'Background jobs waiting or running.',
+         [({'kind': kind, 'status': status}, n) for kind, status, n in counts]),
+    ]
+
+
+metrics_bp = Blueprint('metrics', __name__)
+
+
+@metrics_bp.route('/metrics', methods=['GET'])
+def metrics():
+    if not current_app.config.get('METRICS_ENABLED', True):
+        abort(404)
+    return Response(REGISTRY.render(), content_type=CONTENT_TYPE)
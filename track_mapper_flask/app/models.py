@@ -3,6 +3,7 @@ import uuid
 from .extensions import db
 from datetime import datetime, timezone
 from sqlalchemy import func, UUID
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.ext.hybrid import hybrid_method, hybrid_property
 
 # friend table
@@ -20,6 +21,12 @@ class User(db.Model):
     email     = db.Column(db.String(255), nullable=False, unique=True)
     google_id = db.Column(db.String(255), nullable=True, unique=True)
     password_hash = db.Column(db.String(255), nullable=False, default="")
+    # materialized friends feed (app/timeline.py); users that existed before
+    # it stay on read-time fan-in until rebuild_timelines.py has run
+    timeline_ready   = db.Column(db.Boolean, nullable=False, default=True)
+    timeline_horizon = db.Column(db.DateTime(timezone=True), nullable=True)
+    # bumped by every write to the user's profile, maps or activities (app/caching.py)
+    data_version = db.Column(db.Integer, nullable=False, default=0)
 
     friends = db.relationship(
         'User',
@@ -43,15 +50,19 @@ class User(db.Model):
         lazy='dynamic'
     )
 
-    def to_dict(self):
+    def to_dict(self, friend_ids=None):
+        # pass friend_ids (see app/serializers.py) to skip loading the friends
+        if friend_ids is None:
+            friend_ids = [f.id for f in self.friends]
+        # UUIDs and datetimes are encoded by app/serialization.py
         return {
-            'id':        str(self.id),
+            'id':        self.id,
             'firstname': self.firstname,
             'lastname':  self.lastname,
             'username':  self.username,
             'email':     self.email,
             'google_id': self.google_id,
-            'friends':   [str(f.id) for f in self.friends]
+            'friends':   list(friend_ids)
         }
 
 
@@ -64,25 +75,59 @@ class Map(db.Model):
     latitude    = db.Column(db.Float, nullable=False)
     longitude   = db.Column(db.Float, nullable=False)
     num_points = db.Column(db.Integer, nullable=False)
+    geohash     = db.Column(db.String(12), nullable=True, index=True)  # maintained by app/spatial.py
+    # tile pyramid (app/tiles.py); NULL until the tiles have been built
+    image_width   = db.Column(db.Integer, nullable=True)
+    image_height  = db.Column(db.Integer, nullable=True)
+    tile_max_zoom = db.Column(db.Integer, nullable=True)
     uploaded_at = db.Column(db.DateTime(timezone=True), default=lambda: datetime.now(timezone.utc), nullable=False)
+    # bounding box of the real control points (app/matching.py); NULL until known
+    min_lat = db.Column(db.Float, nullable=True)
+    min_lon = db.Column(db.Float, nullable=True)
+    max_lat = db.Column(db.Float, nullable=True)
+    max_lon = db.Column(db.Float, nullable=True)
+    # the points JSON document as uploaded and the SHA-256 it is fitted and
+    # cached under (app/spline_cache.py); NULL for maps whose points are
+    # still only in points/<id>.json (backfill_map_points.py). Deferred:
+    # listings never read it; undefer() it where the points are served.
+    control_points = db.deferred(db.Column(JSONB, nullable=True))
+    points_digest  = db.Column(db.String(64), nullable=True)
     
     user = db.relationship(
         'User',
         back_populates='maps'
     )
 
+    __table_args__ = (
+        # overlap (&&) searches of map extents; the expression must match
+        # app/matching.py's map_extent
+        db.Index('ix_map_extent', func.box(func.point(min_lon, min_lat), func.point(max_lon, max_lat)),
+                 postgresql_using='gist'),
+    )
+
     def to_dict(self):
         return {
-            'id': str(self.id),
+            'id': self.id,
             'title': self.title,
             'description': self.description,
             'image_path': self.image_path,
-            'user_id': str(self.user_id),
+            'user_id': self.user_id,
             'latitude':    self.latitude,
             'longitude':   self.longitude,
             'num_points':  self.num_points,
-            'uploaded_at': self.uploaded_at.isoformat()
+            'uploaded_at': self.uploaded_at,
+            'image_width':   self.image_width,
+            'image_height':  self.image_height,
+            'tile_max_zoom': self.tile_max_zoom,
+            'extent':        self.extent
         }
+
+    @property
+    def extent(self):
+        """[min_lat, min_lon, max_lat, max_lon] of the control points, or None."""
+        if self.min_lat is None:
+            return None
+        return [self.min_lat, self.min_lon, self.max_lat, self.max_lon]
     
     @hybrid_method
     def distance_to(self, lat, lon):
@@ -115,21 +160,175 @@ class Activity(db.Model):
     created_at = db.Column(db.DateTime(timezone=True), default=lambda: datetime.now(timezone.utc), nullable=False)
     distance = db.Column(db.Float, nullable=True)
     elapsed_time = db.Column(db.Float, nullable=True)
+    # computed from the GPX file (app/gpx.py); NULL until processed
+    moving_time    = db.Column(db.Float, nullable=True)
+    elevation_gain = db.Column(db.Float, nullable=True)
+    point_count    = db.Column(db.Integer, nullable=True)
+    min_lat = db.Column(db.Float, nullable=True)
+    min_lon = db.Column(db.Float, nullable=True)
+    max_lat = db.Column(db.Float, nullable=True)
+    max_lon = db.Column(db.Float, nullable=True)
+    # [{"tolerance", "points"}] per stored level of detail (app/tracks.py)
+    track_lods = db.Column(db.JSON, nullable=True)
+    # bytes of tracks/<id>/full.tmt (app/trackcodec.py); NULL until encoded
+    track_size = db.Column(db.Integer, nullable=True)
     
     user = db.relationship(
         'User',
         back_populates='activities'
     )
+
+    __table_args__ = (
+        # keyset pagination of the friends feed: (created_at, id) per user
+        db.Index('ix_activity_user_created', 'user_id', 'created_at', 'id'),
+    )
     
     def to_dict(self):
         return {
-            'id': str(self.id),
+            'id': self.id,
             'title': self.title,
             'description': self.description,
-            'user_id': str(self.user_id),
-            'map_id': str(self.map_id) if self.map_id else None,
-            'created_at': self.created_at.isoformat(),
+            'user_id': self.user_id,
+            'map_id': self.map_id,
+            'created_at': self.created_at,
             'distance': self.distance,
-            'elapsed_time': self.elapsed_time
+            'elapsed_time': self.elapsed_time,
+            'moving_time': self.moving_time,
+            'elevation_gain': self.elevation_gain,
+            'bbox': self.bbox,
         }
+
+    @property
+    def bbox(self):
+        """[min_lat, min_lon, max_lat, max_lon] of the track, or None."""
+        if self.min_lat is None:
+            return None
+        return [self.min_lat, self.min_lon, self.max_lat, self.max_lon]
     
+
+
+class TimelineEntry(db.Model):
+    """One activity in one reader's friends feed (fan-out on write)."""
+    __tablename__ = 'timeline'
+    owner_id    = db.Column(UUID(as_uuid=True), db.ForeignKey('user.id', ondelete='CASCADE'), primary_key=True)
+    activity_id = db.Column(UUID(as_uuid=True), db.ForeignKey('activity.id', ondelete='CASCADE'), primary_key=True)
+    author_id   = db.Column(UUID(as_uuid=True), nullable=False)
+    created_at  = db.Column(db.DateTime(timezone=True), nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_timeline_owner_created', 'owner_id', 'created_at', 'activity_id'),
+    )
+
+
+class MapCell(db.Model):
+    """Maps per geohash cell at each clustering precision (app/clustering.py)."""
+    __tablename__ = 'map_cell'
+    precision = db.Column(db.SmallInteger, primary_key=True)
+    cell      = db.Column(db.String(12), primary_key=True)
+    count     = db.Column(db.Integer, nullable=False, default=0)
+    sum_lat   = db.Column(db.Float, nullable=False, default=0.0)
+    sum_lon   = db.Column(db.Float, nullable=False, default=0.0)
+    # most recently uploaded map in the cell
+    rep_id          = db.Column(UUID(as_uuid=True), nullable=True)
+    rep_uploaded_at = db.Column(db.DateTime(timezone=True), nullable=True)
+
+    def to_dict(self):
+        return {
+            'cell': self.cell,
+            'count': self.count,
+            'latitude': self.sum_lat / self.count,
+            'longitude': self.sum_lon / self.count,
+            'map_id': self.rep_id,
+        }
+
+
+class ActivityRollup(db.Model):
+    """A user's activity totals for one day, week or month (app/rollups.py)."""
+    __tablename__ = 'activity_rollup'
+    user_id        = db.Column(UUID(as_uuid=True), db.ForeignKey('user.id', ondelete='CASCADE'), primary_key=True)
+    bucket         = db.Column(db.String(5), primary_key=True)  # 'day', 'week' or 'month'
+    period_start   = db.Column(db.Date, primary_key=True)       # UTC; weeks start on Monday
+    count          = db.Column(db.Integer, nullable=False, default=0)
+    distance       = db.Column(db.Float, nullable=False, default=0.0)
+    elapsed_time   = db.Column(db.Float, nullable=False, default=0.0)
+    moving_time    = db.Column(db.Float, nullable=False, default=0.0)
+    elevation_gain = db.Column(db.Float, nullable=False, default=0.0)
+
+    def to_dict(self):
+        return {
+            'start': self.period_start.isoformat(),
+            'count': self.count,
+            'distance': self.distance,
+            'elapsed_time': self.elapsed_time,
+            'moving_time': self.moving_time,
+            'elevation_gain': self.elevation_gain,
+        }
+
+
+# content-addressed upload storage (app/storage.py)
+class StoredBlob(db.Model):
+    __tablename__ = 'blob'
+    hash     = db.Column(db.String(64), primary_key=True)  # sha256 hex
+    size     = db.Column(db.BigInteger, nullable=False)
+    refcount = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime(timezone=True), default=lambda: datetime.now(timezone.utc), nullable=False)
+
+
+class StoredFile(db.Model):
+    __tablename__ = 'stored_file'
+    path      = db.Column(db.String(512), primary_key=True)  # e.g. 'images/<id>.jpg'
+    blob_hash = db.Column(db.String(64), db.ForeignKey('blob.hash'), nullable=False, index=True)
+
+
+# storage objects waiting to be removed (app/deletion_queue.py)
+class PendingDeletion(db.Model):
+    __tablename__ = 'pending_deletion'
+    id         = db.Column(db.BigInteger, primary_key=True)
+    key        = db.Column(db.String(512), nullable=False, index=True)  # object key, or folder when is_prefix
+    is_prefix  = db.Column(db.Boolean, nullable=False, default=False)
+    attempts   = db.Column(db.Integer, nullable=False, default=0)
+    not_before = db.Column(db.DateTime(timezone=True), default=lambda: datetime.now(timezone.utc), nullable=False)
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime(timezone=True), default=lambda: datetime.now(timezone.utc), nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_pending_deletion_due', 'not_before', 'id'),
+    )
+
+
+# background work queue (app/jobs.py, worker.py)
+class Job(db.Model):
+    __tablename__ = 'job'
+    id              = db.Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    kind            = db.Column(db.String(64), nullable=False)
+    payload         = db.Column(db.JSON, nullable=False, default=dict)
+    status          = db.Column(db.String(16), nullable=False, default='queued')  # queued, running, succeeded, failed
+    idempotency_key = db.Column(db.String(255), unique=True)
+    user_id         = db.Column(UUID(as_uuid=True), db.ForeignKey('user.id', ondelete='SET NULL'), index=True)
+    attempts        = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts    = db.Column(db.Integer, nullable=False, default=5)
+    run_after       = db.Column(db.DateTime(timezone=True), default=lambda: datetime.now(timezone.utc), nullable=False)
+    locked_until    = db.Column(db.DateTime(timezone=True))
+    last_error      = db.Column(db.Text)
+    result          = db.Column(db.JSON)
+    created_at      = db.Column(db.DateTime(timezone=True), default=lambda: datetime.now(timezone.utc), nullable=False)
+    started_at      = db.Column(db.DateTime(timezone=True))
+    finished_at     = db.Column(db.DateTime(timezone=True))
+
+    __table_args__ = (
+        db.Index('ix_job_status_run_after', 'status', 'run_after'),
+    )
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'status': self.status,
+            'attempts': self.attempts,
+            'max_attempts': self.max_attempts,
+            'last_error': self.last_error,
+            'result': self.result,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+        }
@@ -0,0 +1,57 @@
+# app/pagination.py
+"""
+Opaque keyset cursors.
+
+A cursor is the sort key of the last row on a page, JSON-encoded and
+base64url'd so clients treat it as an opaque string. List endpoints return
+it in the `X-Next-Cursor` header and accept it back as `?cursor=`.
+"""
+import json
+import uuid
+import base64
+import binascii
+from datetime import datetime
+
+NEXT_CURSOR_HEADER = 'X-Next-Cursor'
+
+
+def _encode_value(v):
+    if isinstance(v, datetime):
+        return {'t': v.isoformat()}
+    if isinstance(v, uuid.UUID):
+        return {'u': str(v)}
+    return v
+
+
+def _decode_value(v):
+    if isinstance(v, dict):
+        if 't' in v:
+            return datetime.fromisoformat(v['t'])
+        if 'u' in v:
+            return uuid.UUID(v['u'])
+        raise ValueError("unknown cursor value")
+    return v
+
+
+def encode_cursor(*key):
+    raw = json.dumps([_encode_value(v) for v in key], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, types):
+    """
+    Returns the key tuple encoded in `cursor`, checking each field against
+    `types`. Raises ValueError if the cursor is malformed.
+    """
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        key = tuple(_decode_value(v) for v in values)
+    except (TypeError, KeyError, AttributeError, ValueError, UnicodeError, binascii.Error) as e:
+        raise ValueError(str(e)) from e
+    # bool is an int subclass, but never a valid sort key
+    if len(key) != len(types) or not all(
+        isinstance(v, t) and not isinstance(v, bool) for v, t in zip(key, types)
+    ):
+        raise ValueError("cursor does not match this endpoint")
+    return key
@@ -0,0 +1,120 @@
+# app/rollups.py
+"""
+Per-user activity totals by day, week and month (ActivityRollup).
+
+They are kept current in the transaction of every change to an activity:
+create_activity and batch_upload add new activities, delete_activity
+subtracts, and process_activity applies the difference when it replaces
+the client's distance and time with the GPX stats and fills in moving
+time and elevation gain. Unknown values count as 0. Periods are UTC
+calendar days, ISO weeks (starting Monday) and months; a period whose
+count drops to 0 is removed. Each change is one INSERT ... ON CONFLICT
+DO UPDATE adding the deltas, so concurrent writers never lose updates.
+
+rebuild_rollups.py recomputes them from Activity rows.
+"""
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import select, delete, insert, func, literal, Date
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from .extensions import db
+from .models import Activity, ActivityRollup
+
+BUCKETS = ('day', 'week', 'month')
+TOTALS = ('distance', 'elapsed_time', 'moving_time', 'elevation_gain')
+
+
+def period_start(when, bucket):
+    """First day of the UTC period containing a date or datetime (naive means UTC)."""
+    day = when
+    if isinstance(when, datetime):
+        day = (when.astimezone(timezone.utc) if when.tzinfo else when).date()
+    if bucket == 'day':
+        return day
+    if bucket == 'week':
+        return day - timedelta(days=day.weekday())
+    if bucket == 'month':
+        return day.replace(day=1)
+    raise ValueError(f"Unknown bucket {bucket!r}")
+
+
+def totals(act):
+    """The values an activity contributes to its periods."""
+    return tuple(getattr(act, name) or 0.0 for name in TOTALS)
+
+
+def _apply(changes):
+    """Adds (user_id, created_at, count, totals) deltas to every bucket; the caller commits."""
+    merged = defaultdict(lambda: [0] + [0.0] * len(TOTALS))
+    for user_id, created_at, count, values in changes:
+        for bucket in BUCKETS:
+            row = merged[(user_id, bucket, period_start(created_at, bucket))]
+            row[0] += count
+            for i, v in enumerate(values, 1):
+                row[i] += v
+    # sorted, so concurrent writers lock the rows in the same order
+    rows = [
+        dict(zip(('user_id', 'bucket', 'period_start', 'count') + TOTALS, key + tuple(row)))
+        for key, row in sorted(merged.items(), key=lambda item: (str(item[0][0]), item[0][1:]))
+        if any(row)
+    ]
+    if not rows:
+        return
+
+    stmt = pg_insert(ActivityRollup).values(rows)
+    db.session.execute(stmt.on_conflict_do_update(
+        index_elements=[ActivityRollup.user_id, ActivityRollup.bucket, ActivityRollup.period_start],
+        set_={name: getattr(ActivityRollup, name) + getattr(stmt.excluded, name)
+              for name in ('count',) + TOTALS},
+    ))
+    if any(row['count'] < 0 for row in rows):
+        db.session.execute(delete(ActivityRollup).where(
+            ActivityRollup.user_id.in_({row['user_id'] for row in rows}),
+            ActivityRollup.count <= 0,
+        ))
+
+
+def add_activities(activities):
+    """Counts new activities (Activity objects); the caller commits."""
+    _apply([(a.user_id, a.created_at, 1, totals(a)) for a in activities])
+
+
+def remove_activity(act):
+    """Uncounts an activity that is being deleted; the caller commits."""
+    _apply([(act.user_id, act.created_at, -1, tuple(-v for v in totals(act)))])
+
+
+def update_activity(act, before):
+    """Applies the change of an activity's values from `before` (totals() earlier); the caller commits."""
+    _apply([(act.user_id, act.created_at, 0, tuple(a - b for a, b in zip(totals(act), before)))])
+
+
+def rebuild_rollups(user_id):
+    """Recomputes a user's rollups from their activities; the caller commits."""
+    db.session.execute(delete(ActivityRollup).where(ActivityRollup.user_id == user_id))
+    for bucket in BUCKETS:
+        start = func.date_trunc(bucket, func.timezone('UTC', Activity.created_at)).cast(Date)
+        db.session.execute(insert(ActivityRollup).from_select(
+            ['user_id', 'bucket', 'period_start', 'count', *TOTALS],
+            select(
+                literal(user_id, ActivityRollup.user_id.type),
+                literal(bucket),
+                start,
+                func.count(),
+                *(func.sum(func.coalesce(getattr(Activity, name), 0.0)) for name in TOTALS),
+            )
+            .where(Activity.user_id == user_id)
+            .group_by(start),
+        ))
+
+
+def user_rollups(user_id, bucket, start=None, end=None):
+    """A user's periods in `bucket` overlapping the dates [start, end], oldest first."""
+    q = ActivityRollup.query.filter_by(user_id=user_id, bucket=bucket)
+    if start is not None:
+        q = q.filter(ActivityRollup.period_start >= period_start(start, bucket))
+    if end is not None:
+        q = q.filter(ActivityRollup.period_start <= end)
+    return q.order_by(ActivityRollup.period_start).all()
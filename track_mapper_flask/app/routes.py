@@ -2,18 +2,35 @@
 import os
 import json
 import uuid
+import logging
+import numpy as np
 from functools import wraps
-from datetime import datetime
-from flask import Blueprint, request, jsonify, send_from_directory, abort, current_app
+from datetime import datetime, timezone
+from flask import Blueprint, request, jsonify, send_from_directory, abort, current_app, url_for
 from werkzeug.security import generate_password_hash
 from werkzeug.utils import secure_filename
 from .extensions import db
-from .models import Map, User, Activity
-from .storage import save_file, delete_file, get_file_response
-from sqlalchemy import desc
-from sqlalchemy.orm import joinedload
+from .models import Map, User, Activity, Job
+from .storage import save_file, save_files, discard_written, delete_file_later, get_file_response, get_file_url
+from .spatial import nearest_maps
+from .pagination import NEXT_CURSOR_HEADER, encode_cursor, decode_cursor
+from .tiles import delete_pyramid, tile_count, tile_folder, TILE_SIZE
+from .tracks import delete_lods, pick_level, track_folder, level_filename, FULL_FILENAME, GPX_MIMETYPE
+from .trackcodec import MIMETYPE as TRACK_MIMETYPE
+from .spline_cache import get_map_spline, delete_map_points, save_map_points, load_map_points
+from .tokens import authenticate, invalidate_user, TokenError
+from .serializers import user_dict, friend_ids_by_user, with_usernames, activity_dicts
+from .timeline import feed_rows, fan_out
+from .jobs import enqueue
+from .caching import versioned_by_user, bump_data_version
+from .rollups import BUCKETS, add_activities, remove_activity, user_rollups
+from .matching import set_map_extent, candidate_maps
+from .clustering import maps_in_bbox, add_map, remove_map
+from sqlalchemy import insert, update
+from sqlalchemy.orm import joinedload, undefer
 
 bp = Blueprint('main', __name__)
+logger = logging.getLogger(__name__)
 
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'gpx'}
 
@@ -32,27 +49,20 @@ def require_auth(func):
     return wrapper
 
 def _get_user_from_token():
-    """Simple token parser: expects Authorization header with a token like
-    'token-<id>' or 'Bearer token-<id>'. Returns the User or aborts 401.
-    This mirrors the naive token format returned by /auth/login and /auth/register.
+    """Expects an Authorization header with a token as issued by /auth/login
+    and /auth/register, optionally prefixed with 'Bearer '. Returns the User
+    or aborts 401. See app/tokens.py for the token format.
     """
     auth = request.headers.get('Authorization')
-    print("auth", auth)
     if not auth:
         abort(401, "Missing Authorization header")
-    # accept both 'Bearer token-<id>' and 'token-<id>'
+    # accept both 'Bearer <token>' and '<token>'
     parts = auth.split()
     token = parts[-1] if parts else auth
-    if not token.startswith('token-'):
-        abort(401, "Invalid token format")
     try:
-        user_id = uuid.UUID(token.split('-', 1)[1])
-    except Exception:
-        abort(401, "Invalid token payload")
-    user = User.query.get(user_id)
-    if not user:
-        abort(401, "User not found for token")
-    return user
+        return authenticate(token)
+    except TokenError as e:
+        abort(401, str(e))
 
 @bp.route('/upload', methods=['POST'])
 def upload_file():
@@ -70,6 +80,7 @@ def upload_file():
     ext = raw.rsplit('.', 1)[1].lower()
     folder = 'activities' if ext == 'gpx' else 'images'
     save_file(file, folder, fname)
+    db.session.commit()
 
     return jsonify(filename=fname, folder=folder), 201
 
@@ -77,6 +88,15 @@ def upload_file():
 def download_file(folder, filename):
     safe_folder = secure_filename(folder)
     safe_filename = secure_filename(filename)
+    if safe_folder == 'points' and safe_filename.endswith('.json'):
+        # control points live on the Map row; older maps may only have the file
+        try:
+            m = db.session.get(Map, uuid.UUID(safe_filename[:-len('.json')]),
+                               options=[undefer(Map.control_points)])
+        except ValueError:
+            m = None
+        if m is not None and m.control_points is not None:
+            return jsonify(m.control_points)
     return get_file_response(safe_folder, safe_filename)
 
 @bp.route('/maps/nearest')
@@ -95,20 +115,25 @@ def maps_nearest():
     except ValueError:
         return jsonify(error="Invalid 'page' parameter, must be a positive integer"), 400
 
+    # keyset cursor (distance, id) takes precedence over page
+    after = None
+    if request.args.get('cursor'):
+        try:
+            after = decode_cursor(request.args['cursor'], ((int, float), uuid.UUID))
+        except ValueError:
+            return jsonify(error="Invalid 'cursor' parameter"), 400
+
     per_page = 20  # Number of maps per page
 
-    # build the query, ordering by our hybrid distance_to expression
-    qry = (
-        Map.query
-           .options(joinedload(Map.user))
-           .add_columns(Map.distance_to(lat0, lon0).label('distance_km'))
-           .order_by('distance_km')
-           .offset((page - 1) * per_page)
-           .limit(per_page)
+    # prefilter through the geohash index, then order by exact distance
+    results = nearest_maps(
+        Map.query.options(joinedload(Map.user)),
+        lat0, lon0,
+        offset=0 if after else (page - 1) * per_page,
+        limit=per_page,
+        after=after,
     )
-
-    results = qry.all()
-    return jsonify([
+    resp = jsonify([
         {
           **m.to_dict(),
           'username': m.user.username,
@@ -116,8 +141,43 @@ def maps_nearest():
         }
         for m, dist in results
     ])
+    if len(results) == per_page:
+        last_map, last_dist = results[-1]
+        resp.headers[NEXT_CURSOR_HEADER] = encode_cursor(last_dist, last_map.id)
+    return resp
     
+@bp.route('/maps/in_bbox')
+def maps_bbox():
+    """
+    Maps in a viewport (see app/clustering.py). Takes the real min_lat,
+    min_lon, max_lat, max_lon (min_lon > max_lon crosses the antimeridian),
+    unlike maps_nearest's flipped params, and an optional web-map `zoom`.
+    Zoomed in, returns {"type": "maps", "maps"}; zoomed out or when too
+    many maps are in view, {"type": "clusters", "precision", "clusters"}
+    with each cluster's count, centroid (latitude/longitude stored like
+    the maps') and representative map_id.
+    """
+    try:
+        box = tuple(float(request.args[k]) for k in ('min_lat', 'min_lon', 'max_lat', 'max_lon'))
+        zoom = int(request.args['zoom']) if 'zoom' in request.args else None
+    except (KeyError, ValueError):
+        return jsonify(error="Must provide numeric 'min_lat', 'min_lon', 'max_lat', 'max_lon' "
+                             "and an optional integer 'zoom'"), 400
+    min_lat, min_lon, max_lat, max_lon = box
+    if not (-90 <= min_lat <= max_lat <= 90 and -180 <= min_lon <= 180 and -180 <= max_lon <= 180) \
+            or (zoom is not None and not 0 <= zoom <= 30):
+        return jsonify(error="Bounding box or zoom out of range"), 400
+
+    result = maps_in_bbox(*box, zoom=zoom)
+    if result[0] == 'maps':
+        return jsonify(type='maps', maps=[
+            {**m.to_dict(), 'username': m.user.username} for m in result[1]
+        ])
+    _, precision, clusters = result
+    return jsonify(type='clusters', precision=precision, clusters=[c.to_dict() for c in clusters])
+
 @bp.route('/users/<uuid:user_id>/maps')
+@versioned_by_user
 def user_maps(user_id):
 
     try:
@@ -129,14 +189,12 @@ def user_maps(user_id):
         
     user = User.query.get(user_id)
     if lat0 is not None and lon0 is not None:
-        all_maps = (
+        all_maps = [m for m, _ in nearest_maps(
             Map.query
                 .options(joinedload(Map.user))
-                .filter(Map.user_id == user_id)
-                .add_columns(Map.distance_to(lat0, lon0).label('distance_km'))
-                .order_by('distance_km')
-                .all()
-        )
+                .filter(Map.user_id == user_id),
+            lat0, lon0,
+        )]
     else:
         all_maps = (
             Map.query
@@ -202,13 +260,13 @@ def create_map(user):
             num_points  = int(num_points),
             image_path  = "",      # placeholder
         )
+        set_map_extent(new_map, points)
         db.session.add(new_map)
         db.session.flush()     # so new_map.id is populated
+        add_map(new_map)
 
-        # 4) build file names and save
-        # points JSON
-        pts_fname = f"{new_map.id}.json"
-        save_file(json.dumps(points).encode('utf-8'), 'points', pts_fname)
+        # 4) store the points on the row and save the image
+        save_map_points(new_map, points, points_raw.encode('utf-8'))
         
         # image file
         img_fname = f"{new_map.id}.jpg"
@@ -217,7 +275,15 @@ def create_map(user):
         # 5) update the Map record
         new_map.image_path  = img_fname
 
-        # 6) final commit
+        # 6) tile pyramid, thumbnail and spline fit run in worker.py
+        jobs = {
+            kind: enqueue(kind, {'map_id': str(new_map.id)},
+                          idempotency_key=f'{kind}:{new_map.id}', user_id=user.id)
+            for kind in ('build_tiles', 'fit_spline')
+        }
+
+        # 7) final commit
+        bump_data_version(user.id)
         db.session.commit()
 
     except Exception as e:
@@ -226,51 +292,136 @@ def create_map(user):
         raise e
         return jsonify(error=str(e)), 500
 
-    return jsonify({**new_map.to_dict(), "username": user.username}), 201
+    return jsonify({**new_map.to_dict(), "username": user.username, "jobs": jobs}), 201
 
 
 @bp.route('/maps/<uuid:map_id>', methods=['DELETE'])
 def delete_map(map_id):
     # 1) fetch or 404
-    print("Deleting map with ID:", map_id)
+    logger.info("Deleting map %s", map_id)
     m = Map.query.get_or_404(map_id)
-    print("Found map:", m)
-
-    delete_file('images', f'{m.id}.jpg')
-    delete_file('points', f'{m.id}.json')
 
-    # 4) delete DB record
+    # 2) delete DB record; its files are queued for storage_worker.py in
+    #    the same transaction, so a failed commit keeps them
     try:
+        delete_file_later('images', f'{m.id}.jpg')
+        delete_map_points(m.id)
+        delete_pyramid(m.id)
+        remove_map(m)
+        # activities recorded on it (possibly by other users) keep existing
+        detached = db.session.execute(
+            update(Activity).where(Activity.map_id == m.id).values(map_id=None)
+            .returning(Activity.user_id).execution_options(synchronize_session=False)
+        ).scalars().all()
+        for user_id in {m.user_id, *detached}:
+            bump_data_version(user_id)
         db.session.delete(m)
         db.session.commit()
     except Exception as e:
         db.session.rollback()
         abort(500, f"Failed to delete map: {e}")
 
-    # 5) no content
+    # 3) no content
     return '', 204
 
+@bp.route('/maps/<uuid:map_id>/tiles/<int:z>/<int:x>/<int:y>', methods=['GET'])
+def map_tile(map_id, z, x, y):
+    m = Map.query.get_or_404(map_id)
+    if m.tile_max_zoom is None:
+        abort(404, "Tiles have not been built for this map")
+    if z > m.tile_max_zoom:
+        abort(404, "Zoom level out of range")
+    cols, rows = tile_count(m.image_width, m.image_height, m.tile_max_zoom, z)
+    if x >= cols or y >= rows:
+        abort(404, "Tile out of range")
+    return get_file_response(tile_folder(map_id, z, x), f'{y}.jpg')
+
+@bp.route('/maps/<uuid:map_id>/thumbnail', methods=['GET'])
+def map_thumbnail(map_id):
+    m = Map.query.get_or_404(map_id)
+    if m.tile_max_zoom is None:
+        abort(404, "Thumbnail has not been built for this map")
+    return get_file_response('thumbnails', f'{map_id}.jpg')
+
+@bp.route('/maps/<uuid:map_id>/bundle', methods=['GET'])
+def map_bundle(map_id):
+    """
+    Everything needed to open a map in one request: the map with its
+    author's username, its control points, and the URLs of its image,
+    thumbnail and tiles (a {z}/{x}/{y} template; null until built). On S3
+    the image URL is presigned and the response may be reused while it
+    stays valid.
+    """
+    m = Map.query.options(joinedload(Map.user), undefer(Map.control_points)).get_or_404(map_id)
+    points = m.control_points
+    if points is None:
+        points, _ = load_map_points(m.id)
+
+    presigned = get_file_url('images', m.image_path)
+    if presigned is not None:
+        image_url, seconds_left = presigned
+    else:
+        image_url = url_for('main.download_file', folder='images', filename=m.image_path, _external=True)
+    tiles = None
+    if m.tile_max_zoom is not None:
+        tile_url = url_for('main.map_tile', map_id=m.id, z=0, x=0, y=0, _external=True)
+        tiles = {
+            'url': tile_url[:-len('0/0/0')] + '{z}/{x}/{y}',
+            'max_zoom': m.tile_max_zoom,
+            'tile_size': TILE_SIZE,
+            'thumbnail_url': url_for('main.map_thumbnail', map_id=m.id, _external=True),
+        }
+
+    resp = jsonify({
+        **m.to_dict(),
+        'username': m.user.username,
+        'points': points,
+        'image_url': image_url,
+        'tiles': tiles,
+    })
+    if presigned is not None:
+        min_remaining = current_app.config.get('S3_PRESIGN_MIN_REMAINING', 300)
+        resp.headers['Cache-Control'] = f"private, max-age={max(0, int(seconds_left - min_remaining))}"
+    return resp
+
+@bp.route('/maps/<uuid:map_id>/warp', methods=['POST'])
+def warp_points(map_id):
+    # expects {"points": [[lat, lon], ...]} in the same (x, y) order as the
+    # map's control points, returns {"points": [[x, y], ...]} in map space
+    m = Map.query.get_or_404(map_id)
+    data = request.get_json(silent=True) or {}
+    try:
+        points = np.asarray(data.get('points'), dtype=np.float64)
+        if points.size == 0:
+            return jsonify(points=[])
+        if points.ndim != 2 or points.shape[1] != 2:
+            raise ValueError
+    except (TypeError, ValueError):
+        return jsonify(error="'points' must be a list of [lat, lon] pairs"), 400
+
+    spline = get_map_spline(map_id, m.points_digest)
+    if spline is None:
+        return jsonify(error="Map has no control points"), 404
+
+    return jsonify(points=spline.warp(points).tolist())
+
 @bp.route('/activities/upload', methods=['POST'])
 def create_activity():
     title        = request.form.get('title')
     description  = request.form.get('description')
     date         = request.form.get('date')
     user_id      = request.form.get('user_id')
-    map_id       = request.form.get('map_id') if request.form.get('map_id') else -1
+    map_id       = request.form.get('map_id') or None
     gpx_file     = request.files.get('gpx')
     distance     = request.form.get('distance')
     elapsed_time = request.form.get('elapsed_time')
-    
-    print("Distance", distance)
-    
-    
+
     # 2) validate
     missing = []
     for name, val in [
         ('title', title),
         ('date', date),
         ('user_id', user_id),
-        ('map_id', map_id),
         ('gpx', gpx_file),
         ('distance', distance),
         ('elapsed_time', elapsed_time)
@@ -278,15 +429,21 @@ def create_activity():
         if not val:
             missing.append(name)
     if missing:
-        print("Missing fields:", missing)
+        logger.debug("Activity upload missing fields: %s", missing)
         return jsonify(error=f"Missing fields: {', '.join(missing)}"), 400
+    if map_id is not None:
+        # without one, processing matches the track against map extents
+        try:
+            map_id = uuid.UUID(map_id)
+        except ValueError:
+            return jsonify(error="'map_id' is not a valid id"), 400
 
     try:
         # 3) parse and create the Activity
         new_activity = Activity(
             title=title,
             description=description,
-            created_at=datetime.strptime(date, "%Y-%m-%dT%H:%M:%SZ"),
+            created_at=datetime.strptime(date, "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=timezone.utc),
             user_id=user_id,
             map_id=map_id,
             distance=float(distance),
@@ -298,27 +455,217 @@ def create_activity():
         # save the GPX file
         gpx_fname = f"{new_activity.id}.gpx"
         save_file(gpx_file, 'activities', gpx_fname)
+
+        # the feed fan-out is one INSERT ... SELECT; processing runs in worker.py
+        fan_out(new_activity)
+        job_id = _enqueue_processing(new_activity.id, new_activity.user_id)
+        add_activities([new_activity])
+        bump_data_version(new_activity.user_id)
         
         db.session.commit()
     except Exception as e:
         db.session.rollback()
-        print("Error during activity creation:", e)
+        logger.exception("Error during activity creation")
         return jsonify(error=str(e)), 500
 
-    return jsonify(new_activity.to_dict()), 201
+    return jsonify({**new_activity.to_dict(), "jobs": {"process_activity": job_id}}), 201
+
+def _enqueue_processing(activity_id, user_id):
+    return enqueue('process_activity', {'activity_id': str(activity_id)},
+                   idempotency_key=f'process_activity:{activity_id}', user_id=user_id)
+
+def _parse_batch_item(item):
+    """Activity column values for one batch_upload metadata entry; raises ValueError."""
+    if not isinstance(item, dict):
+        raise ValueError("metadata entries must be objects")
+    missing = [k for k in ('title', 'date', 'distance', 'elapsed_time') if item.get(k) in (None, '')]
+    if missing:
+        raise ValueError(f"Missing fields: {', '.join(missing)}")
+    try:
+        created_at = datetime.strptime(item['date'], "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=timezone.utc)
+    except (TypeError, ValueError):
+        raise ValueError("'date' must look like 2024-01-31T12:00:00Z")
+    try:
+        distance = float(item['distance'])
+        elapsed_time = float(item['elapsed_time'])
+    except (TypeError, ValueError):
+        raise ValueError("'distance' and 'elapsed_time' must be numbers")
+    map_id = item.get('map_id')
+    if map_id:
+        try:
+            map_id = uuid.UUID(str(map_id))
+        except ValueError:
+            raise ValueError("'map_id' is not a valid id")
+    return {
+        'title': item['title'],
+        'description': item.get('description'),
+        'created_at': created_at,
+        'map_id': map_id or None,
+        'distance': distance,
+        'elapsed_time': elapsed_time,
+    }
+
+
+@bp.route('/activities/batch_upload', methods=['POST'])
+@require_auth
+def batch_upload_activities(user):
+    """
+    Multipart form with a `metadata` JSON array and one `gpx` file part per
+    entry, in the same order. Entries carry the create_activity fields
+    (title, description, date, map_id, distance, elapsed_time) and an
+    optional client_id echoed back. Invalid entries (including unknown
+    maps) and failed file writes are reported per item; the rest are
+    inserted in one statement and committed together. If storing or
+    committing fails, nothing is kept and the files written for the batch
+    are removed again.
+    """
+    # 1) parse metadata and pair it with the files
+    try:
+        metadata = json.loads(request.form.get('metadata') or '')
+        if not isinstance(metadata, list):
+            raise ValueError
+    except ValueError:
+        return jsonify(error="'metadata' must be a JSON array"), 400
+    files = request.files.getlist('gpx')
+    if len(files) != len(metadata):
+        return jsonify(error=f"Got {len(files)} gpx files for {len(metadata)} metadata entries"), 400
+    max_items = current_app.config.get('BATCH_UPLOAD_MAX_ITEMS', 100)
+    if len(metadata) > max_items:
+        return jsonify(error=f"At most {max_items} activities per batch"), 400
+
+    results = [None] * len(metadata)
+    valid = []  # (index, row)
+    for i, item in enumerate(metadata):
+        client_id = item.get('client_id') if isinstance(item, dict) else None
+        results[i] = {'index': i, 'client_id': client_id}
+        try:
+            row = _parse_batch_item(item)
+        except ValueError as e:
+            results[i].update(status='error', error=str(e))
+            continue
+        row.update(id=uuid.uuid4(), user_id=user.id)
+        valid.append((i, row))
+
+    # an unknown map would fail the whole insert on its foreign key
+    map_ids = {row['map_id'] for _, row in valid if row['map_id']}
+    known = {m_id for (m_id,) in Map.query.with_entities(Map.id).filter(Map.id.in_(map_ids))} if map_ids else set()
+    for i, row in valid:
+        if row['map_id'] and row['map_id'] not in known:
+            results[i].update(status='error', error="'map_id' does not exist")
+    valid = [(i, row) for i, row in valid if not row['map_id'] or row['map_id'] in known]
+
+    written = []
+    rows = []
+    try:
+        # 2) write the GPX files concurrently
+        saved = save_files([(files[i], f"{row['id']}.gpx") for i, row in valid], 'activities', written)
+        for (i, row), ok in zip(valid, saved):
+            if ok is True:
+                rows.append((i, row))
+            else:
+                results[i].update(status='error', error=f"Failed to store gpx: {ok}")
+
+        # 3) one bulk insert and its processing jobs, single commit
+        if rows:
+            db.session.execute(insert(Activity), [row for _, row in rows])
+            activities = [Activity(**row) for _, row in rows]
+            for act in activities:
+                fan_out(act)
+                _enqueue_processing(act.id, user.id)
+            add_activities(activities)
+            bump_data_version(user.id)
+            db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        discard_written(written)
+        logger.exception("Batch upload of %d activities failed", len(valid))
+        for i, _ in valid:
+            if results[i].get('status') != 'error':
+                results[i].update(status='error', error=f"Batch upload failed: {e}")
+        rows = []
+
+    for i, row in rows:
+        results[i].update(status='created', activity=Activity(**row).to_dict())
+
+    created = len(rows)
+    return jsonify(
+        created=created,
+        failed=len(results) - created,
+        results=results,
+    ), 201 if created else 400
+
+
+@bp.route('/activities/<uuid:activity_id>/track', methods=['GET'])
+def activity_track(activity_id):
+    """
+    The activity's track, in the format the Accept header prefers:
+      application/json (otherwise): a simplified level (see app/tracks.py)
+      application/vnd.trackmapper.track: the same level in the binary
+        format of app/trackcodec.py, or the whole track without parameters
+      application/gpx+xml: the original upload
+    `tolerance` (meters) picks the coarsest level within it, `max_points`
+    caps the point count; without either the finest level is served.
+    """
+    act = Activity.query.get_or_404(activity_id)
+    fmt = request.accept_mimetypes.best_match(['application/json', TRACK_MIMETYPE, GPX_MIMETYPE],
+                                              default='application/json')
+    if fmt == GPX_MIMETYPE:
+        resp = get_file_response('activities', f'{act.id}.gpx')
+    else:
+        try:
+            tolerance = float(request.args['tolerance']) if 'tolerance' in request.args else None
+            max_points = int(request.args['max_points']) if 'max_points' in request.args else None
+            if (tolerance is not None and tolerance < 0) or (max_points is not None and max_points < 1):
+                raise ValueError
+        except ValueError:
+            return jsonify(error="'tolerance' must be a non-negative number and 'max_points' a positive integer"), 400
+        binary = fmt == TRACK_MIMETYPE
+        if not act.track_lods or (binary and act.track_size is None):
+            abort(404, "Track has not been processed yet")
+        if binary and tolerance is None and max_points is None:
+            filename = FULL_FILENAME
+        else:
+            filename = level_filename(pick_level(act.track_lods, tolerance, max_points), binary=binary)
+        resp = get_file_response(track_folder(act.id), filename)
+    if resp is None:
+        return jsonify(error="Failed to generate file response"), 500
+    resp.vary.add('Accept')
+    return resp
+
+@bp.route('/activities/<uuid:activity_id>/maps', methods=['GET'])
+def activity_map_candidates(activity_id):
+    """
+    Maps whose extent overlaps the activity's track, best first, with the
+    fraction of the track's bounding box each covers (see app/matching.py).
+    Empty until the activity has been processed.
+    """
+    act = Activity.query.get_or_404(activity_id)
+    try:
+        limit = int(request.args.get('limit', 5))
+        if not 1 <= limit <= 50:
+            raise ValueError
+    except ValueError:
+        return jsonify(error="'limit' must be an integer from 1 to 50"), 400
+    return jsonify([
+        {**m.to_dict(), 'username': m.user.username, 'coverage': coverage}
+        for m, coverage in candidate_maps(act, limit=limit)
+    ])
 
 @bp.route('/activities/<uuid:activity_id>', methods=['DELETE'])
 @require_auth
 def delete_activity(activity_id, user):
     # Require auth; only allow deleting your own activity
     
-    act = Activity.query.get_or_404(activity_id)
+    # locked, so process_activity cannot change the totals being removed
+    act = Activity.query.with_for_update().get_or_404(activity_id)
     if act.user_id != user.id:
         abort(403, "You can only delete your own activities")
     
-    delete_file('activities', f'{act.id}.gpx')
-    
     try:
+        delete_file_later('activities', f'{act.id}.gpx')
+        delete_lods(act.id)
+        remove_activity(act)
+        bump_data_version(act.user_id)
         db.session.delete(act)
         db.session.commit()
     except Exception as e:
@@ -328,39 +675,50 @@ def delete_activity(activity_id, user):
     return '', 204
 
 @bp.route('/users/<uuid:user_id>/activities', methods=['GET'])
+@versioned_by_user
 def user_activities(user_id):
     user = User.query.get(user_id)
     if not user:
         return jsonify(error="User not found"), 404
-    activities = user.activities.all()
-    return jsonify([
-        {
-            'id': activity.id,
-            'title': activity.title,
-            'description': activity.description,
-            'created_at': activity.created_at.isoformat(),
-            'user_id': activity.user_id,
-            'map_id': activity.map_id,
-            'username': user.username,
-            'distance': activity.distance,
-            'elapsed_time': activity.elapsed_time
-        }
-        for activity in activities
-    ])
+    rows = with_usernames(user.activities).all()
+    return jsonify(activity_dicts(rows))
+
+
+@bp.route('/users/<uuid:user_id>/stats', methods=['GET'])
+@versioned_by_user
+def user_stats(user_id):
+    """
+    Activity totals per period (see app/rollups.py). `bucket` is day, week
+    (the default) or month; `from` and `to` (YYYY-MM-DD, inclusive) limit
+    the periods returned. Periods without activities are omitted.
+    """
+    if not User.query.get(user_id):
+        return jsonify(error="User not found"), 404
+    bucket = request.args.get('bucket', 'week')
+    if bucket not in BUCKETS:
+        return jsonify(error=f"'bucket' must be one of {', '.join(BUCKETS)}"), 400
+    try:
+        start = datetime.strptime(request.args['from'], "%Y-%m-%d").date() if 'from' in request.args else None
+        end = datetime.strptime(request.args['to'], "%Y-%m-%d").date() if 'to' in request.args else None
+    except ValueError:
+        return jsonify(error="'from' and 'to' must look like 2024-01-31"), 400
+    periods = user_rollups(user_id, bucket, start, end)
+    return jsonify(bucket=bucket, periods=[p.to_dict() for p in periods])
 
 
 # Profile endpoints
 @bp.route('/users/<uuid:user_id>/profile', methods=['GET'])
+@versioned_by_user
 def get_user_profile(user_id):
     user = User.query.get_or_404(user_id)
-    return jsonify(user.to_dict())
+    return jsonify(user_dict(user))
 
 
 @bp.route('/users/<uuid:user_id>/profile', methods=['PUT'])
 @require_auth
 def update_user_profile(user_id, user):
     data = request.get_json() or {}
-    print("editing user", user.to_dict())
+    edited_id = user.id
     # Accept firstname, lastname, username, password
     if 'firstname' in data:
         user.firstname = data['firstname']
@@ -371,17 +729,20 @@ def update_user_profile(user_id, user):
     if 'password' in data and data['password']:
         user.password_hash = generate_password_hash(data['password'])
     try:
+        bump_data_version(edited_id)
         db.session.commit()
     except Exception as e:
         db.session.rollback()
         return jsonify(error=str(e)), 500
-    return jsonify(user.to_dict())
+    finally:
+        invalidate_user(edited_id)
+    return jsonify(user_dict(user))
     
 # get most recent activities from a user's friend
 @bp.route('/users/<uuid:user_id>/friends/activities', methods=['GET'])
 def user_friends_activities(user_id):
     user = User.query.get_or_404(user_id)
-    friend_ids = [f.id for f in user.friends] + [user.id]  # Include the user's own ID
+    friend_ids = friend_ids_by_user([user.id])[user.id] + [user.id]  # Include the user's own ID
 
     try:
         page = int(request.args.get('page', 1))
@@ -390,27 +751,31 @@ def user_friends_activities(user_id):
     except ValueError:
         return jsonify(error="Invalid 'page' parameter, must be a positive integer"), 400
 
+    # keyset cursor (created_at, id) takes precedence over page
+    before = None
+    if request.args.get('cursor'):
+        try:
+            before = decode_cursor(request.args['cursor'], (datetime, uuid.UUID))
+        except ValueError:
+            return jsonify(error="Invalid 'cursor' parameter"), 400
+
     per_page = 20  # Number of activities per page
-    activities = (
-        Activity.query
-                .options(joinedload(Activity.user))
-                .filter(Activity.user_id.in_(friend_ids))
-                .order_by(desc(Activity.created_at))
-                .offset((page - 1) * per_page)
-                .limit(per_page)
-    )
+    # materialized timeline, falling back to fan-in (app/timeline.py)
+    rows = feed_rows(user, friend_ids, before=before,
+                     offset=(page - 1) * per_page, limit=per_page)
 
-    return jsonify([
-        {
-            'id':           act.id,
-            'title':        act.title,
-            'description':  act.description,
-            'created_at':   act.created_at.isoformat(),
-            'map_id':       act.map_id,
-            'user_id':      act.user_id,
-            'username':     act.user.username,
-            'distance':     act.distance,
-            'elapsed_time': act.elapsed_time
-        }
-        for act in activities
-    ])
\ No newline at end of file
+    resp = jsonify(activity_dicts(rows))
+    if len(rows) == per_page:
+        last = rows[-1][0]
+        resp.headers[NEXT_CURSOR_HEADER] = encode_cursor(last.created_at, last.id)
+    return resp
+
+
+# status of background work started by an upload (app/jobs.py)
+@bp.route('/jobs/<uuid:job_id>', methods=['GET'])
+@require_auth
+def job_status(job_id, user):
+    job = db.session.get(Job, job_id)
+    if job is None or job.user_id != user.id:
+        return jsonify(error="Job not found"), 404
+    return jsonify(job.to_dict())
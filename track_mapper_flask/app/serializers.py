@@ -0,0 +1,48 @@
+# app/serializers.py
+"""
+Response payloads that need related rows, loaded in bulk.
+
+User.to_dict() walks the friends relationship, which loads every friend
+as a full User; these helpers fetch just the ids from the friend table
+in one query for any number of users. Activity lists select the
+author's username through a join instead of loading each User.
+"""
+from collections import defaultdict
+
+from sqlalchemy import select
+
+from .extensions import db
+from .models import User, Activity, friend
+
+
+def friend_ids_by_user(user_ids):
+    """{user_id: [friend_id, ...]} for every id in user_ids, in one query."""
+    ids = defaultdict(list)
+    user_ids = list(user_ids)
+    if not user_ids:
+        return ids
+    rows = db.session.execute(
+        select(friend.c.user_id, friend.c.friend_id).where(friend.c.user_id.in_(user_ids))
+    )
+    for user_id, friend_id in rows:
+        ids[user_id].append(friend_id)
+    return ids
+
+
+def user_dicts(users):
+    friends = friend_ids_by_user(u.id for u in users)
+    return [u.to_dict(friend_ids=friends[u.id]) for u in users]
+
+
+def user_dict(user):
+    return user_dicts([user])[0]
+
+
+def with_usernames(query):
+    """Adds the author's username to an Activity query; rows become (Activity, username)."""
+    return query.join(User, Activity.user_id == User.id).add_columns(User.username)
+
+
+def activity_dicts(rows):
+    """Payloads for (Activity, username) rows as returned by with_usernames()."""
+    return [{**act.to_dict(), 'username': username} for act, username in rows]
@@ -0,0 +1,110 @@
+# app/simplify.py
+"""
+Douglas-Peucker simplification of GPX tracks into levels of detail.
+
+dp_significance() runs Douglas-Peucker once with no tolerance and records
+for every point the tolerance up to which it survives: the distance at
+which it was chosen as a split point, capped by that of every split
+above it. Keeping the points whose significance exceeds t is then exactly
+the Douglas-Peucker result for tolerance t, so all levels come from one
+pass, and the N most significant points give a DP-ordered track of N
+points. Distances are in meters on a local equirectangular projection,
+which is accurate to well under 1% over the extent of an activity.
+
+Segments are simplified separately and always keep their end points.
+"""
+import json
+
+import numpy as np
+
+from .gpx import EARTH_RADIUS_M
+
+
+def _project(lat, lon):
+    """(x, y) in meters around the track's mean latitude."""
+    lat0 = np.radians(np.mean(lat)) if len(lat) else 0.0
+    return (np.radians(lon) * np.cos(lat0) * EARTH_RADIUS_M,
+            np.radians(lat) * EARTH_RADIUS_M)
+
+
+def _segment_distances(px, py, ax, ay, bx, by):
+    """Distances of points (px, py) from the segment a-b."""
+    dx, dy = bx - ax, by - ay
+    length_sq = dx * dx + dy * dy
+    if length_sq == 0:
+        return np.hypot(px - ax, py - ay)
+    t = np.clip(((px - ax) * dx + (py - ay) * dy) / length_sq, 0.0, 1.0)
+    return np.hypot(px - (ax + t * dx), py - (ay + t * dy))
+
+
+def dp_significance(lat, lon, segment, min_tolerance=0.0):
+    """
+    Per-point tolerance in meters below which Douglas-Peucker keeps it.
+    Ranges whose points all lie within `min_tolerance` are not split
+    further; their points get 0, as no level at or above it keeps them.
+    """
+    n = len(lat)
+    x, y = _project(lat, lon)
+    sig = np.zeros(n)
+    if n == 0:
+        return sig
+
+    # segment boundaries: [start, end] index pairs
+    breaks = np.flatnonzero(segment[1:] != segment[:-1]) + 1
+    starts = np.concatenate(([0], breaks))
+    ends = np.concatenate((breaks - 1, [n - 1]))
+    sig[starts] = np.inf
+    sig[ends] = np.inf
+
+    stack = [(int(a), int(b), np.inf) for a, b in zip(starts, ends)]
+    while stack:
+        a, b, cap = stack.pop()
+        if b - a < 2:
+            continue
+        d = _segment_distances(x[a + 1:b], y[a + 1:b], x[a], y[a], x[b], y[b])
+        i = int(np.argmax(d))
+        s = min(float(d[i]), cap)
+        if s <= min_tolerance:
+            continue
+        i += a + 1
+        sig[i] = s
+        stack.append((a, i, s))
+        stack.append((i, b, s))
+    return sig
+
+
+def level_indices(sig, tolerance=None, max_points=None):
+    """Sorted indices of the points kept at a tolerance and/or point budget."""
+    keep = np.arange(len(sig))
+    if tolerance is not None:
+        keep = keep[sig[keep] > tolerance]
+    if max_points is not None and len(keep) > max_points:
+        keep = np.sort(keep[np.argsort(-sig[keep], kind='stable')[:max_points]])
+    return keep
+
+
+def _value(v, digits):
+    return None if v != v else round(float(v), digits)
+
+
+def encode_level(track, indices, tolerance):
+    """
+    JSON of one level: {"tolerance", "points", "segments"}, each segment a
+    list of [lat, lon, ele, time] rows (ele/time null when unknown, time in
+    epoch seconds).
+    """
+    segments = []
+    last = None
+    for i in indices:
+        if track.segment[i] != last:
+            segments.append([])
+            last = track.segment[i]
+        segments[-1].append([
+            round(float(track.lat[i]), 7), round(float(track.lon[i]), 7),
+            _value(track.ele[i], 2), _value(track.time[i], 3),
+        ])
+    return json.dumps({
+        'tolerance': tolerance,
+        'points': len(indices),
+        'segments': segments,
+    }, separators=(',', ':')).encode('utf-8')
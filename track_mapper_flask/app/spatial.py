@@ -0,0 +1,225 @@
+# app/spatial.py
+"""
+Geohash-based spatial index for Map rows.
+
+Every Map stores the geohash of its (latitude, longitude) in `Map.geohash`.
+Map rows hold the real longitude in `latitude` and the real latitude in
+`longitude` (see maps_nearest), so the column "latitude" runs to +/-180.
+Map.distance_to reads such a point as the one reached by going over the
+pole (lat 90 + x is lat 90 - x on the opposite meridian), and the geohash
+is taken of that point (`fold`), so every row gets one and the cell
+geometry matches the Haversine distances exactly.
+
+Nearest-map queries first restrict candidates to the 3x3 block of cells
+around the query point (a single indexed range per cell), run the exact
+Haversine only on those rows, and widen the block one geohash level at a
+time until the requested page is provably complete.
+"""
+from math import radians, sin, cos, asin, floor, inf, isfinite
+
+from sqlalchemy import event, or_, tuple_
+
+from .models import Map
+
+EARTH_RADIUS_KM = 6371.0
+
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+# precision stored on every Map row (~5m x 5m cells)
+GEOHASH_PRECISION = 9
+
+# levels tried by nearest_maps, finest first (~5km, ~40km, ~150km, ~1250km)
+SEARCH_PRECISIONS = (5, 4, 3, 2)
+
+
+def _cell_size(precision):
+    """(lat_height, lon_width) in degrees of a cell at `precision`."""
+    bits = 5 * precision
+    lon_bits = (bits + 1) // 2
+    lat_bits = bits // 2
+    return 180.0 / (1 << lat_bits), 360.0 / (1 << lon_bits)
+
+
+def _cell_index(lat, lon, precision):
+    lat_h, lon_w = _cell_size(precision)
+    bits = 5 * precision
+    i_lat = min(int(floor((lat + 90.0) / lat_h)), (1 << (bits // 2)) - 1)
+    i_lon = min(int(floor((lon + 180.0) / lon_w)), (1 << ((bits + 1) // 2)) - 1)
+    return i_lat, i_lon
+
+
+def _cell_hash(i_lat, i_lon, precision):
+    """Interleave cell indices (longitude bit first) into a geohash string."""
+    bits = 5 * precision
+    lon_bits = (bits + 1) // 2
+    lat_bits = bits // 2
+    value = 0
+    for b in range(bits):
+        if b % 2 == 0:
+            lon_bits -= 1
+            value = (value << 1) | ((i_lon >> lon_bits) & 1)
+        else:
+            lat_bits -= 1
+            value = (value << 1) | ((i_lat >> lat_bits) & 1)
+    return ''.join(
+        BASE32[(value >> (5 * (precision - 1 - i))) & 31]
+        for i in range(precision)
+    )
+
+
+def in_range(lat, lon):
+    return lat is not None and lon is not None and isfinite(lat) and isfinite(lon)
+
+
+def fold(lat, lon):
+    """The point with -90 <= lat <= 90, -180 <= lon < 180 that Haversine treats (lat, lon) as."""
+    lat = (lat + 180.0) % 360.0 - 180.0
+    if lat > 90.0:
+        lat, lon = 180.0 - lat, lon + 180.0
+    elif lat < -90.0:
+        lat, lon = -180.0 - lat, lon + 180.0
+    return lat, (lon + 180.0) % 360.0 - 180.0
+
+
+def encode(lat, lon, precision=GEOHASH_PRECISION):
+    """Geohash of a point (after `fold`), or None if a coordinate is missing."""
+    if not in_range(lat, lon):
+        return None
+    return _cell_hash(*_cell_index(*fold(lat, lon), precision), precision)
+
+
+def block_cells(lat, lon, precision):
+    """Geohashes of the (up to) 3x3 block of cells centred on the point's cell."""
+    i_lat, i_lon = _cell_index(lat, lon, precision)
+    bits = 5 * precision
+    n_lat = 1 << (bits // 2)
+    n_lon = 1 << ((bits + 1) // 2)
+    cells = set()
+    for d_lat in (-1, 0, 1):
+        row = i_lat + d_lat
+        if row < 0 or row >= n_lat:
+            continue
+        for d_lon in (-1, 0, 1):
+            cells.add(_cell_hash(row, (i_lon + d_lon) % n_lon, precision))
+    return sorted(cells)
+
+
+def bbox_cells(min_lat, min_lon, max_lat, max_lon, precision, limit=None):
+    """
+    Geohashes of the cells at `precision` covering a box, or None if there
+    are more than `limit`. A box with min_lon > max_lon crosses the
+    antimeridian.
+    """
+    lo_lat, lo_lon = _cell_index(max(min_lat, -90.0), min_lon, precision)
+    hi_lat, hi_lon = _cell_index(min(max_lat, 90.0), max_lon, precision)
+    n_lon = 1 << ((5 * precision + 1) // 2)
+    if min_lon <= max_lon:
+        lon_span = hi_lon - lo_lon + 1
+    else:
+        lon_span = (hi_lon - lo_lon) % n_lon + 1 if hi_lon < lo_lon else n_lon
+    if limit is not None and (hi_lat - lo_lat + 1) * lon_span > limit:
+        return None
+    return [
+        _cell_hash(i_lat, (lo_lon + d_lon) % n_lon, precision)
+        for i_lat in range(lo_lat, hi_lat + 1)
+        for d_lon in range(lon_span)
+    ]
+
+
+def covered_radius_km(lat, lon, precision):
+    """
+    Radius around the point that lies entirely inside its 3x3 block.
+
+    Any map closer than this distance is guaranteed to be in block_cells(),
+    so a page whose last row is nearer than the radius cannot be missing rows.
+    """
+    lat_h, lon_w = _cell_size(precision)
+    i_lat, i_lon = _cell_index(lat, lon, precision)
+
+    south = (i_lat - 1) * lat_h - 90.0
+    north = (i_lat + 2) * lat_h - 90.0
+    lat_gap = min(
+        lat - south if south > -90.0 else inf,
+        north - lat if north < 90.0 else inf,
+    )
+
+    if 3 * lon_w >= 360.0:
+        lon_gap = inf
+    else:
+        west = (i_lon - 1) * lon_w - 180.0
+        east = (i_lon + 2) * lon_w - 180.0
+        lon_gap = min(lon - west, east - lon)
+
+    # a point nearer than r_lat can't leave the block's latitude band, and
+    # within that band its latitude is at most phi_max, which bounds how
+    # short a longitude gap can be on the sphere.
+    r_lat = EARTH_RADIUS_KM * radians(lat_gap) if lat_gap != inf else inf
+    phi_max = min(90.0, abs(lat) + lat_gap)
+    if lon_gap == inf:
+        r_lon = inf
+    else:
+        r_lon = EARTH_RADIUS_KM * 2 * asin(
+            max(0.0, cos(radians(phi_max))) * sin(radians(min(lon_gap, 180.0)) / 2)
+        )
+    return min(r_lat, r_lon)
+
+
+def cell_ranges(cells):
+    """Index range of Map.geohash per cell."""
+    pad = GEOHASH_PRECISION
+    return [
+        Map.geohash.between(c + '0' * (pad - len(c)), c + 'z' * (pad - len(c)))
+        for c in cells
+    ]
+
+
+def _cell_filter(cells):
+    """Index range per cell, plus rows that have no geohash (missing coordinates)."""
+    return or_(Map.geohash.is_(None), *cell_ranges(cells))
+
+
+def nearest_maps(query, lat, lon, offset=0, limit=None, after=None):
+    """
+    Rows of `query` with their distance to (lat, lon), ordered nearest first.
+
+    Returns a list of (Map, distance_km), identical to ordering the whole
+    query by Map.distance_to, but only the candidates in the surrounding
+    geohash cells are scored when a limit is given. `after` is a
+    (distance_km, map_id) keyset cursor; only rows sorting after it are returned.
+    """
+    distance = Map.distance_to(lat, lon)
+    if after is not None:
+        query = query.filter(tuple_(distance, Map.id) > tuple_(*after))
+
+    def run(q):
+        q = (
+            q.add_columns(distance.label('distance_km'))
+             .order_by(distance, Map.id)
+             .offset(offset)
+        )
+        if limit is not None:
+            q = q.limit(limit)
+        return q.all()
+
+    if limit is not None and in_range(lat, lon):
+        # cells and radii of the point the distances are measured from
+        f_lat, f_lon = fold(lat, lon)
+        for precision in SEARCH_PRECISIONS:
+            radius = covered_radius_km(f_lat, f_lon, precision)
+            if radius <= 0:
+                continue
+            rows = run(
+                query.filter(_cell_filter(block_cells(f_lat, f_lon, precision)))
+                     .filter(distance < radius)
+            )
+            if len(rows) == limit:
+                return rows
+
+    # coarsest fallback: score every row
+    return run(query)
+
+
+@event.listens_for(Map, 'before_insert')
+@event.listens_for(Map, 'before_update')
+def _set_geohash(mapper, connection, target):
+    target.geohash = encode(target.latitude, target.longitude)
@@ -0,0 +1,134 @@
+# app/spline.py
+"""
+Thin-plate spline between real-world and map-image coordinates.
+
+A vectorized NumPy port of TrackMapper/Math/Spline.swift: the same
+rescaling, affine least-squares fit and r^2 log r radial basis, so points
+warped here land where the iOS client draws them. Coordinates follow the
+control point files: `real` is {x: latitude, y: longitude} and `map` is
+the normalized image position.
+"""
+import json
+
+import numpy as np
+
+# rows warped per block; bounds the (rows x control points) distance matrix
+WARP_CHUNK = 65536
+
+
+def parse_pairs(data):
+    """
+    (real, map) float arrays of shape (m, 2) from a points JSON document,
+    either a bare list of {map, real} pairs or {"N": ..., "pairs": [...]}.
+    """
+    if isinstance(data, (bytes, str)):
+        data = json.loads(data)
+    if isinstance(data, dict):
+        data = data.get('pairs')
+    if not isinstance(data, list):
+        raise ValueError("Expected a list of {map, real} pairs")
+    real = np.array([[p['real']['x'], p['real']['y']] for p in data], dtype=np.float64).reshape(-1, 2)
+    mapped = np.array([[p['map']['x'], p['map']['y']] for p in data], dtype=np.float64).reshape(-1, 2)
+    return real, mapped
+
+
+def _radial(sq_dist):
+    """r^2 log r evaluated from squared distances, with phi(0) = 0."""
+    sq_dist = np.maximum(sq_dist, 0.0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        phi = 0.5 * sq_dist * np.log(sq_dist)
+    phi[sq_dist == 0.0] = 0.0
+    return phi
+
+
+def _sq_distances(a, b, b_norms=None):
+    """(len(a), len(b)) matrix of squared distances via the Gram trick."""
+    if b_norms is None:
+        b_norms = np.einsum('ij,ij->i', b, b)
+    a_norms = np.einsum('ij,ij->i', a, a)
+    return a_norms[:, None] + b_norms[None, :] - 2.0 * (a @ b.T)
+
+
+def _normalization(coords):
+    lo = coords.min(axis=0)
+    span = coords.max(axis=0) - lo
+    span[span == 0] = 1.0
+    return -lo, 1.0 / span
+
+
+class Spline:
+    def __init__(self, real, mapped):
+        real = np.asarray(real, dtype=np.float64).reshape(-1, 2)
+        mapped = np.asarray(mapped, dtype=np.float64).reshape(-1, 2)
+
+        # drop repeated real coordinates, keeping the first occurrence
+        _, first = np.unique(real, axis=0, return_index=True)
+        keep = np.sort(first)
+        self.real = real[keep]
+        self.mapped = mapped[keep]
+        self.m = len(self.real)
+
+        # can't make a spline with less than 3 points
+        if self.m < 3:
+            self.real_trans = np.zeros(2)
+            self.real_scale = np.ones(2)
+            self.map_trans = np.zeros(2)
+            self.map_scale = np.ones(2)
+            self.control = np.zeros((self.m, 2))
+            self.D = np.zeros((3, 2))
+            self.c = np.zeros((self.m, 2))
+            return
+
+        # rescale coordinates to be between 0 and 1
+        self.real_trans, self.real_scale = _normalization(self.real)
+        self.map_trans, self.map_scale = _normalization(self.mapped)
+        self.control = (self.real + self.real_trans) * self.real_scale
+        target = (self.mapped + self.map_trans) * self.map_scale
+
+        # affine part by least squares
+        A = np.hstack([self.control, np.ones((self.m, 1))])
+        self.D, *_ = np.linalg.lstsq(A, target, rcond=None)
+
+        # radial part interpolates the affine residual; the diagonal is
+        # nudged off zero exactly as the client does
+        phi = _radial(_sq_distances(self.control, self.control))
+        np.fill_diagonal(phi, 1e-6)
+        self.c = np.linalg.solve(phi, A @ self.D - target)
+        self._control_norms = np.einsum('ij,ij->i', self.control, self.control)
+
+    @classmethod
+    def from_json(cls, data):
+        return cls(*parse_pairs(data))
+
+    # fields that fully describe a fitted spline
+    _ARRAYS = ('real', 'mapped', 'real_trans', 'real_scale', 'map_trans',
+               'map_scale', 'control', 'D', 'c')
+
+    def to_arrays(self):
+        return {name: getattr(self, name) for name in self._ARRAYS}
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        """Rebuilds a fitted spline from to_arrays() output without solving."""
+        spline = cls.__new__(cls)
+        for name in cls._ARRAYS:
+            setattr(spline, name, np.asarray(arrays[name], dtype=np.float64))
+        spline.m = len(spline.real)
+        spline._control_norms = np.einsum('ij,ij->i', spline.control, spline.control)
+        return spline
+
+    def warp(self, points):
+        """Map-space coordinates (n, 2) for real-world points (n, 2)."""
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        n = len(points)
+        if self.m < 3:
+            return np.zeros((n, 2))
+
+        out = np.empty((n, 2))
+        for start in range(0, n, WARP_CHUNK):
+            block = (points[start:start + WARP_CHUNK] + self.real_trans) * self.real_scale
+            phi = _radial(_sq_distances(block, self.control, self._control_norms))
+            out[start:start + WARP_CHUNK] = (
+                block @ self.D[:2] + self.D[2] - phi @ self.c
+            )
+        return out / self.map_scale - self.map_trans
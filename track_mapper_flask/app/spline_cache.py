@@ -0,0 +1,203 @@
+# app/spline_cache.py
+"""
+Process-level cache of fitted map splines.
+
+Control points live on the Map row (control_points, with the SHA-256 of
+their JSON in points_digest); maps not yet moved there by
+backfill_map_points.py are read from points/<id>.json.
+
+Tier 1 is an in-memory LRU keyed by map id; each entry remembers the
+digest of the points it was fitted from, so callers that pass
+Map.points_digest never get a spline for stale points. Tier 2 persists
+the fitted coefficients (points/<id>.spline.npz) so a cold worker loads
+them instead of solving again.
+
+Writes to a map's points go through save_map_points(), which drops the
+cached fit in both tiers; delete_map calls delete_map_points(), which
+queues the points and fit files for deletion with its transaction.
+"""
+import io
+import json
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from flask import current_app
+from sqlalchemy import select
+
+from .extensions import db
+from .models import Map
+from .spline import Spline
+from .storage import save_file, delete_file, delete_file_later, read_file
+
+logger = logging.getLogger(__name__)
+
+# bump when the persisted layout changes so old files are refitted
+PERSIST_VERSION = 1
+
+
+class SplineCache:
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+
+    def get(self, map_id, digest=None):
+        with self._lock:
+            entry = self._entries.get(map_id)
+            if entry is None or (digest is not None and entry[0] != digest):
+                self.misses += 1
+                return None
+            self._entries.move_to_end(map_id)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, map_id, digest, spline):
+        with self._lock:
+            self._entries[map_id] = (digest, spline)
+            self._entries.move_to_end(map_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def record_disk_hit(self):
+        with self._lock:
+            self.disk_hits += 1
+
+    def invalidate(self, map_id):
+        with self._lock:
+            self._entries.pop(map_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'disk_hits': self.disk_hits,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_spline_cache():
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = SplineCache(current_app.config.get('SPLINE_CACHE_SIZE', 256))
+    return _cache
+
+
+def points_digest(raw):
+    return hashlib.sha256(raw).hexdigest()
+
+
+def _persisted_name(map_id):
+    return f'{map_id}.spline.npz'
+
+
+def _load_persisted(map_id, digest=None):
+    raw = read_file('points', _persisted_name(map_id))
+    if raw is None:
+        return None
+    try:
+        with np.load(io.BytesIO(raw), allow_pickle=False) as data:
+            if int(data['version']) != PERSIST_VERSION:
+                return None
+            stored_digest = str(data['digest'])
+            if digest is not None and stored_digest != digest:
+                return None
+            return stored_digest, Spline.from_arrays(data)
+    except (OSError, KeyError, ValueError) as e:
+        logger.warning("Ignoring unreadable spline file for %s: %s", map_id, e)
+        return None
+
+
+def _persist(map_id, digest, spline):
+    buf = io.BytesIO()
+    np.savez(buf, version=PERSIST_VERSION, digest=digest, **spline.to_arrays())
+    save_file(buf.getvalue(), 'points', _persisted_name(map_id))
+
+
+def get_map_spline(map_id, digest=None):
+    """
+    Fitted spline for a map's control points, or None if it has none.
+    Pass `digest` (points_digest of the current points JSON) when known to
+    reject fits of older content.
+    """
+    cache = get_spline_cache()
+    spline = cache.get(map_id, digest)
+    if spline is not None:
+        return spline
+
+    persist = current_app.config.get('SPLINE_PERSIST', True)
+    if persist:
+        found = _load_persisted(map_id, digest)
+        if found is not None:
+            cache.record_disk_hit()
+            cache.put(map_id, *found)
+            return found[1]
+
+    points, digest = load_map_points(map_id)
+    if points is None:
+        return None
+    spline = Spline.from_json(points)
+    cache.put(map_id, digest, spline)
+    if persist:
+        _persist(map_id, digest, spline)
+    return spline
+
+
+def invalidate_map_spline(map_id):
+    get_spline_cache().invalidate(map_id)
+    delete_file('points', _persisted_name(map_id))
+
+
+def delete_map_points(map_id):
+    """Forgets a deleted map's fit and queues its points files; the caller commits."""
+    get_spline_cache().invalidate(map_id)
+    delete_file_later('points', f'{map_id}.json')
+    delete_file_later('points', _persisted_name(map_id))
+
+
+def load_map_points(map_id):
+    """(points document, digest) of a map, or (None, None) if it has none."""
+    row = db.session.execute(
+        select(Map.control_points, Map.points_digest).where(Map.id == map_id)
+    ).first()
+    if row is not None and row.control_points is not None:
+        return row.control_points, row.points_digest
+    raw = read_file('points', f'{map_id}.json')
+    if raw is None:
+        return None, None
+    return json.loads(raw), points_digest(raw)
+
+
+def save_map_points(m, points, raw=None):
+    """
+    Stores control points on a Map row and drops any fit of the old ones;
+    the caller commits. `raw` is the JSON they were parsed from, if any,
+    so a fit persisted from those bytes stays valid.
+    """
+    if raw is None:
+        raw = json.dumps(points).encode('utf-8')
+    digest = points_digest(raw)
+    if m.points_digest is not None and digest != m.points_digest:
+        invalidate_map_spline(m.id)
+    m.control_points = points
+    m.points_digest = digest
+    return digest
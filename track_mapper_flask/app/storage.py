@@ -1,24 +1,417 @@
 import os
+import shutil
+import time
+import logging
+import hashlib
+import mimetypes
+import tempfile
+import threading
+from datetime import datetime, timezone
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 import boto3
-from flask import current_app, send_from_directory
-from botocore.exceptions import ClientError
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config as BotoConfig
+from flask import current_app, send_from_directory, redirect, request, Response, abort
+from botocore.exceptions import ClientError, BotoCoreError
+from sqlalchemy import select, update, delete
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from .extensions import db
+from .models import StoredBlob, StoredFile, PendingDeletion
+from .metrics import storage_timer
 
-def get_s3_client():
+logger = logging.getLogger(__name__)
+
+# One S3 client per worker process. boto3 clients are thread-safe and own
+# a connection pool, so they are built once and reused; the cache is keyed
+# by the settings it was built from and by pid, so a changed config (tests)
+# or a forked gunicorn worker gets a fresh client instead of sharing sockets.
+_s3_lock = threading.Lock()
+_s3_client = None
+_s3_client_key = None
+
+
+def _s3_settings():
+    cfg = current_app.config
+    endpoint = cfg.get('S3_ENDPOINT_URL')
+    return (
+        os.getpid(),
+        cfg.get('S3_ACCESS_KEY'),
+        cfg.get('S3_SECRET_KEY'),
+        cfg.get('S3_REGION'),
+        endpoint.strip() if endpoint and endpoint.strip() else None,
+        cfg.get('S3_MAX_POOL_CONNECTIONS', 10),
+        cfg.get('S3_MAX_ATTEMPTS', 5),
+        cfg.get('S3_CONNECT_TIMEOUT', 5),
+        cfg.get('S3_READ_TIMEOUT', 60),
+    )
+
+
+def _build_s3_client(settings):
+    _, access_key, secret_key, region, endpoint, pool, attempts, connect_timeout, read_timeout = settings
     kwargs = {
         'service_name': 's3',
-        'aws_access_key_id': current_app.config['S3_ACCESS_KEY'],
-        'aws_secret_access_key': current_app.config['S3_SECRET_KEY'],
-        'region_name': current_app.config['S3_REGION']
+        'aws_access_key_id': access_key,
+        'aws_secret_access_key': secret_key,
+        'region_name': region,
+        'config': BotoConfig(
+            max_pool_connections=pool,
+            retries={'max_attempts': attempts, 'mode': 'standard'},
+            connect_timeout=connect_timeout,
+            read_timeout=read_timeout,
+        ),
     }
-    
-    endpoint = current_app.config.get('S3_ENDPOINT_URL')
-    if endpoint and endpoint.strip():
+    if endpoint:
         kwargs['endpoint_url'] = endpoint
-        print(f"Getting S3 client with endpoint: {endpoint}")
+    logger.info("Creating S3 client (pid %s, endpoint %s)", os.getpid(), endpoint or 'AWS default')
+    # a private session: the default boto3 session is not thread-safe
+    return boto3.session.Session().client(**kwargs)
+
+
+def get_s3_client():
+    global _s3_client, _s3_client_key
+    settings = _s3_settings()
+    client = _s3_client
+    if client is not None and _s3_client_key == settings:
+        return client
+    with _s3_lock:
+        if _s3_client is None or _s3_client_key != settings:
+            _s3_client = _build_s3_client(settings)
+            _s3_client_key = settings
+        return _s3_client
+
+
+def reset_s3_client():
+    """Drops the cached client; the next call builds a new one."""
+    global _s3_client, _s3_client_key, _s3_lock
+    _s3_lock = threading.Lock()
+    _s3_client = None
+    _s3_client_key = None
+
+
+# never reuse the parent's client (or a lock it held) in a forked worker
+os.register_at_fork(after_in_child=reset_s3_client)
+
+
+def get_transfer_config():
+    cfg = current_app.config
+    return TransferConfig(
+        multipart_threshold=cfg.get('S3_MULTIPART_THRESHOLD', 8 * 1024 * 1024),
+        multipart_chunksize=cfg.get('S3_MULTIPART_CHUNKSIZE', 8 * 1024 * 1024),
+        max_concurrency=cfg.get('S3_MAX_CONCURRENCY', 4),
+    )
+
+class PresignedURLCache:
+    """
+    Bounded LRU of presigned GET URLs keyed by (bucket, key). A URL is
+    reused until less than `min_remaining` seconds of its validity are left,
+    so repeat downloads get the same redirect target and client/CDN caches
+    can hit.
+    """
+    def __init__(self, max_entries=10000, min_remaining=300):
+        self.max_entries = max_entries
+        self.min_remaining = min_remaining
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, bucket, key, now=None):
+        """(url, seconds_left) for a cached URL that is still fresh enough, else None."""
+        now = time.time() if now is None else now
+        with self._lock:
+            entry = self._entries.get((bucket, key))
+            if entry is not None and entry[1] - now > self.min_remaining:
+                self._entries.move_to_end((bucket, key))
+                self.hits += 1
+                return entry[0], entry[1] - now
+            self.misses += 1
+            return None
+
+    def put(self, bucket, key, url, expires_at):
+        with self._lock:
+            self._entries[(bucket, key)] = (url, expires_at)
+            self._entries.move_to_end((bucket, key))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, bucket, key):
+        with self._lock:
+            self._entries.pop((bucket, key), None)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+
+_presign_cache = None
+
+
+def get_presign_cache():
+    global _presign_cache
+    if _presign_cache is None:
+        with _s3_lock:
+            if _presign_cache is None:
+                _presign_cache = PresignedURLCache(
+                    current_app.config.get('S3_PRESIGN_CACHE_SIZE', 10000),
+                    current_app.config.get('S3_PRESIGN_MIN_REMAINING', 300),
+                )
+    return _presign_cache
+
+
+def get_presigned_url(folder, filename):
+    """
+    Presigned S3 GET URL for a file, reused from the cache while it has
+    enough validity left. Returns (url, seconds_left).
+    """
+    bucket = current_app.config['S3_BUCKET']
+    full_filename = f"{folder}/{filename}"
+    cache = get_presign_cache()
+    cached = cache.get(bucket, full_filename)
+    if cached is not None:
+        return cached
+
+    expires_in = current_app.config.get('S3_PRESIGN_EXPIRES', 3600)
+    issued_at = time.time()
+    with storage_timer('S3', 'presign'):
+        url = get_s3_client().generate_presigned_url('get_object',
+                                                     Params={'Bucket': bucket, 'Key': full_filename},
+                                                     ExpiresIn=expires_in)
+    cache.put(bucket, full_filename, url, issued_at + expires_in)
+    return url, expires_in
+
+
+def _forget_presigned(full_filename):
+    if _presign_cache is not None:
+        _presign_cache.invalidate(current_app.config.get('S3_BUCKET'), full_filename)
+
+
+# --- Content-addressed uploads -------------------------------------------
+#
+# Files in CONTENT_ADDRESSED_FOLDERS are stored once per distinct content
+# under blobs/<sha256[:2]>/<sha256>. A StoredFile row maps the public name
+# ('images/<id>.jpg') to its blob and StoredBlob.refcount counts those
+# names, so identical uploads cost no extra storage or transfer and the
+# blob is only removed with its last name. Names written before this
+# existed have no StoredFile row and resolve to their original key.
+# The rows are added to the caller's session; the caller commits.
+
+CONTENT_ADDRESSED_FOLDERS = {'images', 'activities'}
+
+HASH_CHUNK_SIZE = 1024 * 1024
+SPOOL_MAX_MEMORY = 8 * 1024 * 1024
+
+
+def _storage_type():
+    return current_app.config.get('FILE_STORE_LOCATION', 'LOCAL').upper()
+
+
+def _local_path(key):
+    return os.path.join(current_app.config['UPLOAD_FOLDER'], *key.split('/'))
+
+
+def blob_key(digest):
+    return f"blobs/{digest[:2]}/{digest}"
+
+
+def _put_object(key, data, content_type=None):
+    """Writes bytes or a readable file object to `key`."""
+    backend = _storage_type()
+    with storage_timer(backend, 'save'):
+        if backend == 'S3':
+            s3 = get_s3_client()
+            bucket = current_app.config['S3_BUCKET']
+            _forget_presigned(key)
+            extra = {'ContentType': content_type} if content_type else {}
+            if isinstance(data, bytes):
+                s3.put_object(Bucket=bucket, Key=key, Body=data, **extra)
+            else:
+                s3.upload_fileobj(data, bucket, key, ExtraArgs=extra or None,
+                                  Config=get_transfer_config())
+        else:
+            path = _local_path(key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # write then rename so readers never see a partial file
+            tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp, 'wb') as f:
+                if isinstance(data, bytes):
+                    f.write(data)
+                elif hasattr(data, 'save'):
+                    data.save(f)
+                else:
+                    shutil.copyfileobj(data, f, HASH_CHUNK_SIZE)
+            os.replace(tmp, path)
+
+
+def _object_exists(key):
+    if _storage_type() == 'S3':
+        with storage_timer('S3', 'head'):
+            try:
+                get_s3_client().head_object(Bucket=current_app.config['S3_BUCKET'], Key=key)
+                return True
+            except ClientError as e:
+                if e.response.get('Error', {}).get('Code') in ('NoSuchKey', '404', 'NotFound'):
+                    return False
+                raise
+    return os.path.exists(_local_path(key))
+
+
+def _delete_object(key):
+    if _storage_type() == 'S3':
+        _forget_presigned(key)
+        with storage_timer('S3', 'delete'):
+            get_s3_client().delete_object(Bucket=current_app.config['S3_BUCKET'], Key=key)
+        return True
+    path = _local_path(key)
+    with storage_timer('LOCAL', 'delete'):
+        if os.path.exists(path):
+            os.remove(path)
+            return True
+    return False
+
+
+def _read_object(key):
+    if _storage_type() == 'S3':
+        with storage_timer('S3', 'read'):
+            try:
+                obj = get_s3_client().get_object(Bucket=current_app.config['S3_BUCKET'], Key=key)
+                return obj['Body'].read()
+            except ClientError as e:
+                if e.response.get('Error', {}).get('Code') in ('NoSuchKey', '404'):
+                    return None
+                raise
+    path = _local_path(key)
+    with storage_timer('LOCAL', 'read'):
+        if not os.path.exists(path):
+            return None
+        with open(path, 'rb') as f:
+            return f.read()
+
+
+def _hash_upload(file_obj):
+    """
+    (sha256, size, data) for an upload. Bytes are hashed directly; file
+    objects are streamed in chunks into a spooled temp file while hashing,
+    so large uploads are never held in memory.
+    """
+    if isinstance(file_obj, bytes):
+        return hashlib.sha256(file_obj).hexdigest(), len(file_obj), file_obj
+
+    stream = getattr(file_obj, 'stream', file_obj)
+    digest = hashlib.sha256()
+    size = 0
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_MEMORY)
+    while True:
+        chunk = stream.read(HASH_CHUNK_SIZE)
+        if not chunk:
+            break
+        digest.update(chunk)
+        spool.write(chunk)
+        size += len(chunk)
+    spool.seek(0)
+    return digest.hexdigest(), size, spool
+
+
+def _rewind(data):
+    if not isinstance(data, bytes):
+        data.seek(0)
+    return data
+
+
+def _resolve(path):
+    """Storage key holding the content of `path` ('folder/filename')."""
+    digest = db.session.execute(
+        select(StoredFile.blob_hash).where(StoredFile.path == path)
+    ).scalar()
+    return blob_key(digest) if digest else path
+
+
+def _acquire_blob(digest, size):
+    """Adds a reference to a blob row (creating it); returns the new refcount."""
+    stmt = (
+        pg_insert(StoredBlob)
+        .values(hash=digest, size=size, refcount=1)
+        .on_conflict_do_update(
+            index_elements=[StoredBlob.hash],
+            set_={'refcount': StoredBlob.refcount + 1},
+        )
+        .returning(StoredBlob.refcount)
+    )
+    return db.session.execute(stmt).scalar()
+
+
+def _release_blob(digest):
+    """
+    Drops a reference to a blob; once nothing points at it, its delete is
+    queued with the caller's transaction, so a rollback keeps the object.
+    """
+    refcount = db.session.execute(
+        update(StoredBlob)
+        .where(StoredBlob.hash == digest)
+        .values(refcount=StoredBlob.refcount - 1)
+        .returning(StoredBlob.refcount)
+    ).scalar()
+    if refcount is not None and refcount <= 0:
+        db.session.execute(
+            delete(StoredBlob).where(StoredBlob.hash == digest, StoredBlob.refcount <= 0)
+        )
+        _queue_deletion(blob_key(digest))
+
+
+def _stage_blob(file_obj, filename):
+    """
+    Hashes an upload and writes its blob unless it already exists. Touches
+    storage only, not the session, so uploads can be staged concurrently.
+    """
+    digest, size, data = _hash_upload(file_obj)
+    key = blob_key(digest)
+    content_type = mimetypes.guess_type(filename)[0]
+    uploaded = False
+    if not _object_exists(key):
+        _put_object(key, data, content_type)
+        uploaded = True
+    return digest, size, data, content_type, uploaded
+
+
+def _register_blob(path, staged):
+    """Points `path` at a staged blob, adjusting refcounts in the session."""
+    digest, size, data, content_type, uploaded = staged
+    key = blob_key(digest)
+
+    previous = db.session.execute(
+        select(StoredFile.blob_hash).where(StoredFile.path == path).with_for_update()
+    ).scalar()
+    if previous == digest:
+        return True
+
+    refcount = _acquire_blob(digest, size)
+    if refcount == 1 and not uploaded:
+        # the object existed but no name referenced it, so a delete of its
+        # last name may be racing us: take it off the deletion queue (this
+        # waits for a worker that has already claimed it) and write it again
+        db.session.execute(delete(PendingDeletion).where(PendingDeletion.key == key))
+        _put_object(key, _rewind(data), content_type)
+
+    if previous is None:
+        db.session.execute(pg_insert(StoredFile).values(path=path, blob_hash=digest))
     else:
-        print("Getting S3 client using default AWS endpoint")
-        
-    return boto3.client(**kwargs)
+        db.session.execute(
+            update(StoredFile).where(StoredFile.path == path).values(blob_hash=digest)
+        )
+        _release_blob(previous)
+    return True
+
+
+def _save_content_addressed(file_obj, path, filename):
+    return _register_blob(path, _stage_blob(file_obj, filename))
+
 
 def save_file(file_obj, folder, filename):
     """
@@ -26,78 +419,341 @@ def save_file(file_obj, folder, filename):
     folder: Subfolder (e.g., 'images', 'activities', 'points')
     file_obj: Can be a file-like object or bytes.
     filename: The name to save the file as.
+    Files in CONTENT_ADDRESSED_FOLDERS are deduplicated by content.
     """
-    storage_type = current_app.config.get('FILE_STORE_LOCATION', 'LOCAL').upper()
     full_filename = f"{folder}/{filename}"
-    print(f"Saving file to {storage_type}: {full_filename}")
-    if storage_type == 'S3':
-        s3 = get_s3_client()
-        bucket = current_app.config['S3_BUCKET']
+    logger.debug("Saving file to %s: %s", _storage_type(), full_filename)
+    try:
+        if folder in CONTENT_ADDRESSED_FOLDERS:
+            return _save_content_addressed(file_obj, full_filename, filename)
+        _put_object(full_filename, file_obj, mimetypes.guess_type(filename)[0])
+        return True
+    except ClientError as e:
+        logger.error("S3 upload of %s failed: %s", full_filename, e)
+        return False
+
+def save_files(entries, folder, written):
+    """
+    Saves many (file_obj, filename) pairs to one folder, writing to storage
+    from a thread pool (STORAGE_UPLOAD_CONCURRENCY). Content-addressed names
+    are recorded in the caller's session afterwards, in order.
+
+    Returns True or an error message per entry. Storage keys this call
+    created are appended to `written`; if the caller's transaction fails,
+    roll back and pass them to discard_written() so no unreferenced object
+    is left behind.
+    """
+    app = current_app._get_current_object()
+    content_addressed = folder in CONTENT_ADDRESSED_FOLDERS
+
+    def stage(entry):
+        file_obj, filename = entry
+        with app.app_context():
+            if content_addressed:
+                return _stage_blob(file_obj, filename)
+            _put_object(f"{folder}/{filename}", file_obj, mimetypes.guess_type(filename)[0])
+            return None
+
+    workers = max(1, min(len(entries), current_app.config.get('STORAGE_UPLOAD_CONCURRENCY', 8)))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(stage, entry) for entry in entries]
+
+    results = []
+    for (file_obj, filename), future in zip(entries, futures):
+        full_filename = f"{folder}/{filename}"
         try:
-            if isinstance(file_obj, bytes):
-                s3.put_object(Bucket=bucket, Key=full_filename, Body=file_obj)
-            else:
-                s3.upload_fileobj(file_obj, bucket, full_filename)
-            return True
+            staged = future.result()
+        except (ClientError, BotoCoreError, OSError) as e:
+            logger.error("Upload of %s failed: %s", full_filename, e)
+            results.append(str(e))
+            continue
+        if not content_addressed:
+            written.append(full_filename)
+            results.append(True)
+            continue
+        if staged[4]:
+            written.append(blob_key(staged[0]))
+        try:
+            results.append(_register_blob(full_filename, staged))
+        except (ClientError, BotoCoreError) as e:
+            logger.error("Upload of %s failed: %s", full_filename, e)
+            results.append(str(e))
+            if staged[4]:
+                # nothing will reference the blob this entry wrote
+                written.remove(blob_key(staged[0]))
+                discard_written([blob_key(staged[0])])
+    return results
+
+
+def discard_written(keys):
+    """
+    Removes objects written by save_files() after the transaction that was
+    to reference them rolled back. Blobs that another committed upload now
+    references are kept.
+    """
+    for key in keys:
+        if key.startswith('blobs/'):
+            digest = key.rsplit('/', 1)[1]
+            if db.session.get(StoredBlob, digest) is not None:
+                continue
+        try:
+            _delete_object(key)
         except ClientError as e:
-            print(f"S3 Upload Error: {e}")
-            return False
-    else:
-        # LOCAL storage
-        upload_dir = os.path.join(current_app.config['UPLOAD_FOLDER'], folder)
-        os.makedirs(upload_dir, exist_ok=True)
-        path = os.path.join(upload_dir, filename)
-        
-        if isinstance(file_obj, bytes):
-            with open(path, 'wb') as f:
-                f.write(file_obj)
-        else:
-            file_obj.save(path)
-        return True
+            logger.error("Cleanup of %s failed: %s", key, e)
+
 
 def delete_file(folder, filename):
     """
-    Deletes a file from either S3 or LOCAL storage.
+    Deletes a file from either S3 or LOCAL storage. For content-addressed
+    files this removes the name; the blob's delete is queued with its last
+    reference, so the caller commits.
     """
-    storage_type = current_app.config.get('FILE_STORE_LOCATION', 'LOCAL').upper()
     full_filename = f"{folder}/{filename}"
-    
-    if storage_type == 'S3':
+    try:
+        if folder in CONTENT_ADDRESSED_FOLDERS:
+            digest = db.session.execute(
+                delete(StoredFile).where(StoredFile.path == full_filename)
+                .returning(StoredFile.blob_hash)
+            ).scalar()
+            if digest is not None:
+                _release_blob(digest)
+                return True
+        return _delete_object(full_filename)
+    except ClientError as e:
+        logger.error("S3 delete of %s failed: %s", full_filename, e)
+        return False
+
+def delete_folder(folder):
+    """
+    Deletes every file under a folder (e.g. 'tiles/<map_id>') from either
+    S3 or LOCAL storage.
+    """
+    if _storage_type() == 'S3':
         s3 = get_s3_client()
         bucket = current_app.config['S3_BUCKET']
         try:
-            s3.delete_object(Bucket=bucket, Key=full_filename)
+            with storage_timer('S3', 'delete_folder'):
+                paginator = s3.get_paginator('list_objects_v2')
+                for page in paginator.paginate(Bucket=bucket, Prefix=f"{folder}/"):
+                    keys = [{'Key': obj['Key']} for obj in page.get('Contents', [])]
+                    for k in keys:
+                        _forget_presigned(k['Key'])
+                    if keys:
+                        # a listing page holds at most 1000 keys, the delete_objects limit
+                        s3.delete_objects(Bucket=bucket, Delete={'Objects': keys, 'Quiet': True})
             return True
         except ClientError as e:
-            print(f"S3 Delete Error: {e}")
+            logger.error("S3 delete of folder %s failed: %s", folder, e)
             return False
     else:
-        upload_dir = os.path.join(current_app.config['UPLOAD_FOLDER'], folder)
-        path = os.path.join(upload_dir, filename)
-        if os.path.exists(path):
-            os.remove(path)
-            return True
+        path = _local_path(folder)
+        with storage_timer('LOCAL', 'delete_folder'):
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+                return True
         return False
 
+# --- Deferred deletion ---------------------------------------------------
+#
+# Deleting rows and objects in one step cannot be atomic: removing files
+# before the commit loses them if the commit fails, removing them after
+# leaves orphans if the process dies in between. The *_later functions
+# instead add PendingDeletion rows to the caller's session, so the delete
+# is recorded in the same transaction as the rows that referenced the
+# files, and storage_worker.py removes the objects afterwards in batches
+# (app/deletion_queue.py).
+
+def _queue_deletion(key, is_prefix=False):
+    db.session.add(PendingDeletion(key=key, is_prefix=is_prefix))
+
+
+def delete_file_later(folder, filename):
+    """Queues a file for deletion; the caller commits."""
+    full_filename = f"{folder}/{filename}"
+    if folder in CONTENT_ADDRESSED_FOLDERS:
+        digest = db.session.execute(
+            delete(StoredFile).where(StoredFile.path == full_filename)
+            .returning(StoredFile.blob_hash)
+        ).scalar()
+        if digest is not None:
+            _release_blob(digest)
+            return
+    _queue_deletion(full_filename)
+
+
+def delete_folder_later(folder):
+    """Queues every file under a folder for deletion; the caller commits."""
+    _queue_deletion(folder, is_prefix=True)
+
+
+def delete_objects(keys):
+    """
+    Removes many objects: S3 delete_objects calls of up to 1000 keys, or
+    unlinks for LOCAL. Missing objects count as deleted. Returns
+    {key: error message} for the keys that could not be removed.
+    """
+    failed = {}
+    if _storage_type() == 'S3':
+        s3 = get_s3_client()
+        bucket = current_app.config['S3_BUCKET']
+        for start in range(0, len(keys), 1000):
+            chunk = keys[start:start + 1000]
+            for key in chunk:
+                _forget_presigned(key)
+            try:
+                with storage_timer('S3', 'delete_batch'):
+                    resp = s3.delete_objects(
+                        Bucket=bucket,
+                        Delete={'Objects': [{'Key': k} for k in chunk], 'Quiet': True},
+                    )
+            except ClientError as e:
+                failed.update((k, str(e)) for k in chunk)
+                continue
+            for err in resp.get('Errors', []):
+                failed[err['Key']] = f"{err.get('Code')}: {err.get('Message')}"
+        return failed
+
+    with storage_timer('LOCAL', 'delete_batch'):
+        for key in keys:
+            try:
+                os.remove(_local_path(key))
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                failed[key] = str(e)
+    return failed
+
+
+def list_objects(prefix):
+    """Yields (key, last modified UTC datetime) for every object under a folder."""
+    if _storage_type() == 'S3':
+        paginator = get_s3_client().get_paginator('list_objects_v2')
+        with storage_timer('S3', 'list'):
+            pages = list(paginator.paginate(Bucket=current_app.config['S3_BUCKET'], Prefix=f"{prefix}/"))
+        for page in pages:
+            for obj in page.get('Contents', []):
+                yield obj['Key'], obj['LastModified']
+        return
+
+    root = current_app.config['UPLOAD_FOLDER']
+    for dirpath, _, filenames in os.walk(_local_path(prefix)):
+        for name in filenames:
+            if name.endswith('.tmp'):
+                continue  # a write in progress (_put_object)
+            path = os.path.join(dirpath, name)
+            key = os.path.relpath(path, root).replace(os.sep, '/')
+            try:
+                modified = datetime.fromtimestamp(os.path.getmtime(path), timezone.utc)
+            except FileNotFoundError:
+                continue
+            yield key, modified
+
+
+def read_file(folder, filename):
+    """
+    Reads a file's contents from either S3 or LOCAL storage.
+    Returns the bytes, or None if the file does not exist.
+    """
+    full_filename = f"{folder}/{filename}"
+    key = _resolve(full_filename) if folder in CONTENT_ADDRESSED_FOLDERS else full_filename
+    try:
+        return _read_object(key)
+    except ClientError as e:
+        logger.error("S3 read of %s failed: %s", key, e)
+        raise
+
+def open_file(folder, filename):
+    """
+    Opens a file for streaming reads from either S3 or LOCAL storage.
+    Returns a binary file object (the caller closes it), or None if the
+    file does not exist.
+    """
+    full_filename = f"{folder}/{filename}"
+    key = _resolve(full_filename) if folder in CONTENT_ADDRESSED_FOLDERS else full_filename
+    if _storage_type() == 'S3':
+        with storage_timer('S3', 'open'):
+            try:
+                obj = get_s3_client().get_object(Bucket=current_app.config['S3_BUCKET'], Key=key)
+            except ClientError as e:
+                if e.response.get('Error', {}).get('Code') in ('NoSuchKey', '404'):
+                    return None
+                logger.error("S3 read of %s failed: %s", key, e)
+                raise
+        return obj['Body']
+    try:
+        return open(_local_path(key), 'rb')
+    except FileNotFoundError:
+        return None
+
+def get_file_url(folder, filename):
+    """
+    (presigned URL, seconds it stays valid) of a file on S3, or None on
+    LOCAL storage, where files are only served through the API.
+    """
+    if _storage_type() != 'S3':
+        return None
+    full_filename = f"{folder}/{filename}"
+    key = _resolve(full_filename) if folder in CONTENT_ADDRESSED_FOLDERS else full_filename
+    return get_presigned_url(*key.rsplit('/', 1))
+
+
 def get_file_response(folder, filename):
     """
     Returns a response to serve the file.
     """
-    storage_type = current_app.config.get('FILE_STORE_LOCATION', 'LOCAL').upper()
     full_filename = f"{folder}/{filename}"
-    
-    if storage_type == 'S3':
-        bucket = current_app.config['S3_BUCKET']
-        s3 = get_s3_client()
+    key = _resolve(full_filename) if folder in CONTENT_ADDRESSED_FOLDERS else full_filename
+
+    if _storage_type() == 'S3':
         try:
-            url = s3.generate_presigned_url('get_object',
-                                            Params={'Bucket': bucket, 'Key': full_filename},
-                                            ExpiresIn=3600)
-            from flask import redirect
-            return redirect(url)
+            url, seconds_left = get_presigned_url(*key.rsplit('/', 1))
+            resp = redirect(url)
+            # clients may reuse the redirect while the URL stays valid, less
+            # the margin after which the cache would hand out a new one
+            min_remaining = current_app.config.get('S3_PRESIGN_MIN_REMAINING', 300)
+            resp.headers['Cache-Control'] = f"private, max-age={max(0, int(seconds_left - min_remaining))}"
+            return resp
         except ClientError as e:
-            print(f"S3 URL Error: {e}")
+            logger.error("S3 presign of %s failed: %s", key, e)
             return None
     else:
-        upload_dir = os.path.join(current_app.config['UPLOAD_FOLDER'], folder)
-        return send_from_directory(upload_dir, filename, as_attachment=True)
+        return _local_file_response(key, filename)
+
+
+def _local_file_response(key, filename):
+    """
+    Serves a LOCAL file with validators: a strong ETag (the content hash for
+    blobs, size/mtime otherwise), Last-Modified, 304 handling and byte
+    ranges. With LOCAL_SENDFILE_MODE set, the bytes are handed to the front
+    server instead of being streamed by the worker.
+    """
+    path = _local_path(key)
+    if not os.path.isfile(path):
+        abort(404)
+    st = os.stat(path)
+    if key.startswith('blobs/'):
+        etag = key.rsplit('/', 1)[1]
+    else:
+        etag = f"{st.st_size:x}-{st.st_mtime_ns:x}"
+    max_age = current_app.config.get('LOCAL_FILE_MAX_AGE', 0) or None
+
+    mode = (current_app.config.get('LOCAL_SENDFILE_MODE') or '').lower()
+    if mode == 'x-accel-redirect':
+        # nginx serves the internal location (and handles Range itself);
+        # we only answer validators so 304s never reach the disk
+        prefix = current_app.config.get('LOCAL_ACCEL_PREFIX', '/protected-uploads/')
+        resp = Response(mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream')
+        resp.headers['X-Accel-Redirect'] = prefix.rstrip('/') + '/' + key
+        resp.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+        resp.set_etag(etag)
+        resp.last_modified = st.st_mtime
+        if max_age:
+            resp.cache_control.public = True
+            resp.cache_control.max_age = max_age
+        return resp.make_conditional(request)
+
+    # send_file answers If-None-Match / If-Modified-Since / Range itself and
+    # emits X-Sendfile instead of the body when USE_X_SENDFILE is on
+    directory, name = os.path.split(path)
+    return send_from_directory(directory, name, as_attachment=True,
+                               download_name=filename, etag=etag, max_age=max_age)
@@ -0,0 +1,96 @@
+# app/tasks.py
+"""
+Background job handlers (app/jobs.py). Each is safe to run more than
+once and does nothing when its map or activity has been deleted since.
+Handlers that write files for a map or activity lock its row first, so
+a concurrent delete waits and then queues those files for deletion too.
+"""
+import logging
+
+from flask import current_app
+
+from .extensions import db
+from .models import Map, Activity
+from .jobs import task
+from .storage import read_file
+from .gpx import GPXError, track_stats
+from .tiles import build_pyramid
+from .tracks import load_track, build_lods, store_full_track
+from .spline_cache import get_map_spline
+from .caching import bump_data_version
+from .rollups import totals, update_activity
+from .matching import auto_match
+
+logger = logging.getLogger(__name__)
+
+
+@task('build_tiles')
+def build_tiles(map_id):
+    """Tile pyramid and thumbnail of a map's image, plus its dimensions."""
+    m = db.session.get(Map, map_id, with_for_update=True)
+    if m is None:
+        return {'skipped': 'map deleted'}
+    image = read_file('images', m.image_path)
+    if image is None:
+        raise FileNotFoundError(f"image {m.image_path} is missing")
+    m.image_width, m.image_height, m.tile_max_zoom = build_pyramid(m.id, image)
+    bump_data_version(m.user_id)
+    return {'width': m.image_width, 'height': m.image_height, 'max_zoom': m.tile_max_zoom}
+
+
+@task('fit_spline')
+def fit_spline(map_id):
+    """Fits and persists a map's spline so the first /warp does not pay for it."""
+    m = db.session.get(Map, map_id, with_for_update=True)
+    if m is None:
+        return {'skipped': 'map deleted'}
+    return {'fitted': get_map_spline(map_id, m.points_digest) is not None}
+
+
+def compute_activity_stats(act, track):
+    """
+    Stores a parsed track's stats on its activity, replacing the client's
+    distance and elapsed time when the track has them. The caller commits.
+    """
+    stats = track_stats(track, current_app.config.get('GPX_MOVING_SPEED', 0.5))
+    act.point_count = stats['num_points']
+    if stats['num_points'] >= 2:
+        act.distance = stats['distance']
+    if stats['elapsed_time'] is not None:
+        act.elapsed_time = stats['elapsed_time']
+    act.moving_time = stats['moving_time']
+    act.elevation_gain = stats['elevation_gain']
+    act.min_lat, act.min_lon = stats['min_lat'], stats['min_lon']
+    act.max_lat, act.max_lon = stats['max_lat'], stats['max_lon']
+    return stats
+
+
+@task('process_activity')
+def process_activity(activity_id):
+    """
+    Computes a new activity's stats (updating its owner's rollups),
+    attaches a map if it has none and stores its simplified tracks. The
+    feed fan-out is done on upload, so a failing job cannot keep the
+    activity out of its readers' timelines.
+    """
+    act = db.session.get(Activity, activity_id, with_for_update=True)
+    if act is None:
+        return {'skipped': 'activity deleted'}
+    result = {}
+    try:
+        track = load_track(act.id)
+        before = totals(act)
+        result['stats'] = compute_activity_stats(act, track)
+        update_activity(act, before)
+        matched = auto_match(act)
+        result['matched_map'] = str(matched) if matched else None
+        act.track_lods = build_lods(act.id, track)
+        act.track_size = store_full_track(act.id, track)
+        result['track_lods'] = act.track_lods
+        result['track_size'] = act.track_size
+        bump_data_version(act.user_id)
+    except GPXError as e:
+        # retrying will not help; keep the client's values
+        logger.warning("Activity %s has an unreadable GPX file: %s", act.id, e)
+        result['error'] = str(e)
+    return result
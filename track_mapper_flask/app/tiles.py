@@ -0,0 +1,84 @@
+# app/tiles.py
+"""
+Image pyramid for map photos.
+
+Level `max_zoom` is the original image cut into TILE_SIZE x TILE_SIZE
+tiles; each level below it halves the resolution, down to level 0 which
+fits in a single tile. Edge tiles are cropped rather than padded. Tiles
+are stored as tiles/<map_id>/<z>/<x>/<y>.jpg, with a small preview at
+thumbnails/<map_id>.jpg.
+"""
+import io
+from math import ceil, log2
+
+from PIL import Image, ImageOps
+
+from .storage import save_file, delete_folder_later, delete_file_later
+
+TILE_SIZE = 256
+THUMBNAIL_SIZE = 256
+JPEG_QUALITY = 85
+
+
+def max_zoom_for(width, height):
+    return max(0, ceil(log2(max(width, height) / TILE_SIZE)))
+
+
+def level_size(width, height, max_zoom, z):
+    """(width, height) in pixels of the image at zoom level z."""
+    factor = 2 ** (max_zoom - z)
+    return max(1, ceil(width / factor)), max(1, ceil(height / factor))
+
+
+def tile_count(width, height, max_zoom, z):
+    """(columns, rows) of tiles at zoom level z."""
+    w, h = level_size(width, height, max_zoom, z)
+    return ceil(w / TILE_SIZE), ceil(h / TILE_SIZE)
+
+
+def _jpeg(img):
+    buf = io.BytesIO()
+    img.save(buf, format='JPEG', quality=JPEG_QUALITY, optimize=True)
+    return buf.getvalue()
+
+
+def tile_folder(map_id, z, x):
+    return f'tiles/{map_id}/{z}/{x}'
+
+
+def build_pyramid(map_id, image_bytes):
+    """
+    Cuts the image into tiles at every zoom level and stores them, plus a
+    thumbnail. Returns (width, height, max_zoom) of the source image.
+    """
+    img = Image.open(io.BytesIO(image_bytes))
+    img = ImageOps.exif_transpose(img).convert('RGB')
+    width, height = img.size
+    max_zoom = max_zoom_for(width, height)
+
+    # walk down from full resolution, halving each level from the previous
+    level = img
+    for z in range(max_zoom, -1, -1):
+        size = level_size(width, height, max_zoom, z)
+        if level.size != size:
+            level = level.resize(size, Image.LANCZOS)
+        cols, rows = tile_count(width, height, max_zoom, z)
+        for x in range(cols):
+            for y in range(rows):
+                box = (
+                    x * TILE_SIZE, y * TILE_SIZE,
+                    min((x + 1) * TILE_SIZE, size[0]), min((y + 1) * TILE_SIZE, size[1]),
+                )
+                save_file(_jpeg(level.crop(box)), tile_folder(map_id, z, x), f'{y}.jpg')
+
+    thumb = img.copy()
+    thumb.thumbnail((THUMBNAIL_SIZE, THUMBNAIL_SIZE), Image.LANCZOS)
+    save_file(_jpeg(thumb), 'thumbnails', f'{map_id}.jpg')
+
+    return width, height, max_zoom
+
+
+def delete_pyramid(map_id):
+    """Queues a map's tiles and thumbnail for deletion; the caller commits."""
+    delete_folder_later(f'tiles/{map_id}')
+    delete_file_later('thumbnails', f'{map_id}.jpg')
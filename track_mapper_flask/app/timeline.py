@@ -0,0 +1,199 @@
+# app/timeline.py
+"""
+Materialized friends feed (fan-out on write).
+
+create_activity copies each new activity into the timeline of its author
+and of every user who has the author as a friend. A reader's timeline
+holds exactly the feed activities created after its horizon: trimming to
+TIMELINE_MAX_LENGTH deletes the oldest entries and moves the horizon up,
+and activities back-dated past the horizon are not inserted. The feed is
+therefore the timeline followed by read-time fan-in restricted to
+created_at <= horizon, which only runs once a reader pages past the
+window.
+
+Readers with more than TIMELINE_FANIN_THRESHOLD friends, and users whose
+timeline has not been built (timeline_ready false), are served by fan-in
+alone and receive no fan-out. Friendships are changed outside the API,
+so run rebuild_timelines.py after changing them.
+"""
+from flask import current_app
+from sqlalchemy import select, delete, update, func, or_, literal, tuple_, desc, UUID
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from .extensions import db
+from .models import User, Activity, TimelineEntry, friend
+from .serializers import with_usernames
+
+
+def _max_length():
+    return current_app.config.get('TIMELINE_MAX_LENGTH', 800)
+
+
+def _fanin_threshold():
+    return current_app.config.get('TIMELINE_FANIN_THRESHOLD', 500)
+
+
+def _friend_count(user_id_col):
+    return select(func.count()).where(friend.c.user_id == user_id_col).scalar_subquery()
+
+
+def uses_timeline(user, friend_count):
+    return user.timeline_ready and friend_count <= _fanin_threshold()
+
+
+def fan_out(activity):
+    """Adds a flushed Activity to the timelines of its readers; the caller commits."""
+    readers = (
+        select(
+            User.id,
+            literal(activity.id, UUID(as_uuid=True)),
+            literal(activity.user_id, UUID(as_uuid=True)),
+            literal(activity.created_at, TimelineEntry.created_at.type),
+        )
+        .where(
+            User.timeline_ready,
+            or_(
+                User.id == activity.user_id,
+                User.id.in_(select(friend.c.user_id).where(friend.c.friend_id == activity.user_id)),
+            ),
+            or_(User.timeline_horizon.is_(None), User.timeline_horizon < activity.created_at),
+            _friend_count(User.id) <= _fanin_threshold(),
+        )
+    )
+    owners = db.session.execute(
+        pg_insert(TimelineEntry)
+        .from_select(['owner_id', 'activity_id', 'author_id', 'created_at'], readers)
+        .on_conflict_do_nothing()
+        .returning(TimelineEntry.owner_id)
+    ).scalars().all()
+    if owners:
+        trim(owners)
+    return len(owners)
+
+
+def trim(owner_ids):
+    """Cuts the given timelines to TIMELINE_MAX_LENGTH entries, raising their horizons."""
+    ranked = (
+        select(
+            TimelineEntry.owner_id,
+            TimelineEntry.created_at,
+            func.row_number().over(
+                partition_by=TimelineEntry.owner_id,
+                order_by=(desc(TimelineEntry.created_at), desc(TimelineEntry.activity_id)),
+            ).label('rn'),
+        )
+        .where(TimelineEntry.owner_id.in_(owner_ids))
+        .subquery()
+    )
+    # everything at or before the first entry past the window goes, ties
+    # included, so the timeline stays "all feed rows newer than the horizon"
+    cutoff = (
+        select(ranked.c.owner_id, ranked.c.created_at)
+        .where(ranked.c.rn == _max_length() + 1)
+        .subquery()
+    )
+    db.session.execute(
+        update(User)
+        .where(User.id == cutoff.c.owner_id)
+        .values(timeline_horizon=func.greatest(
+            func.coalesce(User.timeline_horizon, cutoff.c.created_at), cutoff.c.created_at
+        ))
+        .execution_options(synchronize_session=False)
+    )
+    db.session.execute(
+        delete(TimelineEntry)
+        .where(
+            TimelineEntry.owner_id.in_(owner_ids),
+            TimelineEntry.owner_id == User.id,
+            TimelineEntry.created_at <= User.timeline_horizon,
+        )
+        .execution_options(synchronize_session=False)
+    )
+
+
+def fan_in_query(friend_ids):
+    """Feed rows (Activity, username) computed from Activity, newest first."""
+    return (
+        with_usernames(Activity.query)
+            .filter(Activity.user_id.in_(friend_ids))
+            .order_by(desc(Activity.created_at), desc(Activity.id))
+    )
+
+
+def feed_rows(user, friend_ids, before=None, offset=0, limit=20):
+    """
+    One page of (Activity, username) rows for a reader's friends feed,
+    newest first. `friend_ids` includes the reader; `before` is a
+    (created_at, activity_id) keyset cursor, otherwise `offset` applies.
+    """
+    if not uses_timeline(user, len(friend_ids) - 1):
+        q = fan_in_query(friend_ids)
+        if before:
+            q = q.filter(tuple_(Activity.created_at, Activity.id) < tuple_(*before))
+        else:
+            q = q.offset(offset)
+        return q.limit(limit).all()
+
+    q = (
+        with_usernames(Activity.query)
+            .join(TimelineEntry, TimelineEntry.activity_id == Activity.id)
+            .filter(TimelineEntry.owner_id == user.id)
+            .order_by(desc(TimelineEntry.created_at), desc(TimelineEntry.activity_id))
+    )
+    if before:
+        q = q.filter(tuple_(TimelineEntry.created_at, TimelineEntry.activity_id) < tuple_(*before))
+    else:
+        q = q.offset(offset)
+    rows = q.limit(limit).all()
+
+    horizon = user.timeline_horizon
+    if len(rows) == limit or horizon is None:
+        return rows
+
+    # paged past the window: continue with fan-in over the trimmed part
+    rest = fan_in_query(friend_ids).filter(Activity.created_at <= horizon)
+    if rows:
+        last = rows[-1][0]
+        rest = rest.filter(tuple_(Activity.created_at, Activity.id) < (last.created_at, last.id))
+    elif before:
+        rest = rest.filter(tuple_(Activity.created_at, Activity.id) < tuple_(*before))
+    else:
+        in_timeline = db.session.execute(
+            select(func.count()).where(TimelineEntry.owner_id == user.id)
+        ).scalar()
+        rest = rest.offset(max(0, offset - in_timeline))
+    return rows + rest.limit(limit - len(rows)).all()
+
+
+def rebuild_timeline(user_id):
+    """Rebuilds one reader's timeline from Activity rows; the caller commits."""
+    friend_ids = select(friend.c.friend_id).where(friend.c.user_id == user_id)
+    feed = or_(Activity.user_id == user_id, Activity.user_id.in_(friend_ids))
+    max_length = _max_length()
+
+    db.session.execute(delete(TimelineEntry).where(TimelineEntry.owner_id == user_id))
+
+    # the first row past the window sets the horizon (None: whole history fits)
+    horizon = db.session.execute(
+        select(Activity.created_at)
+        .where(feed)
+        .order_by(desc(Activity.created_at), desc(Activity.id))
+        .offset(max_length)
+        .limit(1)
+    ).scalar()
+
+    newest = select(
+        literal(user_id, UUID(as_uuid=True)), Activity.id, Activity.user_id, Activity.created_at
+    ).where(feed)
+    if horizon is not None:
+        newest = newest.where(Activity.created_at > horizon)
+    db.session.execute(
+        pg_insert(TimelineEntry)
+        .from_select(['owner_id', 'activity_id', 'author_id', 'created_at'], newest)
+    )
+    db.session.execute(
+        update(User)
+        .where(User.id == user_id)
+        .values(timeline_ready=True, timeline_horizon=horizon)
+        .execution_options(synchronize_session=False)
+    )
@@ -0,0 +1,158 @@
+# app/tokens.py
+"""
+Signed auth tokens and a short-lived cache of authenticated users.
+
+Tokens are itsdangerous-signed, timestamped payloads carrying the user id
+and a fingerprint of the password hash, so require_auth can check them
+without a database round-trip and a password change revokes old tokens.
+The legacy 'token-<uuid>' format stays accepted while
+LEGACY_TOKENS_ACCEPTED is on.
+
+Loaded users are cached per worker for AUTH_USER_CACHE_TTL seconds as
+detached snapshots and merged into the request's session without a
+SELECT. update_user_profile calls invalidate_user(); other workers pick
+up changes when their entry expires.
+"""
+import time
+import uuid
+import hashlib
+import threading
+from collections import OrderedDict
+
+from flask import current_app
+from itsdangerous import URLSafeTimedSerializer, BadSignature, SignatureExpired
+from sqlalchemy import inspect
+from sqlalchemy.orm import make_transient_to_detached
+
+from .extensions import db
+from .models import User
+
+TOKEN_SALT = 'trackmapper-auth'
+LEGACY_PREFIX = 'token-'
+
+
+class TokenError(Exception):
+    pass
+
+
+def _serializer():
+    return URLSafeTimedSerializer(current_app.config['SECRET_KEY'], salt=TOKEN_SALT)
+
+
+def _password_fingerprint(user):
+    return hashlib.sha256((user.password_hash or '').encode('utf-8')).hexdigest()[:16]
+
+
+def issue_token(user):
+    return _serializer().dumps({'uid': str(user.id), 'pw': _password_fingerprint(user)})
+
+
+def verify_token(token):
+    """
+    Returns (user_id, password_fingerprint) for a valid token; the
+    fingerprint is None for legacy tokens. Raises TokenError otherwise.
+    """
+    if token.startswith(LEGACY_PREFIX):
+        if not current_app.config.get('LEGACY_TOKENS_ACCEPTED', True):
+            raise TokenError("Legacy token no longer accepted")
+        try:
+            return uuid.UUID(token[len(LEGACY_PREFIX):]), None
+        except ValueError:
+            raise TokenError("Invalid token payload")
+    try:
+        payload = _serializer().loads(
+            token, max_age=current_app.config.get('AUTH_TOKEN_MAX_AGE', 30 * 24 * 3600)
+        )
+        return uuid.UUID(payload['uid']), payload.get('pw')
+    except SignatureExpired:
+        raise TokenError("Token expired")
+    except (BadSignature, KeyError, TypeError, ValueError):
+        raise TokenError("Invalid token")
+
+
+class UserCache:
+    def __init__(self, ttl=60, max_entries=10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None or entry[0] < now:
+                self._entries.pop(user_id, None)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(user_id)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, user_id, snapshot):
+        with self._lock:
+            self._entries[user_id] = (time.monotonic() + self.ttl, snapshot)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
+
+_user_cache = None
+_user_cache_lock = threading.Lock()
+
+
+def get_user_cache():
+    global _user_cache
+    if _user_cache is None:
+        with _user_cache_lock:
+            if _user_cache is None:
+                _user_cache = UserCache(
+                    current_app.config.get('AUTH_USER_CACHE_TTL', 60),
+                    current_app.config.get('AUTH_USER_CACHE_SIZE', 10000),
+                )
+    return _user_cache
+
+
+def _snapshot(user):
+    """Detached copy of the user's column values, safe to share across requests."""
+    copy = User(**{c.key: getattr(user, c.key) for c in inspect(User).column_attrs})
+    make_transient_to_detached(copy)
+    return copy
+
+
+def load_user(user_id):
+    """User attached to the current session, or None; served from the cache when fresh."""
+    cache = get_user_cache()
+    if current_app.config.get('AUTH_USER_CACHE_TTL', 60) > 0:
+        snapshot = cache.get(user_id)
+        if snapshot is not None:
+            return db.session.merge(snapshot, load=False)
+    user = db.session.get(User, user_id)
+    if user is not None:
+        cache.put(user_id, _snapshot(user))
+    return user
+
+
+def invalidate_user(user_id):
+    get_user_cache().invalidate(user_id)
+
+
+def authenticate(token):
+    """User for a bearer token; raises TokenError if it is invalid or revoked."""
+    user_id, fingerprint = verify_token(token)
+    user = load_user(user_id)
+    if user is None:
+        raise TokenError("User not found for token")
+    if fingerprint is not None and fingerprint != _password_fingerprint(user):
+        raise TokenError("Token revoked")
+    return user
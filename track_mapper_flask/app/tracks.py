@@ -0,0 +1,94 @@
+# app/tracks.py
+"""
+Simplified activity tracks for drawing.
+
+process_activity stores one file per level of detail at
+tracks/<activity_id>/lod<i>.json, simplified with Douglas-Peucker
+(app/simplify.py) to each of TRACK_LOD_TOLERANCES meters, finest first,
+and records [{"tolerance", "points"}] per level in Activity.track_lods.
+/activities/<id>/track serves the level that fits the requested
+tolerance or point budget, so a feed card downloads a few KB instead of
+the whole GPX.
+
+Each level is also stored as lod<i>.tmt, and the whole track as full.tmt,
+in the binary format of app/trackcodec.py; clients that accept it get
+those instead of the JSON. The GPX upload stays as the archival original.
+"""
+import mimetypes
+from contextlib import closing
+
+from flask import current_app
+
+from .gpx import parse_track
+from .simplify import dp_significance, level_indices, encode_level
+from .storage import save_file, open_file, delete_folder_later
+from .trackcodec import MIMETYPE, encode_track
+
+GPX_MIMETYPE = 'application/gpx+xml'
+FULL_FILENAME = 'full.tmt'
+
+mimetypes.add_type(MIMETYPE, '.tmt')
+mimetypes.add_type(GPX_MIMETYPE, '.gpx')
+
+
+def track_folder(activity_id):
+    return f'tracks/{activity_id}'
+
+
+def level_filename(i, binary=False):
+    return f'lod{i}.tmt' if binary else f'lod{i}.json'
+
+
+def load_track(activity_id):
+    """Parses an activity's GPX file; raises GPXError or FileNotFoundError."""
+    f = open_file('activities', f'{activity_id}.gpx')
+    if f is None:
+        raise FileNotFoundError(f"activities/{activity_id}.gpx is missing")
+    with closing(f):
+        return parse_track(f)
+
+
+def _tolerances():
+    return sorted(current_app.config.get('TRACK_LOD_TOLERANCES', (2.0, 10.0, 50.0)))
+
+
+def build_lods(activity_id, track):
+    """Stores every level of a parsed track; returns the Activity.track_lods list."""
+    folder = track_folder(activity_id)
+    tolerances = _tolerances()
+    sig = dp_significance(track.lat, track.lon, track.segment, min_tolerance=tolerances[0])
+    lods = []
+    for i, tolerance in enumerate(tolerances):
+        indices = level_indices(sig, tolerance)
+        save_file(encode_level(track, indices, tolerance), folder, level_filename(i))
+        save_file(encode_track(track.take(indices)), folder, level_filename(i, binary=True))
+        lods.append({'tolerance': tolerance, 'points': len(indices)})
+    return lods
+
+
+def store_full_track(activity_id, track):
+    """Stores the whole track as full.tmt; returns its size for Activity.track_size."""
+    data = encode_track(track)
+    save_file(data, track_folder(activity_id), FULL_FILENAME)
+    return len(data)
+
+
+def delete_lods(activity_id):
+    """Queues an activity's levels and full.tmt for deletion; the caller commits."""
+    delete_folder_later(track_folder(activity_id))
+
+
+def pick_level(lods, tolerance=None, max_points=None):
+    """
+    Index of the level to serve: the coarsest within `tolerance` meters
+    (the finest if none is), then coarser while it has more than
+    `max_points` points. With neither, the finest level.
+    """
+    i = 0
+    if tolerance is not None:
+        within = [j for j, lod in enumerate(lods) if lod['tolerance'] <= tolerance]
+        i = within[-1] if within else 0
+    if max_points is not None:
+        while i < len(lods) - 1 and lods[i]['points'] > max_points:
+            i += 1
+    return i
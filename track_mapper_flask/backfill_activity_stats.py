@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+Compute GPX stats (app/gpx.py) for activities uploaded before they existed.
+
+Usage:
+  python backfill_activity_stats.py                      # every activity without stats
+  python backfill_activity_stats.py --force              # recompute every activity
+  python backfill_activity_stats.py --activity-id <uuid> # a single activity
+"""
+import argparse
+import uuid
+from app import create_app
+from app.extensions import db
+from app.models import Activity
+from app.gpx import GPXError
+from app.tasks import compute_activity_stats
+from app.tracks import load_track
+from app.caching import bump_data_version
+from app.rollups import totals, update_activity
+
+
+def backfill(force=False, activity_id=None):
+    app = create_app()
+    with app.app_context():
+        q = Activity.query
+        if activity_id:
+            q = q.filter(Activity.id == activity_id)
+        elif not force:
+            q = q.filter(Activity.point_count.is_(None))
+        ids = [a_id for (a_id,) in q.with_entities(Activity.id).order_by(Activity.created_at).all()]
+        print(f"Computing stats for {len(ids)} activities")
+
+        done = 0
+        for i, a_id in enumerate(ids, 1):
+            act = db.session.get(Activity, a_id, with_for_update=True)
+            if act is None:
+                db.session.rollback()
+                continue
+            try:
+                before = totals(act)
+                stats = compute_activity_stats(act, load_track(act.id))
+                update_activity(act, before)
+                bump_data_version(act.user_id)
+                db.session.commit()
+                done += 1
+                print(f"[{i}/{len(ids)}] {act.id}: {stats['num_points']} points, {stats['distance']:.0f} m")
+            except (GPXError, FileNotFoundError) as e:
+                db.session.rollback()
+                print(f"[{i}/{len(ids)}] {a_id}: skipped: {e}")
+
+        print(f"✅ Computed stats for {done} of {len(ids)} activities")
+
+
+def main():
+    p = argparse.ArgumentParser(description="Backfill activity GPX stats")
+    p.add_argument("--force", action="store_true", help="recompute activities that already have stats")
+    p.add_argument("--activity-id", type=uuid.UUID, help="only process this activity")
+    args = p.parse_args()
+    backfill(force=args.force, activity_id=args.activity_id)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Copy control points from points/<id>.json onto their Map rows
+(Map.control_points, app/spline_cache.py), for maps uploaded before the
+points were stored in the database. Fits already persisted for a map stay
+valid. Map extents (app/matching.py) missing from the row are filled in too.
+
+Usage:
+  python backfill_map_points.py                  # every map without points on its row
+  python backfill_map_points.py --delete-files   # also queue the copied files for deletion
+  python backfill_map_points.py --map-id <uuid>  # a single map
+"""
+import argparse
+import json
+import uuid
+from app import create_app
+from app.extensions import db
+from app.models import Map
+from app.storage import read_file, delete_file_later
+from app.spline_cache import save_map_points
+from app.matching import set_map_extent
+from app.caching import bump_data_version
+
+
+def backfill(delete_files=False, map_id=None):
+    app = create_app()
+    with app.app_context():
+        q = Map.query
+        if map_id:
+            q = q.filter(Map.id == map_id)
+        else:
+            q = q.filter(Map.control_points.is_(None))
+        ids = [m_id for (m_id,) in q.with_entities(Map.id).order_by(Map.uploaded_at).all()]
+        print(f"Copying control points for {len(ids)} maps")
+
+        done = 0
+        for i, m_id in enumerate(ids, 1):
+            m = db.session.get(Map, m_id, with_for_update=True)
+            raw = read_file('points', f'{m_id}.json') if m is not None else None
+            if raw is None:
+                db.session.rollback()
+                print(f"[{i}/{len(ids)}] {m_id}: skipped: no points file")
+                continue
+            try:
+                points = json.loads(raw)
+            except ValueError as e:
+                db.session.rollback()
+                print(f"[{i}/{len(ids)}] {m_id}: skipped: {e}")
+                continue
+            save_map_points(m, points, raw)
+            if m.min_lat is None:
+                set_map_extent(m, points)
+                if m.min_lat is not None:
+                    # the extent is part of the owner's cached /users/<id>/maps
+                    bump_data_version(m.user_id)
+            if delete_files:
+                delete_file_later('points', f'{m_id}.json')
+            db.session.commit()
+            done += 1
+            print(f"[{i}/{len(ids)}] {m_id}: {len(raw)} bytes")
+
+        print(f"✅ Copied control points for {done} of {len(ids)} maps")
+
+
+def main():
+    p = argparse.ArgumentParser(description="Move map control points into the database")
+    p.add_argument("--delete-files", action="store_true", help="queue the copied points files for deletion")
+    p.add_argument("--map-id", type=uuid.UUID, help="only process this map")
+    args = p.parse_args()
+    backfill(delete_files=args.delete_files, map_id=args.map_id)
+
+
+if __name__ == "__main__":
+    main()
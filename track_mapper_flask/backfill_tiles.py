@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""
+Build tile pyramids and thumbnails for maps uploaded before tiling existed.
+
+Usage:
+  python backfill_tiles.py                 # every map without tiles
+  python backfill_tiles.py --force         # rebuild every map
+  python backfill_tiles.py --map-id <uuid> # a single map
+"""
+import argparse
+import uuid
+from app import create_app
+from app.extensions import db
+from app.models import Map
+from app.storage import read_file
+from app.tiles import build_pyramid
+
+
+def backfill(force=False, map_id=None):
+    app = create_app()
+    with app.app_context():
+        q = Map.query
+        if map_id:
+            q = q.filter(Map.id == map_id)
+        elif not force:
+            q = q.filter(Map.tile_max_zoom.is_(None))
+        ids = [m_id for (m_id,) in q.with_entities(Map.id).order_by(Map.uploaded_at).all()]
+        print(f"Building tiles for {len(ids)} maps")
+
+        built = 0
+        for i, m_id in enumerate(ids, 1):
+            m = db.session.get(Map, m_id)
+            image = read_file('images', m.image_path)
+            if image is None:
+                print(f"[{i}/{len(ids)}] {m.id}: image {m.image_path} missing, skipping")
+                continue
+            try:
+                m.image_width, m.image_height, m.tile_max_zoom = build_pyramid(m.id, image)
+                db.session.commit()
+                built += 1
+                print(f"[{i}/{len(ids)}] {m.id}: {m.image_width}x{m.image_height}, zoom 0-{m.tile_max_zoom}")
+            except Exception as e:
+                db.session.rollback()
+                print(f"[{i}/{len(ids)}] {m.id}: failed: {e}")
+
+        print(f"✅ Built tiles for {built} of {len(ids)} maps")
+
+
+def main():
+    p = argparse.ArgumentParser(description="Backfill map tile pyramids")
+    p.add_argument("--force", action="store_true", help="rebuild maps that already have tiles")
+    p.add_argument("--map-id", type=uuid.UUID, help="only process this map")
+    args = p.parse_args()
+    backfill(force=args.force, map_id=args.map_id)
+
+
+if __name__ == "__main__":
+    main()
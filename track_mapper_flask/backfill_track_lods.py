@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""
+Build simplified and binary tracks (app/tracks.py) for activities uploaded
+before they existed, or after changing TRACK_LOD_TOLERANCES.
+
+Usage:
+  python backfill_track_lods.py                      # every activity without levels
+  python backfill_track_lods.py --force              # rebuild every activity
+  python backfill_track_lods.py --activity-id <uuid> # a single activity
+"""
+import argparse
+import uuid
+from app import create_app
+from app.extensions import db
+from app.models import Activity
+from app.gpx import GPXError
+from app.tracks import load_track, build_lods, store_full_track
+
+
+def backfill(force=False, activity_id=None):
+    app = create_app()
+    with app.app_context():
+        q = Activity.query
+        if activity_id:
+            q = q.filter(Activity.id == activity_id)
+        elif not force:
+            q = q.filter(db.or_(Activity.track_lods.is_(None), Activity.track_size.is_(None)))
+        ids = [a_id for (a_id,) in q.with_entities(Activity.id).order_by(Activity.created_at).all()]
+        print(f"Building simplified tracks for {len(ids)} activities")
+
+        done = 0
+        for i, a_id in enumerate(ids, 1):
+            act = db.session.get(Activity, a_id, with_for_update=True)
+            if act is None:
+                db.session.rollback()
+                continue
+            try:
+                track = load_track(act.id)
+                act.track_lods = build_lods(act.id, track)
+                act.track_size = store_full_track(act.id, track)
+                db.session.commit()
+                done += 1
+                points = ', '.join(f"{lod['tolerance']:g}m: {lod['points']}" for lod in act.track_lods)
+                print(f"[{i}/{len(ids)}] {act.id}: {points}; full track {act.track_size} bytes")
+            except (GPXError, FileNotFoundError) as e:
+                db.session.rollback()
+                print(f"[{i}/{len(ids)}] {a_id}: skipped: {e}")
+
+        print(f"✅ Built simplified tracks for {done} of {len(ids)} activities")
+
+
+def main():
+    p = argparse.ArgumentParser(description="Backfill simplified activity tracks")
+    p.add_argument("--force", action="store_true", help="rebuild activities that already have levels")
+    p.add_argument("--activity-id", type=uuid.UUID, help="only process this activity")
+    args = p.parse_args()
+    backfill(force=args.force, activity_id=args.activity_id)
+
+
+if __name__ == "__main__":
+    main()
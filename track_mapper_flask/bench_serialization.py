@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark of response serializers on 10k-row map and activity lists.
+
+Compares the previous path (to_dict() converting UUIDs/datetimes per row,
+then Flask's json-module provider) with app/serialization.py's orjson and
+MessagePack encoders, and checks the JSON bodies are byte-identical.
+No database is needed; rows are built in memory.
+
+Usage:
+  python bench_serialization.py [--rows 10000] [--repeat 5]
+"""
+import argparse
+import random
+import time
+import uuid
+from datetime import datetime, timezone, timedelta
+
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+
+from app.models import Map, Activity
+from app import serialization
+from app.serialization import FastJSONProvider, dumps_json_bytes
+
+
+def make_rows(n):
+    rnd = random.Random(42)
+    start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    users = [uuid.uuid4() for _ in range(50)]
+    maps, activities = [], []
+    for i in range(n):
+        maps.append(Map(
+            id=uuid.uuid4(), title=f"Map {i}", description="Trail map of the park",
+            image_path=f"{uuid.uuid4()}.jpg", user_id=rnd.choice(users),
+            latitude=rnd.uniform(-80, 80), longitude=rnd.uniform(-180, 180),
+            num_points=rnd.randint(3, 40),
+            uploaded_at=start + timedelta(seconds=rnd.randint(0, 3e7), microseconds=rnd.randint(0, 999999)),
+            image_width=4032, image_height=3024, tile_max_zoom=4,
+        ))
+        activities.append(Activity(
+            id=uuid.uuid4(), title=f"Run {i}", description=None, user_id=rnd.choice(users),
+            map_id=rnd.choice([None, uuid.uuid4()]),
+            created_at=start + timedelta(seconds=rnd.randint(0, 3e7)),
+            distance=rnd.uniform(500, 42195), elapsed_time=float(rnd.randint(120, 20000)),
+        ))
+    return maps, activities
+
+
+def legacy_dict(d):
+    """The row as to_dict() produced it before the serializer handled UUID/datetime."""
+    out = {}
+    for k, v in d.items():
+        if isinstance(v, uuid.UUID):
+            v = str(v)
+        elif isinstance(v, datetime):
+            v = v.isoformat()
+        out[k] = v
+    return out
+
+
+def timed(fn, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        out = fn()
+        best = min(best, time.perf_counter() - t0)
+    return best, out
+
+
+def main():
+    p = argparse.ArgumentParser(description="Benchmark response serializers")
+    p.add_argument("--rows", type=int, default=10000)
+    p.add_argument("--repeat", type=int, default=5)
+    args = p.parse_args()
+
+    app = Flask(__name__)
+    legacy = DefaultJSONProvider(app)
+    fast = FastJSONProvider(app)
+    maps, activities = make_rows(args.rows)
+
+    print(f"orjson: {'yes' if serialization.orjson else 'no'}, "
+          f"msgpack: {'yes' if serialization.msgpack else 'no'}, rows: {args.rows}")
+    for name, rows in (("maps", maps), ("activities", activities)):
+        cases = [
+            ("json module, per-row str()/isoformat()",
+             lambda: legacy.dumps([legacy_dict({**r.to_dict(), 'username': 'someone'}) for r in rows],
+                                  separators=(',', ':')).encode('ascii')),
+            ("json module, default= hook",
+             lambda: DefaultJSONProvider.dumps(fast, [{**r.to_dict(), 'username': 'someone'} for r in rows],
+                                               separators=(',', ':')).encode('ascii')),
+            ("FastJSONProvider",
+             lambda: dumps_json_bytes([{**r.to_dict(), 'username': 'someone'} for r in rows])),
+        ]
+        if serialization.msgpack:
+            cases.append(("MessagePack",
+                          lambda: serialization.dumps_msgpack([{**r.to_dict(), 'username': 'someone'} for r in rows])))
+
+        print(f"\n{name}:")
+        baseline_time, baseline = timed(cases[0][1], args.repeat)
+        for label, fn in cases:
+            t, out = timed(fn, args.repeat)
+            same = "" if label == "MessagePack" else ("  identical" if out == baseline else "  DIFFERENT")
+            print(f"  {label:42s} {t * 1000:8.1f} ms  {len(out) / 1024:8.0f} KiB  "
+                  f"x{baseline_time / t:4.1f}{same}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Size and speed of the binary track format (app/trackcodec.py) against GPX.
+
+For each GPX file given, and a synthetic 1 Hz track of --points points,
+prints the GPX size, each codec's size and ratio, encode/decode times
+and the largest round-trip error. No database is needed.
+
+Usage:
+  python bench_trackcodec.py [app/uploads_old/gpx_3.gpx ...] [--points 100000] [--repeat 5]
+"""
+import argparse
+import io
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+
+from app.gpx import parse_track, haversine
+from app import trackcodec
+from app.trackcodec import encode_track, decode_track, RAW, ZLIB, ZSTD
+
+
+def synthetic_gpx(n):
+    """GPX text of an n-point run: ~3 m steps at 1 Hz with a wandering heading."""
+    rnd = np.random.default_rng(42)
+    heading = np.cumsum(rnd.normal(0, 0.1, n))
+    step = rnd.normal(3.0, 0.3, n) / 111_320
+    lat = 47.0 + np.cumsum(step * np.cos(heading))
+    lon = 8.0 + np.cumsum(step * np.sin(heading)) / np.cos(np.radians(47.0))
+    ele = 400 + np.cumsum(rnd.normal(0, 0.2, n))
+    start = datetime(2024, 5, 1, 7, 0, tzinfo=timezone.utc).timestamp()
+    out = io.StringIO()
+    out.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+              '<gpx version="1.1" creator="bench" xmlns="http://www.topografix.com/GPX/1/1">\n'
+              '  <trk>\n    <name>Synthetic</name>\n    <trkseg>\n')
+    for i in range(n):
+        t = datetime.fromtimestamp(start + i, timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+        out.write(f'      <trkpt lat="{lat[i]:.7f}" lon="{lon[i]:.7f}">\n'
+                  f'        <ele>{ele[i]:.1f}</ele>\n        <time>{t}</time>\n      </trkpt>\n')
+    out.write('    </trkseg>\n  </trk>\n</gpx>\n')
+    return out.getvalue().encode('utf-8')
+
+
+def timed(fn, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        out = fn()
+        best = min(best, time.perf_counter() - t0)
+    return best, out
+
+
+def bench(name, gpx_bytes, repeat):
+    parse_time, track = timed(lambda: parse_track(io.BytesIO(gpx_bytes)), repeat)
+    print(f"\n{name}: {len(track)} points, GPX {len(gpx_bytes) / 1024:.0f} KiB, "
+          f"parsed in {parse_time * 1000:.1f} ms")
+    codecs = [("raw", RAW), ("zlib", ZLIB)]
+    if trackcodec.zstandard:
+        codecs.append(("zstd", ZSTD))
+    for label, codec in codecs:
+        enc_time, data = timed(lambda: encode_track(track, compression=codec), repeat)
+        dec_time, back = timed(lambda: decode_track(data), repeat)
+        error = np.nanmax(haversine(track.lat, track.lon, back.lat, back.lon)) if len(track) else 0.0
+        same = (np.array_equal(track.segment, back.segment)
+                and np.allclose(track.ele, back.ele, atol=0.005, equal_nan=True)
+                and np.allclose(track.time, back.time, atol=0.0005, equal_nan=True))
+        print(f"  {label:5s} {len(data) / 1024:8.1f} KiB  x{len(gpx_bytes) / len(data):5.1f}  "
+              f"encode {enc_time * 1000:6.1f} ms  decode {dec_time * 1000:6.2f} ms  "
+              f"max error {error * 100:.2f} cm{'' if same else '  MISMATCH'}")
+
+
+def main():
+    p = argparse.ArgumentParser(description="Benchmark the binary track format")
+    p.add_argument("files", nargs="*", help="GPX files to encode")
+    p.add_argument("--points", type=int, default=100000, help="points in the synthetic track")
+    p.add_argument("--repeat", type=int, default=5)
+    args = p.parse_args()
+
+    print(f"zstandard: {'yes' if trackcodec.zstandard else 'no'}")
+    for path in args.files:
+        with open(path, 'rb') as f:
+            bench(path, f.read(), args.repeat)
+    if args.points:
+        bench("synthetic", synthetic_gpx(args.points), args.repeat)
+
+
+if __name__ == "__main__":
+    main()
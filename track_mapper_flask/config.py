@@ -17,8 +17,29 @@ else:
     SQLALCHEMY_DATABASE_URI = "postgresql://localhost:5432/trackmapper"
 
 SQLALCHEMY_TRACK_MODIFICATIONS = False
+
+# Auth: tokens are signed with SECRET_KEY, which must be the same on every
+# worker. create_app refuses to start without it unless in debug mode
+# (FLASK_DEBUG) or TESTING, where a fixed development key is used. Legacy
+# 'token-<uuid>' tokens are accepted until LEGACY_TOKENS_ACCEPTED is
+# turned off.
+SECRET_KEY = os.environ.get('SECRET_KEY')
+TESTING = os.environ.get('TESTING', 'false').lower() == 'true'
+AUTH_TOKEN_MAX_AGE = int(os.environ.get('AUTH_TOKEN_MAX_AGE', 30 * 24 * 3600))
+LEGACY_TOKENS_ACCEPTED = os.environ.get('LEGACY_TOKENS_ACCEPTED', 'true').lower() == 'true'
+# authenticated users are cached per worker for this many seconds (0 disables)
+AUTH_USER_CACHE_TTL = int(os.environ.get('AUTH_USER_CACHE_TTL', 60))
+AUTH_USER_CACHE_SIZE = int(os.environ.get('AUTH_USER_CACHE_SIZE', 10000))
 UPLOAD_FOLDER = os.path.join(BASE_DIR, 'app', 'uploads')
 
+# LOCAL file serving. LOCAL_SENDFILE_MODE hands file bodies to the front
+# server: 'x-sendfile' (Apache/lighttpd) or 'x-accel-redirect' (nginx, which
+# must expose UPLOAD_FOLDER as an internal location at LOCAL_ACCEL_PREFIX).
+LOCAL_SENDFILE_MODE = os.environ.get('LOCAL_SENDFILE_MODE', '').lower()
+LOCAL_ACCEL_PREFIX = os.environ.get('LOCAL_ACCEL_PREFIX', '/protected-uploads/')
+LOCAL_FILE_MAX_AGE = int(os.environ.get('LOCAL_FILE_MAX_AGE', 0))
+USE_X_SENDFILE = LOCAL_SENDFILE_MODE == 'x-sendfile'
+
 # Storage Configuration
 FILE_STORE_LOCATION = os.environ.get('FILE_STORE_LOCATION', 'LOCAL')
 S3_BUCKET = os.environ.get('S3_BUCKET')
@@ -26,3 +47,77 @@ S3_ACCESS_KEY = os.environ.get('S3_ACCESS_KEY')
 S3_SECRET_KEY = os.environ.get('S3_SECRET_KEY')
 S3_REGION = os.environ.get('S3_REGION', 'us-east-1')
 S3_ENDPOINT_URL = os.environ.get('S3_ENDPOINT_URL') # Optional for R2/other S3-compatible
+# threads writing files for multi-file requests (activities/batch_upload)
+STORAGE_UPLOAD_CONCURRENCY = int(os.environ.get('STORAGE_UPLOAD_CONCURRENCY', 8))
+BATCH_UPLOAD_MAX_ITEMS = int(os.environ.get('BATCH_UPLOAD_MAX_ITEMS', 100))
+# storage_worker.py: first retry delay for a failed delete, doubling per
+# attempt up to the max (seconds)
+DELETION_RETRY_BASE = int(os.environ.get('DELETION_RETRY_BASE', 30))
+DELETION_RETRY_MAX = int(os.environ.get('DELETION_RETRY_MAX', 3600))
+# S3 client tuning: the client is shared per worker process
+S3_MAX_POOL_CONNECTIONS = int(os.environ.get('S3_MAX_POOL_CONNECTIONS', 10))
+S3_MAX_ATTEMPTS = int(os.environ.get('S3_MAX_ATTEMPTS', 5))
+S3_CONNECT_TIMEOUT = float(os.environ.get('S3_CONNECT_TIMEOUT', 5))
+S3_READ_TIMEOUT = float(os.environ.get('S3_READ_TIMEOUT', 60))
+S3_MULTIPART_THRESHOLD = int(os.environ.get('S3_MULTIPART_THRESHOLD', 8 * 1024 * 1024))
+S3_MULTIPART_CHUNKSIZE = int(os.environ.get('S3_MULTIPART_CHUNKSIZE', 8 * 1024 * 1024))
+S3_MAX_CONCURRENCY = int(os.environ.get('S3_MAX_CONCURRENCY', 4))
+# presigned download URLs are reused until less than MIN_REMAINING seconds are left
+S3_PRESIGN_EXPIRES = int(os.environ.get('S3_PRESIGN_EXPIRES', 3600))
+S3_PRESIGN_MIN_REMAINING = int(os.environ.get('S3_PRESIGN_MIN_REMAINING', 300))
+S3_PRESIGN_CACHE_SIZE = int(os.environ.get('S3_PRESIGN_CACHE_SIZE', 10000))
+
+# Spline cache: fitted splines kept in memory per worker, and optionally
+# persisted next to each points file so cold workers skip the solve
+SPLINE_CACHE_SIZE = int(os.environ.get('SPLINE_CACHE_SIZE', 256))
+SPLINE_PERSIST = os.environ.get('SPLINE_PERSIST', 'true').lower() == 'true'
+
+# Background jobs (app/jobs.py, worker.py): attempts before a job is marked
+# failed, retry delay doubling from the base up to the max, and how long a
+# claimed job may run before another worker takes it over (seconds).
+# JOBS_INLINE runs jobs in the request process instead (development).
+JOB_MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS', 5))
+JOB_RETRY_BASE = int(os.environ.get('JOB_RETRY_BASE', 10))
+JOB_RETRY_MAX = int(os.environ.get('JOB_RETRY_MAX', 3600))
+JOB_LEASE = int(os.environ.get('JOB_LEASE', 600))
+JOBS_INLINE = os.environ.get('JOBS_INLINE', 'false').lower() == 'true'
+
+# GPX processing (app/gpx.py): steps slower than this (m/s) are not
+# counted as moving time
+GPX_MOVING_SPEED = float(os.environ.get('GPX_MOVING_SPEED', 0.5))
+# tolerances in meters of the simplified tracks stored per activity
+# (app/tracks.py), comma-separated
+TRACK_LOD_TOLERANCES = [float(t) for t in os.environ.get('TRACK_LOD_TOLERANCES', '2,10,50').split(',')]
+
+# Activity-to-map matching (app/matching.py): whether processing attaches
+# a map to activities uploaded without one, and the least fraction of the
+# track's bounding box the map's extent must cover
+ACTIVITY_AUTO_MATCH = os.environ.get('ACTIVITY_AUTO_MATCH', 'true').lower() == 'true'
+ACTIVITY_MATCH_MIN_COVERAGE = float(os.environ.get('ACTIVITY_MATCH_MIN_COVERAGE', 0.5))
+
+# Viewport queries (app/clustering.py): zoom from which /maps/in_bbox
+# lists maps instead of clusters, the most maps it lists before falling
+# back to clusters, and the most cells it reads per request
+MAP_CLUSTER_MAX_ZOOM = int(os.environ.get('MAP_CLUSTER_MAX_ZOOM', 12))
+MAP_BBOX_MAX_MAPS = int(os.environ.get('MAP_BBOX_MAX_MAPS', 500))
+MAP_CLUSTER_MAX_CELLS = int(os.environ.get('MAP_CLUSTER_MAX_CELLS', 1024))
+
+# Friends feed (app/timeline.py): entries kept per reader, and the friend
+# count above which a reader is served by read-time fan-in instead
+TIMELINE_MAX_LENGTH = int(os.environ.get('TIMELINE_MAX_LENGTH', 800))
+TIMELINE_FANIN_THRESHOLD = int(os.environ.get('TIMELINE_FANIN_THRESHOLD', 500))
+
+# Serialized bodies of per-user GET endpoints kept per worker, keyed by
+# the user's data_version ETag (app/caching.py); 0 disables
+RESPONSE_CACHE_SIZE = int(os.environ.get('RESPONSE_CACHE_SIZE', 1024))
+RESPONSE_CACHE_MAX_BODY = int(os.environ.get('RESPONSE_CACHE_MAX_BODY', 256 * 1024))
+
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+# GET /metrics (Prometheus text format, see app/metrics.py)
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'true').lower() == 'true'
+
+# Query instrumentation (app/instrumentation.py): X-Query-Count/X-Query-Time
+# response headers outside debug mode, and a log warning for requests that
+# issue at least QUERY_COUNT_WARN queries (0 disables)
+QUERY_STATS_HEADERS = os.environ.get('QUERY_STATS_HEADERS', 'false').lower() == 'true'
+QUERY_COUNT_WARN = int(os.environ.get('QUERY_COUNT_WARN', 50))
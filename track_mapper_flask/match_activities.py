@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Fill in map extents and attach maps to activities (app/matching.py).
+
+First computes the extent of every map that has none from its control points,
+then matches each processed activity that has no map against the extent
+index, one UPDATE per batch. Activities that already have a map are left
+alone; run backfill_activity_stats.py first so older activities have a
+bounding box.
+
+Usage:
+  python match_activities.py                        # extents, then activities
+  python match_activities.py --min-coverage 0.8     # stricter than ACTIVITY_MATCH_MIN_COVERAGE
+  python match_activities.py --extents-only
+"""
+import argparse
+from app import create_app
+from app.extensions import db
+from app.models import Map
+from app.matching import set_map_extent, maps_without_extent, match_batch
+from app.spline_cache import load_map_points
+from app.caching import bump_data_version
+
+
+def fill_extents(batch_size):
+    done = missing = 0
+    after_id = None
+    while True:
+        ids = maps_without_extent(batch_size, after_id)
+        if not ids:
+            break
+        after_id = ids[-1]
+        owners = set()
+        for m in Map.query.filter(Map.id.in_(ids)):
+            points, _ = load_map_points(m.id)
+            if points is not None:
+                set_map_extent(m, points)
+            if m.min_lat is None:
+                missing += 1
+            else:
+                done += 1
+                owners.add(m.user_id)
+        # the extent is part of the owner's cached /users/<id>/maps
+        for user_id in owners:
+            bump_data_version(user_id)
+        db.session.commit()
+        print(f"extents: {done} computed, {missing} without usable points")
+    return done
+
+
+def match(batch_size, min_coverage):
+    scanned = 0
+    matched = []
+    after_id = None
+    while True:
+        ids, rows = match_batch(after_id, batch_size, min_coverage)
+        if not ids:
+            break
+        for user_id in {user_id for _, user_id, _ in rows}:
+            bump_data_version(user_id)
+        db.session.commit()
+        after_id = ids[-1]
+        scanned += len(ids)
+        matched += rows
+        print(f"[{scanned}] scanned, {len(matched)} matched")
+    return matched
+
+
+def run(batch_size=1000, min_coverage=None, extents_only=False):
+    app = create_app()
+    with app.app_context():
+        extents = fill_extents(batch_size)
+        if extents_only:
+            print(f"✅ Computed {extents} map extents")
+            return
+        matched = match(batch_size, min_coverage)
+        print(f"✅ Computed {extents} map extents and attached maps to {len(matched)} activities")
+
+
+def main():
+    p = argparse.ArgumentParser(description="Match activities to the maps they overlap")
+    p.add_argument("--batch-size", type=int, default=1000)
+    p.add_argument("--min-coverage", type=float,
+                   help="least fraction of the track's bounding box a map must cover "
+                        "(default ACTIVITY_MATCH_MIN_COVERAGE)")
+    p.add_argument("--extents-only", action="store_true", help="only fill in map extents")
+    args = p.parse_args()
+    run(batch_size=args.batch_size, min_coverage=args.min_coverage, extents_only=args.extents_only)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,33 @@
+#!/usr/bin/env python3
+"""
+Rebuild the map clusters (MapCell, app/clustering.py) from Map rows.
+
+Run after deploying the map_cell table, after seeding or migrating data,
+and after adding or deleting maps outside the API.
+
+Usage:
+  python rebuild_map_cells.py
+"""
+import argparse
+from app import create_app
+from app.extensions import db
+from app.models import Map, MapCell
+from app.clustering import rebuild_map_cells
+
+
+def rebuild():
+    app = create_app()
+    with app.app_context():
+        print(f"Rebuilding map cells for {Map.query.count()} maps")
+        rebuild_map_cells()
+        db.session.commit()
+        print(f"✅ Rebuilt {MapCell.query.count()} map cells")
+
+
+def main():
+    argparse.ArgumentParser(description="Rebuild the map clusters served by /maps/in_bbox").parse_args()
+    rebuild()
+
+
+if __name__ == "__main__":
+    main()
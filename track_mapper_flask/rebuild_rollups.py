@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+"""
+Rebuild per-user activity rollups (app/rollups.py) from Activity rows.
+
+Run after deploying the activity_rollup table, after seeding or migrating
+data, and after editing activities outside the API.
+
+Usage:
+  python rebuild_rollups.py                  # every user
+  python rebuild_rollups.py --user-id <uuid> # a single user
+"""
+import argparse
+import uuid
+from app import create_app
+from app.extensions import db
+from app.models import User
+from app.rollups import rebuild_rollups
+from app.caching import bump_data_version
+
+
+def rebuild(user_id=None):
+    app = create_app()
+    with app.app_context():
+        q = User.query.with_entities(User.id)
+        if user_id:
+            q = q.filter(User.id == user_id)
+        ids = [u_id for (u_id,) in q.order_by(User.id).all()]
+        print(f"Rebuilding rollups for {len(ids)} users")
+
+        for i, u_id in enumerate(ids, 1):
+            rebuild_rollups(u_id)
+            bump_data_version(u_id)
+            db.session.commit()
+            if i % 100 == 0 or i == len(ids):
+                print(f"[{i}/{len(ids)}] rebuilt")
+
+        print(f"✅ Rebuilt rollups for {len(ids)} users")
+
+
+def main():
+    p = argparse.ArgumentParser(description="Rebuild per-user activity rollups")
+    p.add_argument("--user-id", type=uuid.UUID, help="only rebuild this user's rollups")
+    args = p.parse_args()
+    rebuild(user_id=args.user_id)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,11 @@
 # run.py
+import os
 from app import create_app
 
+if __name__ == '__main__':
+    # the development server runs in debug mode, which needs no SECRET_KEY
+    os.environ.setdefault('FLASK_DEBUG', '1')
+
 app = create_app()
 
 if __name__ == '__main__':
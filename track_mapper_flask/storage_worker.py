@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Storage cleanup worker (app/deletion_queue.py).
+
+  drain:     removes the objects queued by map and activity deletes, in
+             batches, retrying failures with backoff. Several can run at
+             once. Polls forever unless --once is given.
+  reconcile: lists images/, points/, activities/, tracks/, tiles/,
+             thumbnails/ and blobs/ and reports objects nothing
+             references; --fix queues them for the next drain.
+
+Usage:
+  python storage_worker.py drain [--once] [--interval 5]
+  python storage_worker.py reconcile [--folder images ...] [--min-age-hours 24] [--fix]
+"""
+import argparse
+import time
+from datetime import timedelta
+
+from app import create_app
+from app.deletion_queue import drain_batch, reconcile, OWNERS
+
+
+def drain(once=False, interval=5.0, batch_size=1000):
+    app = create_app()
+    with app.app_context():
+        total = 0
+        while True:
+            deleted, failed = drain_batch(batch_size)
+            total += deleted
+            if deleted or failed:
+                print(f"deleted {deleted}, failed {failed}")
+            if deleted + failed == batch_size:
+                continue  # more may be due right away
+            if once:
+                break
+            time.sleep(interval)
+        print(f"✅ Deleted {total} queued objects")
+
+
+def run_reconcile(folders=None, min_age_hours=24.0, fix=False):
+    app = create_app()
+    with app.app_context():
+        orphans, names = reconcile(folders, timedelta(hours=min_age_hours), fix=fix)
+        for key in orphans:
+            print(f"orphaned object: {key}")
+        for path in names:
+            print(f"orphaned name:   {path}")
+        action = "queued for deletion" if fix else "found (run with --fix to queue them)"
+        print(f"✅ {len(orphans)} objects and {len(names)} names {action}")
+
+
+def main():
+    p = argparse.ArgumentParser(description="Drain and reconcile storage deletions")
+    sub = p.add_subparsers(dest="command", required=True)
+
+    d = sub.add_parser("drain", help="delete queued objects")
+    d.add_argument("--once", action="store_true", help="exit when nothing is due")
+    d.add_argument("--interval", type=float, default=5.0, help="seconds between polls")
+    d.add_argument("--batch-size", type=int, default=1000)
+
+    r = sub.add_parser("reconcile", help="find objects nothing references")
+    r.add_argument("--folder", action="append", choices=sorted(OWNERS) + ['blobs'],
+                   help="only scan this folder (repeatable)")
+    r.add_argument("--min-age-hours", type=float, default=24.0,
+                   help="ignore objects modified more recently than this")
+    r.add_argument("--fix", action="store_true", help="queue the orphans for deletion")
+
+    args = p.parse_args()
+    if args.command == "drain":
+        drain(once=args.once, interval=args.interval, batch_size=args.batch_size)
+    else:
+        run_reconcile(args.folder, args.min_age_hours, args.fix)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,7 @@
 from app.models import db, User, Map, Activity, friend
+from app.timeline import rebuild_timeline
+from app.rollups import rebuild_rollups
+from app.clustering import rebuild_map_cells
 from faker import Faker
 import random
 from sqlalchemy.exc import IntegrityError
@@ -158,6 +161,13 @@ def run():
     print("Creating activities...")
     create_activities(users, maps_by_user)
 
+    print("Building timelines, rollups and map clusters...")
+    for user in users:
+        rebuild_timeline(user.id)
+        rebuild_rollups(user.id)
+    rebuild_map_cells()
+    db.session.commit()
+
     print("✅ Done seeding the database.")
 
 if __name__ == "__main__":
@@ -0,0 +1,100 @@
+# track_mapper_flask/upgrade_db.py
+"""
+Bring an existing database up to date with the models.
+
+db.create_all() only creates missing tables, so columns and indexes added
+to existing tables are applied here, followed by any data backfills.
+Every step is idempotent; run it after each deploy:
+
+  python upgrade_db.py
+"""
+from sqlalchemy import text
+from app import create_app
+from app.extensions import db
+from app.models import Map
+from app.spatial import encode
+
+BATCH_SIZE = 1000
+
+STATEMENTS = [
+    # spatial index for /maps/nearest
+    "ALTER TABLE map ADD COLUMN IF NOT EXISTS geohash VARCHAR(12)",
+    "CREATE INDEX IF NOT EXISTS ix_map_geohash ON map (geohash)",
+    # tile pyramid
+    "ALTER TABLE map ADD COLUMN IF NOT EXISTS image_width INTEGER",
+    "ALTER TABLE map ADD COLUMN IF NOT EXISTS image_height INTEGER",
+    "ALTER TABLE map ADD COLUMN IF NOT EXISTS tile_max_zoom INTEGER",
+    # keyset pagination of the friends feed
+    "CREATE INDEX IF NOT EXISTS ix_activity_user_created ON activity (user_id, created_at, id)",
+    # materialized friends feed; existing users read via fan-in until
+    # rebuild_timelines.py has built their timeline
+    'ALTER TABLE "user" ADD COLUMN IF NOT EXISTS timeline_ready BOOLEAN NOT NULL DEFAULT false',
+    'ALTER TABLE "user" ADD COLUMN IF NOT EXISTS timeline_horizon TIMESTAMP WITH TIME ZONE',
+    # ETags of per-user endpoints
+    'ALTER TABLE "user" ADD COLUMN IF NOT EXISTS data_version INTEGER NOT NULL DEFAULT 0',
+    # stats computed from the GPX file; backfill_activity_stats.py fills old rows
+    "ALTER TABLE activity ADD COLUMN IF NOT EXISTS moving_time DOUBLE PRECISION",
+    "ALTER TABLE activity ADD COLUMN IF NOT EXISTS elevation_gain DOUBLE PRECISION",
+    "ALTER TABLE activity ADD COLUMN IF NOT EXISTS point_count INTEGER",
+    "ALTER TABLE activity ADD COLUMN IF NOT EXISTS min_lat DOUBLE PRECISION",
+    "ALTER TABLE activity ADD COLUMN IF NOT EXISTS min_lon DOUBLE PRECISION",
+    "ALTER TABLE activity ADD COLUMN IF NOT EXISTS max_lat DOUBLE PRECISION",
+    "ALTER TABLE activity ADD COLUMN IF NOT EXISTS max_lon DOUBLE PRECISION",
+    # simplified tracks; backfill_track_lods.py builds them for old rows
+    "ALTER TABLE activity ADD COLUMN IF NOT EXISTS track_lods JSON",
+    # binary tracks; backfill_track_lods.py encodes them for old rows
+    "ALTER TABLE activity ADD COLUMN IF NOT EXISTS track_size INTEGER",
+    # map extents for activity matching; match_activities.py fills old rows
+    "ALTER TABLE map ADD COLUMN IF NOT EXISTS min_lat DOUBLE PRECISION",
+    "ALTER TABLE map ADD COLUMN IF NOT EXISTS min_lon DOUBLE PRECISION",
+    "ALTER TABLE map ADD COLUMN IF NOT EXISTS max_lat DOUBLE PRECISION",
+    "ALTER TABLE map ADD COLUMN IF NOT EXISTS max_lon DOUBLE PRECISION",
+    "CREATE INDEX IF NOT EXISTS ix_map_extent ON map USING gist (box(point(min_lon, min_lat), point(max_lon, max_lat)))",
+    # control points on the row; backfill_map_points.py copies the old files
+    "ALTER TABLE map ADD COLUMN IF NOT EXISTS control_points JSONB",
+    "ALTER TABLE map ADD COLUMN IF NOT EXISTS points_digest VARCHAR(64)",
+]
+
+
+def backfill_geohash():
+    total = 0
+    last_id = None
+    while True:
+        q = Map.query.filter(Map.geohash.is_(None))
+        if last_id is not None:
+            q = q.filter(Map.id > last_id)
+        maps = q.order_by(Map.id).limit(BATCH_SIZE).all()
+        if not maps:
+            break
+        last_id = maps[-1].id
+
+        # rows missing a coordinate stay NULL and are always treated as
+        # candidates by nearest_maps
+        updates = [
+            {'id': m.id, 'geohash': encode(m.latitude, m.longitude)}
+            for m in maps
+        ]
+        updates = [u for u in updates if u['geohash'] is not None]
+        if updates:
+            db.session.execute(
+                text("UPDATE map SET geohash = :geohash WHERE id = :id"), updates
+            )
+        db.session.commit()
+        total += len(updates)
+    print(f"Backfilled geohash for {total} maps")
+
+
+def upgrade():
+    app = create_app()
+    with app.app_context():
+        for stmt in STATEMENTS:
+            print(stmt)
+            db.session.execute(text(stmt))
+        db.session.commit()
+
+        backfill_geohash()
+        print("✅ Database is up to date.")
+
+
+if __name__ == "__main__":
+    upgrade()
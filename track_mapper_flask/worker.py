@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Background job worker (app/jobs.py).
+
+Claims due jobs and runs them in a pool of processes, each with its own
+app and database connections. Run one or more next to the web service;
+they coordinate through the job table.
+
+Usage:
+  python worker.py [--processes N] [--interval 2]
+  python worker.py --once     # run everything that is due, then exit
+"""
+import argparse
+import os
+import time
+import logging
+from multiprocessing import get_context
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+
+from app import create_app
+from app.jobs import claim, init_process, run_in_process
+
+logger = logging.getLogger('worker')
+
+
+def _pool(processes):
+    ctx = get_context('spawn')  # children build their own engine instead of sharing sockets
+    return ProcessPoolExecutor(processes, mp_context=ctx, initializer=init_process)
+
+
+def work(processes=2, interval=2.0, once=False):
+    app = create_app()
+    done_total = failed_total = 0
+    pool = _pool(processes)
+
+    def submit(job):
+        nonlocal pool
+        try:
+            return pool.submit(run_in_process, *job)
+        except BrokenProcessPool:
+            # a process died (e.g. killed for memory) and took the pool down
+            logger.warning("Process pool broken, starting a new one")
+            pool.shutdown(wait=False)
+            pool = _pool(processes)
+            return pool.submit(run_in_process, *job)
+
+    with app.app_context():
+        running = set()
+        while True:
+            free = processes - len(running)
+            if free:
+                for job in claim(free):
+                    logger.info("Running job %s (%s)", job[0], job[1])
+                    running.add(submit(job))
+            if not running:
+                if once:
+                    break
+                time.sleep(interval)
+                continue
+            finished, running = wait(running, timeout=interval, return_when=FIRST_COMPLETED)
+            for future in finished:
+                try:
+                    ok = future.result()
+                except Exception:
+                    # a crashed process: the job is retried once its lease runs out
+                    logger.exception("Job process failed")
+                    ok = False
+                done_total += ok
+                failed_total += not ok
+    pool.shutdown()
+    print(f"✅ {done_total} jobs succeeded, {failed_total} failed")
+
+
+def main():
+    p = argparse.ArgumentParser(description="Run background jobs")
+    p.add_argument("--processes", type=int, default=os.cpu_count() or 2,
+                   help="jobs run at once (default: CPU count)")
+    p.add_argument("--interval", type=float, default=2.0, help="seconds between polls when idle")
+    p.add_argument("--once", action="store_true", help="exit when no job is due")
+    args = p.parse_args()
+    work(processes=args.processes, interval=args.interval, once=args.once)
+
+
+if __name__ == "__main__":
+    main()